@@ -0,0 +1,160 @@
+# adaptive.py
+# Adaptive ordering of the operands of AND/OR chains in compiled rules.
+import time
+from .utils import is_number, to_bool
+
+# What a variable must hold for an operand to be safe to evaluate out of order, from weakest to strongest
+ANY, SCALAR, NUMBER = 0, 1, 2
+
+JSON_TYPES = (str, int, float, bool, list, dict)
+
+
+def _floats(value):
+    try:
+        float(value)
+    except (TypeError, ValueError, OverflowError):
+        return False
+    return True
+
+_CHECKS = {
+    ANY: lambda value: isinstance(value, JSON_TYPES),
+    SCALAR: lambda value: type(value) is str or _floats(value),
+    NUMBER: _floats,
+}
+
+
+def guard_requirements(node, kind=ANY, requirements=None):
+    """
+    Works out what the variables of a subtree must hold for it to never raise and never
+    return None, which is what makes it safe to evaluate in any order.
+
+    Args:
+        node (Node): The root of the subtree.
+        kind (int): How the value of the subtree is used by its parent, ANY, SCALAR or NUMBER.
+        requirements (dict, optional): Variable name to requirement mapping to extend.
+
+    Returns:
+        dict or None: The requirement of every variable, None if the subtree can raise
+        or return None whatever the variables hold (/, %, unsupported operators or
+        non-numeric literals used as numbers).
+    """
+    if requirements is None:
+        requirements = {}
+
+    if node.node_type == 'literal':
+        if kind == NUMBER and not is_number(node.value):
+            return None
+        return requirements
+
+    if node.node_type == 'variable':
+        requirements[node.value] = max(kind, requirements.get(node.value, ANY))
+        return requirements
+
+    if node.value in ('AND', 'OR', 'XOR'):
+        child_kind = ANY
+    elif node.value in ('>', '<', '>=', '<=', '+', '-', '*'):
+        child_kind = NUMBER
+    elif node.value in ('=', '==', '!='):
+        child_kind = SCALAR
+    else:
+        return None
+
+    if guard_requirements(node.left, child_kind, requirements) is None:
+        return None
+    return guard_requirements(node.right, child_kind, requirements)
+
+
+class AdaptiveRun:
+    """
+    A run of consecutive operands of an AND/OR chain that are evaluated cheapest and most
+    decisive first.
+
+    When a record satisfies the requirements of every operand, none of them can raise or
+    return None, so the outcome of the run no longer depends on the order its operands are
+    evaluated in. Every sample_rate-th such record is timed and counted per operand, and
+    every reorder_interval samples the operands are sorted by their average cost divided by
+    the rate at which they decide the run. Any other record is evaluated in the written order.
+    """
+
+    def __init__(self, operator, operands, requirements, fallback, sample_rate=16, reorder_interval=64):
+        self.operator = operator
+        self.operands = operands
+        self.sample_rate = sample_rate
+        self.reorder_interval = reorder_interval
+        self._checks = [(name, _CHECKS[kind]) for name, kind in requirements.items()]
+        self._fallback = fallback
+        # An AND run is decided by the first false operand, an OR run by the first true one
+        self._decisive = operator == 'OR'
+
+        self.order = tuple(range(len(operands)))
+        self._ordered = tuple(operands)
+        self.calls = 0
+        self.samples = 0
+        self.evaluated = [0] * len(operands)
+        self.decided = [0] * len(operands)
+        self.cost = [0.0] * len(operands)
+
+    def __call__(self, data):
+        for name, check in self._checks:
+            value = data.get(name, None)
+            if value is None or not check(value):
+                return self._fallback(data)
+
+        self.calls += 1
+        if self.calls % self.sample_rate == 0:
+            return self._sampled(data)
+
+        decisive = self._decisive
+        for operand in self._ordered:
+            if to_bool(operand(data)) is decisive:
+                return decisive
+        return not decisive
+
+    def _sampled(self, data):
+        decisive = self._decisive
+        result = not decisive
+        for position in self.order:
+            start = time.perf_counter()
+            value = to_bool(self.operands[position](data))
+            self.cost[position] += time.perf_counter() - start
+            self.evaluated[position] += 1
+            if value is decisive:
+                self.decided[position] += 1
+                result = decisive
+                break
+
+        self.samples += 1
+        if self.samples % self.reorder_interval == 0:
+            self.reorder()
+        return result
+
+    def reorder(self):
+        measured = [self.cost[i] / self.evaluated[i] for i in range(len(self.operands)) if self.evaluated[i]]
+        default_cost = sum(measured) / len(measured) if measured else 0.0
+
+        def score(position):
+            evaluated = self.evaluated[position]
+            cost = self.cost[position] / evaluated if evaluated else default_cost
+            # Smoothed, so operands that were rarely reached are neither favoured nor buried
+            return cost * (evaluated + 2) / (self.decided[position] + 1)
+
+        order = tuple(sorted(self.order, key=score))
+        self._ordered = tuple(self.operands[position] for position in order)
+        self.order = order
+
+        # Older observations count for half, so the order follows shifts in the traffic
+        for position in range(len(self.operands)):
+            self.evaluated[position] //= 2
+            self.decided[position] //= 2
+            self.cost[position] /= 2
+
+    def stats(self):
+        return [
+            {
+                'position': position,
+                'evaluated': self.evaluated[position],
+                'decided': self.decided[position],
+                'cost': self.cost[position],
+            }
+            for position in self.order
+        ]
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
+from django.db.models.signals import post_delete
 
 
 class RuleitConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ruleit'
+
+    def ready(self):
+        from .invalidation import start_listener, rule_deleted
+        request_started.connect(start_listener, dispatch_uid='ruleit_start_listener')
+        post_delete.connect(rule_deleted, sender=self.get_model('Rule'), dispatch_uid='ruleit_rule_deleted')
@@ -0,0 +1,196 @@
+# cache.py
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+
+
+class RuleCache:
+    """
+    A thread-safe, per-process LRU cache of prepared rules keyed by (rule_id, version).
+
+    It also remembers the latest known version of every cached rule and the id behind
+    every cached rule name, so a lookup by id or name does not need the database.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._names = {}
+        self._rule_names = {}
+        self._lock = threading.Lock()
+
+    def get(self, rule_id=None, rule_name=None, version=None):
+        """
+        Returns the cached value for a rule, or None on a miss.
+        Without a version the latest known version of the rule is used.
+        """
+        with self._lock:
+            if rule_id is None:
+                rule_id = self._names.get(rule_name)
+            if version is None:
+                version = self._versions.get(rule_id)
+            key = (rule_id, version)
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, rule_id, version, value, rule_name=None, current=True):
+        """
+        Caches a value for a version of a rule. Values of pinned earlier versions are put with
+        current=False, so lookups without a version never return them.
+        """
+        with self._lock:
+            key = (rule_id, version)
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if current and version >= self._versions.get(rule_id, 0):
+                self._versions[rule_id] = version
+            if current and rule_name:
+                self._names[rule_name] = rule_id
+                self._rule_names[rule_id] = rule_name
+
+            while len(self._entries) > self.max_size:
+                (old_id, old_version), _ = self._entries.popitem(last=False)
+                if self._versions.get(old_id) == old_version:
+                    self._forget(old_id)
+
+    def invalidate(self, rule_id=None, rule_name=None):
+        """
+        Drops every cached version of a rule. A rule name alone is enough to drop the
+        name mapping, which is what a newly created rule needs.
+        """
+        with self._lock:
+            if rule_id is None:
+                rule_id = self._names.pop(rule_name, None)
+            for key in [key for key in self._entries if key[0] == rule_id]:
+                del self._entries[key]
+            self._forget(rule_id)
+
+    def versions(self):
+        """
+        Returns the latest known version of every cached rule.
+        """
+        with self._lock:
+            return dict(self._versions)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._names.clear()
+            self._rule_names.clear()
+
+    def _forget(self, rule_id):
+        self._versions.pop(rule_id, None)
+        rule_name = self._rule_names.pop(rule_id, None)
+        if rule_name is not None:
+            self._names.pop(rule_name, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LRUCache:
+    """
+    A minimal thread-safe LRU mapping for prepared objects that are not tied to a single rule.
+    """
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ResultCache:
+    """
+    A thread-safe LRU cache of evaluation results with a time to live, keyed by
+    (rule_id, version, input_key). It counts its hits and misses.
+    """
+
+    # Returned by get on a miss, since None is a valid result
+    MISSING = object()
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (self.ttl and entry[0] < time.monotonic()):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return self.MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self.ttl or 0), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, rule_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == rule_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Compiled evaluators of the rules used by this process
+compiled_rules = RuleCache(getattr(settings, 'RULEIT_COMPILED_RULE_CACHE_SIZE', 1024))
+
+# Tokens and optimized postfix tokens of rule strings, keyed by the stripped rule string
+parsed_rules = LRUCache(getattr(settings, 'RULEIT_PARSE_CACHE_SIZE', 4096))
+
+# Merged DAGs of rule sets, keyed by the (rule_id, version) pairs they were built from
+merged_rule_sets = LRUCache(getattr(settings, 'RULEIT_MERGED_RULE_SET_CACHE_SIZE', 32))
+
+# Results of /api/evaluate-rule/ when RULEIT_RESULT_CACHE is on
+evaluation_results = ResultCache(
+    getattr(settings, 'RULEIT_RESULT_CACHE_SIZE', 10000),
+    getattr(settings, 'RULEIT_RESULT_CACHE_TTL', 300)
+)
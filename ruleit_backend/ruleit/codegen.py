@@ -0,0 +1,188 @@
+# codegen.py
+# Generates Python source for a rule AST and compiles it into a native function.
+#
+# The source is assembled only from the fixed templates below, generated temporary names and
+# indexes into a constants pool. Literal values, variable names and operator names never appear
+# in it, they are read from the pool at runtime, so no rule can inject code.
+from .utils import is_number, to_bool, to_float
+from .compiler import _eq, _ne, _div, _mod
+
+ORDERING_OPERATORS = {'>', '<', '>=', '<='}
+ARITHMETIC_OPERATORS = {'+', '-', '*'}
+# Operators whose result is already True, False or None
+BOOLEAN_OPERATORS = ORDERING_OPERATORS | {'=', '==', '!=', 'AND', 'OR', 'XOR'}
+
+
+def _unsupported(message):
+    raise NotImplementedError(message)
+
+def _unknown():
+    raise Exception("unknown error occurred.")
+
+# The only names the generated code can reach, builtins included
+NAMESPACE = {
+    '_f': to_float,
+    '_b': to_bool,
+    '_float': float,
+    '_str': str,
+    '_type': type,
+    '_numbers': (float, int, bool),
+    '_isnum': is_number,
+    '_eq': _eq,
+    '_ne': _ne,
+    '_div': _div,
+    '_mod': _mod,
+    '_unsupported': _unsupported,
+    '_unknown': _unknown,
+}
+
+
+class SourceGenerator:
+    """
+    Turns a rule AST into the source of `def evaluate(data)` with the same results as evaluate_rule.
+
+    Every operator node becomes one inlined expression: None checks and short-circuits are
+    conditional expressions, comparisons and arithmetic are plain Python operators and numeric
+    literals are converted to floats once, here.
+    """
+
+    def __init__(self):
+        self.constants = []
+        self._constant_index = {}
+        self._temporaries = 0
+
+    def constant(self, value):
+        key = (type(value), value)
+        if key not in self._constant_index:
+            self._constant_index[key] = len(self.constants)
+            self.constants.append(value)
+        return f"_c[{self._constant_index[key]}]"
+
+    def generate(self, ast_root):
+        return f"def evaluate(data):\n    return {self.expression(ast_root)}\n"
+
+    def expression(self, node):
+        if node is None:
+            raise RuntimeError("Invalid tree structure.")
+
+        if node.node_type == 'literal':
+            return self.constant(node.value)
+        if node.node_type == 'variable':
+            return f"data.get({self.constant(node.value)}, None)"
+        if node.node_type != 'operator':
+            return "_unknown()"
+
+        self._temporaries += 1
+        left, right = f"l{self._temporaries}", f"r{self._temporaries}"
+        operator = node.value
+
+        if operator == 'AND':
+            return (
+                f"(None if ({left} := {self.expression(node.left)}) is None"
+                f" else False if not {self.boolean(node.left, left)}"
+                f" else None if ({right} := {self.expression(node.right)}) is None"
+                f" else {self.boolean(node.right, right)})"
+            )
+        if operator == 'OR':
+            return (
+                f"(None if ({left} := {self.expression(node.left)}) is None"
+                f" else True if {self.boolean(node.left, left)}"
+                f" else None if ({right} := {self.expression(node.right)}) is None"
+                f" else {self.boolean(node.right, right)})"
+            )
+
+        # Both operands are evaluated before either is checked for None, literals never are None
+        checks = []
+        operands = []
+        for child, name in ((node.left, left), (node.right, right)):
+            if child is not None and child.node_type == 'literal':
+                operands.append(self.constant(child.value))
+            else:
+                checks.append(f"(({name} := {self.expression(child)}) is None)")
+                operands.append(name)
+
+        value = self.operation(operator, node.left, node.right, *operands)
+        if not checks:
+            return value
+        return f"(None if {' | '.join(checks)} else {value})"
+
+    def boolean(self, node, operand):
+        # to_bool is only needed for values that are not booleans already
+        if node.node_type == 'operator' and node.value in BOOLEAN_OPERATORS:
+            return operand
+        return f"_b({operand})"
+
+    def number(self, node, operand):
+        # Numeric literals are converted once, numbers with float() and anything else with to_float
+        if node.node_type == 'literal':
+            if is_number(node.value):
+                return self.constant(float(node.value))
+            return f"_f({operand})"
+        return f"(_float({operand}) if _type({operand}) in _numbers else _f({operand}))"
+
+    def operation(self, operator, left_node, right_node, left, right):
+        if operator in ORDERING_OPERATORS or operator in ARITHMETIC_OPERATORS:
+            return f"({self.number(left_node, left)} {operator} {self.number(right_node, right)})"
+        if operator == '/':
+            return f"_div({left}, {right})"
+        if operator == '%':
+            return f"_mod({left}, {right})"
+        if operator == 'XOR':
+            return f"({self.boolean(left_node, left)} != {self.boolean(right_node, right)})"
+
+        if operator in ('=', '==', '!='):
+            negate = operator == '!='
+            compare = '!=' if negate else '=='
+            left_literal = left_node.node_type == 'literal'
+            right_literal = right_node.node_type == 'literal'
+
+            if left_literal != right_literal:
+                literal_node, literal, operand = (left_node, left, right) if left_literal else (right_node, right, left)
+                if is_number(literal_node.value):
+                    number = self.constant(float(literal_node.value))
+                    numeric = f"_type({operand}) in _numbers or _isnum({operand})"
+                    if left_literal:
+                        return f"({number} {compare} _float({operand}) if {numeric} else {literal} {compare} {operand})"
+                    return f"(_float({operand}) {compare} {number} if {numeric} else {operand} {compare} {literal})"
+                if left_literal:
+                    # A literal that is not a number is compared as it is without checking the other operand
+                    return f"({literal} {compare} {operand})"
+                # Strings are compared as they are, the generic operator is only needed for other types
+                return f"({operand} {compare} {literal} if _type({operand}) is _str else {'_ne' if negate else '_eq'}({operand}, {literal}))"
+
+            return f"{'_ne' if negate else '_eq'}({left}, {right})"
+
+        message = self.constant(f"Unsupported operator '{operator}' encountered.")
+        return f"_unsupported({message})"
+
+
+def generate_source(ast_root):
+    """
+    Generates the source of a rule.
+
+    Returns:
+        tuple: The source of `def evaluate(data)` and the constants pool it reads as `_c`.
+    """
+    generator = SourceGenerator()
+    source = generator.generate(ast_root)
+    return source, tuple(generator.constants)
+
+def compile_native(ast_root, filename='<rule>'):
+    """
+    Compiles a rule AST into a native Python function taking the data dictionary and returning
+    the result evaluate_rule would return for it.
+
+    Returns:
+        function or None: The function, None if the rule is nested too deeply for the Python compiler.
+    """
+    try:
+        source, constants = generate_source(ast_root)
+        code = compile(source, filename, 'exec')
+    except (RecursionError, SyntaxError, MemoryError):
+        return None
+
+    namespace = dict(NAMESPACE, _c=constants, __builtins__={})
+    exec(code, namespace)
+    evaluate = namespace['evaluate']
+    evaluate.source = source
+    return evaluate
@@ -0,0 +1,108 @@
+# collector.py
+# Garbage collection of the nodes no rule can reach anymore.
+#
+# Edits point a rule at a new tree and subtrees are shared across rules, so old nodes are never
+# deleted in place. The collector finds and deletes them in batches instead.
+import time
+from django.db import connection, transaction
+from .models import Node, Rule, RuleVersion
+
+# Advisory lock serializing the collector with the transactions that save nodes
+NODE_LOCK_ID = 0x72756c65
+
+
+def lock_nodes(shared=True):
+    """
+    Takes the node advisory lock until the end of the current transaction.
+
+    Writers take it shared, so they never wait for each other. The collector takes it
+    exclusively, so it never deletes a stored node a writer is about to reuse.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT pg_advisory_xact_lock{'_shared' if shared else ''}(%s)", [NODE_LOCK_ID])
+
+
+def _root_ids_query():
+    # Every node a rule or a retained rule version points at directly
+    return (
+        f"SELECT rule_root_id FROM {Rule._meta.db_table}"
+        f" UNION SELECT rule_root_id FROM {RuleVersion._meta.db_table}"
+    )
+
+
+def count_orphaned_nodes():
+    """
+    Counts the nodes that are not reachable from any rule or rule version.
+    """
+    table = Node._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            WITH RECURSIVE reachable AS (
+                SELECT n.id, n.left_id, n.right_id FROM {table} n WHERE n.id IN ({_root_ids_query()})
+                UNION
+                SELECT c.id, c.left_id, c.right_id FROM {table} c JOIN reachable r ON c.id = r.left_id OR c.id = r.right_id
+            )
+            SELECT (SELECT COUNT(*) FROM {table}) - (SELECT COUNT(*) FROM reachable)
+        """)
+        return cursor.fetchone()[0]
+
+
+def prune_versions(keep):
+    """
+    Deletes all but the latest keep versions of every rule, so their trees can be collected.
+    The current version of a rule is always kept.
+
+    Returns:
+        int: The number of deleted versions.
+    """
+    table = RuleVersion._meta.db_table
+    with transaction.atomic():
+        # Serialized with the collector and with rollbacks to the versions being deleted
+        lock_nodes(shared=False)
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                DELETE FROM {table} v USING {Rule._meta.db_table} r
+                WHERE v.rule_id = r.id AND v.version <= r.version - %s
+            """, [max(keep, 1)])
+            return cursor.rowcount
+
+
+def collect_orphaned_nodes(batch_size=1000):
+    """
+    Deletes every node that is not reachable from any rule or rule version.
+
+    A node is reachable when a rule or one of its versions points at it, or a reachable node has
+    it as a child, so the unreachable nodes without any parent can always go. Deleting them
+    leaves their children without parents in turn, so the orphaned trees are taken apart from
+    the top, one batch at a time, until no such node is left. Nodes still in use are never touched. Every batch is its
+    own short transaction holding the node lock, so rules can be created and edited in between.
+
+    Returns:
+        dict: The number of deleted nodes, the number of batches and the time taken in seconds.
+    """
+    table = Node._meta.db_table
+    delete_query = f"""
+        DELETE FROM {table} WHERE id IN (
+            SELECT n.id FROM {table} n
+            WHERE n.id NOT IN ({_root_ids_query()})
+              AND NOT EXISTS (SELECT 1 FROM {table} p WHERE p.left_id = n.id)
+              AND NOT EXISTS (SELECT 1 FROM {table} p WHERE p.right_id = n.id)
+            LIMIT %s
+        )
+    """
+
+    started = time.monotonic()
+    deleted = 0
+    batches = 0
+    while True:
+        with transaction.atomic():
+            lock_nodes(shared=False)
+            with connection.cursor() as cursor:
+                cursor.execute(delete_query, [batch_size])
+                count = cursor.rowcount
+        if not count:
+            break
+        deleted += count
+        batches += 1
+
+    return {'deleted': deleted, 'batches': batches, 'seconds': time.monotonic() - started}
@@ -0,0 +1,295 @@
+# columnar.py
+# Vectorized evaluation of a rule over columnar data with NumPy.
+#
+# NumPy is pinned in requirements.txt, but only imported when a rule is evaluated over columns,
+# so the rest of the app keeps working in environments built without it.
+from .compiler import _eq, _ne
+
+ORDERING_OPERATORS = {'>', '<', '>=', '<='}
+ARITHMETIC_OPERATORS = {'+', '-', '*', '/', '%'}
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("Columnar evaluation requires NumPy, install it with `pip install numpy`.")
+    return numpy
+
+
+class ColumnarResult:
+    """
+    The outcome of a rule for every row of a dataset.
+
+    Attributes:
+        matched: Boolean mask of the rows whose result is truthy.
+        missing: Boolean mask of the rows for which evaluate_rule would return None.
+        errors: Boolean mask of the rows for which evaluate_rule would raise.
+        values: The result of every row, only meaningful where neither missing nor errors is set.
+    """
+
+    def __init__(self, matched, missing, errors, values):
+        self.matched = matched
+        self.missing = missing
+        self.errors = errors
+        self.values = values
+
+
+class _Column:
+    """
+    The values a node takes over all rows. A literal holds a single scalar.
+    Rows that are None or that raised are flagged in the none and error masks, and strings
+    tells that every other row holds a str.
+    """
+
+    def __init__(self, values, none, error, literal=False, strings=False):
+        self.values = values
+        self.none = none
+        self.error = error
+        self.literal = literal
+        self.strings = strings
+
+
+class ColumnarEvaluator:
+    """
+    Evaluates a rule AST over columns in a few array passes.
+
+    Variables map to columns, comparisons and arithmetic to vectorized array operations and
+    AND/OR/XOR to boolean mask operations. Every node is evaluated for the rows that reach it
+    in evaluate_rule, so short-circuits, None propagation and errors give the same outcome per
+    row. Values NumPy cannot type (object columns) fall back to per-element conversion.
+    """
+
+    def __init__(self, columns):
+        np = self.np = _numpy()
+        self.columns = {}
+        self.size = None
+        for name, column in columns.items():
+            column = self.column(column)
+            if self.size is None:
+                self.size = len(column.values)
+            elif len(column.values) != self.size:
+                raise ValueError("All columns must have the same length.")
+            self.columns[name] = column
+        self.size = self.size or 0
+        self.nothing = np.zeros(self.size, dtype=bool)
+
+    def column(self, column):
+        np = self.np
+        none = None
+        if isinstance(column, np.ma.MaskedArray):
+            none = np.ma.getmaskarray(column)
+            column = column.filled(column.fill_value).astype(object)
+            column[none] = None
+        elif not isinstance(column, np.ndarray):
+            # Plain sequences keep their Python values, NumPy would coerce mixed types to strings
+            values = list(column)
+            column = np.empty(len(values), dtype=object)
+            for index, value in enumerate(values):
+                column[index] = value
+        strings = column.dtype.kind in 'US'
+        if column.dtype.kind not in 'biuf':
+            column = column.astype(object)
+        if none is None:
+            none = column == None if column.dtype == object else np.zeros(len(column), dtype=bool)
+        none = np.asarray(none, dtype=bool)
+        if column.dtype == object and not strings:
+            strings = all(type(value) is str for value in column[~none])
+        return _Column(column, none, np.zeros(len(column), dtype=bool), strings=strings)
+
+    def evaluate(self, ast_root):
+        np = self.np
+        with np.errstate(all='ignore'):
+            result = self.node(ast_root, np.ones(self.size, dtype=bool))
+            values = result.values
+            if result.literal:
+                values = np.full(self.size, values, dtype=object)
+            truth = self.truth(result)
+            matched = np.broadcast_to(truth, (self.size,)) & ~result.none & ~result.error
+        return ColumnarResult(np.array(matched), result.none, result.error, values)
+
+    def node(self, node, active):
+        np = self.np
+        if node is None:
+            return _Column(None, self.nothing, active.copy())
+
+        if node.node_type == 'literal':
+            return _Column(node.value, self.nothing, self.nothing, literal=True)
+        if node.node_type == 'variable':
+            column = self.columns.get(node.value)
+            if column is None:
+                return _Column(np.full(self.size, None, dtype=object), ~self.nothing, self.nothing)
+            return column
+        if node.node_type != 'operator':
+            return _Column(None, self.nothing, active.copy())
+
+        operator = node.value
+        if operator in ('AND', 'OR'):
+            left = self.node(node.left, active)
+            error = left.error & active
+            none = left.none & active & ~error
+            truth = np.broadcast_to(self.truth(left), (self.size,))
+            # AND goes on with the rows whose left side is true, OR with the rows whose left side is false
+            decided = ~truth if operator == 'AND' else truth
+            remaining = active & ~error & ~none & ~decided
+
+            right = self.node(node.right, remaining)
+            right_error = right.error & remaining
+            error = error | right_error
+            none = none | (right.none & remaining & ~right_error)
+            values = np.where(remaining, np.broadcast_to(self.truth(right), (self.size,)), operator == 'OR')
+            return _Column(values, none, error)
+
+        # Every other operator evaluates both sides before checking them for None
+        left = self.node(node.left, active)
+        right = self.node(node.right, active)
+        error = (left.error | right.error) & active
+        none = (left.none | right.none) & active & ~error
+        valid = active & ~error & ~none
+
+        if operator == 'XOR':
+            values = np.broadcast_to(self.truth(left) != self.truth(right), (self.size,))
+            return _Column(values, none, error)
+
+        if operator in ORDERING_OPERATORS or operator in ARITHMETIC_OPERATORS:
+            left_values, left_error = self.numbers(left, valid)
+            right_values, right_error = self.numbers(right, valid)
+            error = error | left_error | right_error
+            if operator in ('/', '%'):
+                error = error | (valid & (right_values == 0))
+            values = self.apply(operator, left_values, right_values)
+            return _Column(np.broadcast_to(values, (self.size,)), none, error)
+
+        if operator in ('=', '==', '!='):
+            values, equality_error = self.equality(left, right, valid, operator == '!=')
+            return _Column(values, none, error | equality_error)
+
+        # Unsupported operators raise for every row where neither side is None
+        return _Column(np.zeros(self.size, dtype=bool), none, error | valid)
+
+    def apply(self, operator, left, right):
+        np = self.np
+        if operator == '>':
+            return np.greater(left, right)
+        if operator == '<':
+            return np.less(left, right)
+        if operator == '>=':
+            return np.greater_equal(left, right)
+        if operator == '<=':
+            return np.less_equal(left, right)
+        if operator == '+':
+            return np.add(left, right)
+        if operator == '-':
+            return np.subtract(left, right)
+        if operator == '*':
+            return np.multiply(left, right)
+        if operator == '/':
+            return np.divide(left, right)
+        return np.remainder(left, right)
+
+    def numbers(self, column, valid):
+        """
+        Converts a column to floats like to_float does.
+
+        Returns:
+            tuple: The floats and the mask of the valid rows that cannot be converted.
+        """
+        np = self.np
+        if column.literal:
+            try:
+                return float(column.values), self.nothing
+            except ValueError:
+                return 0.0, valid.copy()
+
+        values = column.values
+        if values.dtype.kind in 'biuf':
+            return values.astype(float), self.nothing
+
+        numbers = np.zeros(self.size, dtype=float)
+        error = np.zeros(self.size, dtype=bool)
+        for index in np.flatnonzero(valid):
+            try:
+                numbers[index] = float(values[index])
+            except (TypeError, ValueError, OverflowError):
+                error[index] = True
+        return numbers, error
+
+    def truth(self, column):
+        np = self.np
+        values = column.values
+        if column.literal:
+            return bool(values)
+        if values.dtype.kind == 'b':
+            return values
+        if values.dtype.kind in 'iuf':
+            return values != 0
+        if column.strings:
+            return np.not_equal(values, '')
+        truth = np.zeros(self.size, dtype=bool)
+        for index in np.flatnonzero(~column.none):
+            truth[index] = bool(values[index])
+        return truth
+
+    def equality(self, left, right, valid, negate):
+        """
+        Compares two columns like the = and != operators: numerically when both sides are
+        numbers, as they are otherwise.
+        """
+        np = self.np
+
+        def numeric(column):
+            if column.literal:
+                try:
+                    float(column.values)
+                    return True
+                except ValueError:
+                    return False
+            return column.values.dtype.kind in 'biuf'
+
+        if numeric(left) and numeric(right):
+            left_values, _ = self.numbers(left, valid)
+            right_values, _ = self.numbers(right, valid)
+            values = np.not_equal(left_values, right_values) if negate else np.equal(left_values, right_values)
+            return np.broadcast_to(values, (self.size,)), self.nothing
+
+        # A number is never equal to a literal that is not a number
+        if (left.literal and numeric(right)) or (right.literal and numeric(left)):
+            return np.full(self.size, negate), self.nothing
+
+        # Strings compare as they are with a literal that is not a number
+        for column, other in ((left, right), (right, left)):
+            if column.strings and other.literal and not numeric(other):
+                values = np.not_equal(column.values, other.values) if negate else np.equal(column.values, other.values)
+                return np.asarray(values, dtype=bool), self.nothing
+
+        # Anything else is compared element by element with the same function as the compiled rules
+        compare = _ne if negate else _eq
+        values = np.zeros(self.size, dtype=bool)
+        error = np.zeros(self.size, dtype=bool)
+        for index in np.flatnonzero(valid):
+            left_value = left.values if left.literal else left.values[index]
+            right_value = right.values if right.literal else right.values[index]
+            try:
+                values[index] = compare(left_value, right_value)
+            except Exception:
+                error[index] = True
+        return values, error
+
+
+def evaluate_columns(ast_root, columns):
+    """
+    Evaluates a rule over a columnar dataset.
+
+    Args:
+        ast_root (Node): The root of the rule AST, e.g. from load_rule_tree or build_tree.
+        columns (dict): Column name to NumPy array (or any sequence) mapping, all of the same
+            length. None entries, masked entries and absent columns are missing values.
+
+    Returns:
+        ColumnarResult: The per-row masks and values.
+
+    Raises:
+        RuntimeError: If NumPy is not installed.
+        ValueError: If the columns have different lengths.
+    """
+    return ColumnarEvaluator(columns).evaluate(ast_root)
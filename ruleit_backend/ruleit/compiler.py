@@ -0,0 +1,755 @@
+# compiler.py
+import json
+import hashlib
+import operator as ops
+from django.conf import settings
+from .models import Rule, RuleVersion
+from .cache import compiled_rules, merged_rule_sets, evaluation_results
+from .index import rule_index
+from .adaptive import AdaptiveRun, guard_requirements
+from .utils import is_number, to_bool, to_float, evaluate_rule, load_nodes, load_rule_tree, aload_rule_tree, dump_tree, build_tree
+
+
+# Comparison and arithmetic operators, called once both operands are known to be present
+def _gt(left, right):
+    return to_float(left) > to_float(right)
+
+def _lt(left, right):
+    return to_float(left) < to_float(right)
+
+def _ge(left, right):
+    return to_float(left) >= to_float(right)
+
+def _le(left, right):
+    return to_float(left) <= to_float(right)
+
+def _eq(left, right):
+    if is_number(left) and is_number(right):
+        return float(left) == float(right)
+    return left == right
+
+def _ne(left, right):
+    if is_number(left) and is_number(right):
+        return float(left) != float(right)
+    return left != right
+
+def _add(left, right):
+    return to_float(left) + to_float(right)
+
+def _sub(left, right):
+    return to_float(left) - to_float(right)
+
+def _mul(left, right):
+    return to_float(left) * to_float(right)
+
+def _div(left, right):
+    if to_float(right) == 0:
+        raise ValueError("Division by zero is not allowed.")
+    return to_float(left) / to_float(right)
+
+def _mod(left, right):
+    if to_float(right) == 0:
+        raise ValueError("Modulo by zero is not allowed.")
+    return to_float(left) % to_float(right)
+
+BINARY_OPERATORS = {
+    '>': _gt,
+    '<': _lt,
+    '>=': _ge,
+    '<=': _le,
+    '=': _eq,
+    '==': _eq,
+    '!=': _ne,
+    '+': _add,
+    '-': _sub,
+    '*': _mul,
+    '/': _div,
+    '%': _mod,
+}
+
+
+# Logical operators get both children unevaluated so they can short-circuit
+def _and(left, right):
+    def run(data):
+        left_value = left(data)
+        if left_value is None: return None
+        if not to_bool(left_value): return False
+        right_value = right(data)
+        if right_value is None: return None
+        return to_bool(right_value)
+    return run
+
+def _or(left, right):
+    def run(data):
+        left_value = left(data)
+        if left_value is None: return None
+        if to_bool(left_value): return True
+        right_value = right(data)
+        if right_value is None: return None
+        return to_bool(right_value)
+    return run
+
+def _xor(left, right):
+    def run(data):
+        left_value = left(data)
+        right_value = right(data)
+        if left_value is None or right_value is None: return None
+        return to_bool(left_value) != to_bool(right_value)
+    return run
+
+LOGICAL_OPERATORS = {
+    'AND': _and,
+    'OR': _or,
+    'XOR': _xor,
+}
+
+
+# Typed variants of the operators, used when one operand is a literal that can be typed once
+NUMERIC_OPERATORS = {
+    '>': ops.gt,
+    '<': ops.lt,
+    '>=': ops.ge,
+    '<=': ops.le,
+    '+': ops.add,
+    '-': ops.sub,
+    '*': ops.mul,
+    '/': ops.truediv,
+    '%': ops.mod,
+}
+
+def _numeric_literal(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+def _typed_numeric(function, operand, number, literal_first):
+    # The literal is already a float, only the other operand is converted per evaluation
+    if literal_first:
+        def run(data):
+            value = operand(data)
+            if value is None: return None
+            return function(number, to_float(value))
+    else:
+        def run(data):
+            value = operand(data)
+            if value is None: return None
+            return function(to_float(value), number)
+    return run
+
+def _typed_equality(negate, operand, literal, literal_first):
+    number = _numeric_literal(literal)
+
+    if number is not None:
+        # A numeric literal compares numerically with anything that parses as a number
+        def run(data):
+            value = operand(data)
+            if value is None: return None
+            try:
+                value_number = float(value)
+            except ValueError:
+                return (value != literal) if negate else (value == literal)
+            return (value_number != number) if negate else (value_number == number)
+
+    elif literal_first:
+        # The literal is checked first and is not a number, so the values compare as they are
+        def run(data):
+            value = operand(data)
+            if value is None: return None
+            return (value != literal) if negate else (value == literal)
+
+    else:
+        generic = _ne if negate else _eq
+        def run(data):
+            value = operand(data)
+            if value is None: return None
+            if type(value) is str:
+                return (value != literal) if negate else (value == literal)
+            return generic(value, literal)
+
+    return run
+
+
+def _chain_operands(node, operator):
+    # The operands of a chain of the same logical operator, in evaluation order
+    operands, stack = [], [node]
+    while stack:
+        current = stack.pop()
+        if current.node_type == 'operator' and current.value == operator:
+            stack += [current.right, current.left]
+        else:
+            operands.append(current)
+    return operands
+
+
+class RuleCompiler:
+    """
+    Turns a rule AST into a tree of pre-dispatched closures.
+
+    Every node is resolved once: operators are looked up in the operator tables and
+    literal and variable nodes become constants, so evaluating the compiled rule is a
+    chain of plain function calls with the same results as evaluate_rule.
+    Literals compared with or combined with another operand are typed at compile time.
+    Nodes shared inside the AST are compiled only once.
+
+    With adaptive set, AND/OR chains evaluate their order-independent operands in the
+    order observed to be cheapest, see AdaptiveRun. The runs are kept in self.runs.
+    """
+
+    def __init__(self, adaptive=False, sample_rate=16, reorder_interval=64):
+        self._compiled = {}
+        self.adaptive = adaptive
+        self.sample_rate = sample_rate
+        self.reorder_interval = reorder_interval
+        self.runs = []
+
+    def compile(self, node):
+        if node is None:
+            raise RuntimeError("Invalid tree structure.")
+
+        # Children are compiled before their parents from an explicit stack instead of by
+        # recursion, so rules nested as deeply as evaluate_rule handles compile as well.
+        # Adaptive AND/OR chains compile their own operands, see build_adaptive.
+        stack = [node]
+        while stack:
+            current = stack[-1]
+            if id(current) in self._compiled:
+                stack.pop()
+                continue
+            if current.node_type == 'operator' and not (self.adaptive and current.value in ('AND', 'OR')):
+                children = (current.left, current.right)
+                if any(child is None for child in children):
+                    raise RuntimeError("Invalid tree structure.")
+                pending = [child for child in reversed(children) if id(child) not in self._compiled]
+                if pending:
+                    stack.extend(pending)
+                    continue
+            stack.pop()
+            # Compiled nodes are kept referenced so their id() cannot be reused by another node
+            self._compiled[id(current)] = (current, self.build(current))
+        return self._compiled[id(node)][1]
+
+    def build(self, node):
+        if node.node_type == 'literal':
+            value = node.value
+            return lambda data: value
+
+        elif node.node_type == 'variable':
+            name = node.value
+            return lambda data: data.get(name, None)
+
+        elif node.node_type == 'operator':
+            if self.adaptive and node.value in ('AND', 'OR'):
+                chain = self.build_adaptive(node)
+                if chain is not None:
+                    return chain
+
+            left = self.compile(node.left)
+            right = self.compile(node.right)
+
+            if node.value in LOGICAL_OPERATORS:
+                return LOGICAL_OPERATORS[node.value](left, right)
+            typed = self.build_typed(node.value, node.left, node.right, left, right)
+            if typed is not None:
+                return typed
+            return self.build_binary(node.value, left, right)
+
+        raise Exception("unknown error occurred.")
+
+    def build_adaptive(self, node):
+        """
+        Compiles an AND/OR chain, turning every run of two or more consecutive operands that
+        can be guarded against raising or returning None into an AdaptiveRun. Returns None
+        when the chain has no such run.
+        """
+        operator = node.value
+        segments, run, adapted = [], [], False
+
+        for operand in _chain_operands(node, operator) + [None]:
+            requirements = guard_requirements(operand) if operand is not None else None
+            if requirements is not None:
+                run.append((operand, requirements))
+                continue
+
+            if len(run) >= 2:
+                segments.append(self.build_run(operator, run))
+                adapted = True
+            else:
+                segments.extend(self.compile(run_operand) for run_operand, _ in run)
+            run = []
+            if operand is not None:
+                segments.append(self.compile(operand))
+
+        if not adapted:
+            return None
+        return self.fold(operator, segments)
+
+    def build_run(self, operator, run):
+        requirements = {}
+        for _, operand_requirements in run:
+            for name, kind in operand_requirements.items():
+                requirements[name] = max(kind, requirements.get(name, kind))
+
+        operands = [self.compile(operand) for operand, _ in run]
+        adaptive_run = AdaptiveRun(
+            operator, operands, requirements, self.fold(operator, operands),
+            sample_rate=self.sample_rate, reorder_interval=self.reorder_interval
+        )
+        self.runs.append(adaptive_run)
+        return adaptive_run
+
+    def fold(self, operator, operands):
+        chain = operands[0]
+        for operand in operands[1:]:
+            chain = LOGICAL_OPERATORS[operator](chain, operand)
+        return chain
+
+    def build_typed(self, operator, left_node, right_node, left, right):
+        """
+        Specializes a comparison or arithmetic operator with one literal operand, so the literal
+        is parsed and typed once here instead of on every evaluation. Returns None when the
+        generic operator has to be used.
+        """
+        if (left_node.node_type == 'literal') == (right_node.node_type == 'literal'):
+            return None
+        literal_first = left_node.node_type == 'literal'
+        literal = left_node.value if literal_first else right_node.value
+        operand = right if literal_first else left
+
+        if operator in ('=', '==', '!='):
+            return _typed_equality(operator == '!=', operand, literal, literal_first)
+
+        if operator in NUMERIC_OPERATORS:
+            number = _numeric_literal(literal)
+            if number is None:
+                return None
+            # Zero divisors and literal left operands of / and % keep their runtime checks
+            if operator in ('/', '%') and (literal_first or number == 0):
+                return None
+            return _typed_numeric(NUMERIC_OPERATORS[operator], operand, number, literal_first)
+
+        return None
+
+    def build_binary(self, operator, left, right):
+        function = BINARY_OPERATORS.get(operator)
+
+        def run(data):
+            left_value = left(data)
+            right_value = right(data)
+            if left_value is None or right_value is None: return None
+            if function is None:
+                raise NotImplementedError(f"Unsupported operator '{operator}' encountered.")
+            return function(left_value, right_value)
+        return run
+
+
+def compile_tree(ast_root):
+    """
+    Compiles an AST into a callable taking the data dictionary and returning the result
+    evaluate_rule would return for it.
+    """
+    return RuleCompiler().compile(ast_root)
+
+
+class Record(dict):
+    """
+    The data of one record together with the per-node results computed for it so far.
+    """
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.memo = {}
+
+def _memoized(run, slot):
+    def memoized(record):
+        memo = record.memo
+        if slot in memo:
+            return memo[slot]
+        value = run(record)
+        memo[slot] = value
+        return value
+    return memoized
+
+
+class SharedRuleCompiler(RuleCompiler):
+    """
+    Compiles many ASTs into one merged DAG.
+
+    Structurally identical subtrees are interned to a single slot, even when they are
+    stored as separate nodes, and operator slots memoize their result on the Record
+    being evaluated. A predicate shared by many rules is therefore computed once per record.
+    The variables every slot depends on are kept in self.dependencies.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._slots = {}
+        self._node_slots = {}
+        self._closures = []
+        self.dependencies = []
+
+    def compile(self, node):
+        if node is None:
+            raise RuntimeError("Invalid tree structure.")
+
+        slot = self._node_slots.get(id(node), (None, None))[1]
+        if slot is None:
+            if node.node_type == 'operator':
+                key = (node.node_type, node.value, self.slot_of(node.left), self.slot_of(node.right))
+            else:
+                key = (node.node_type, node.value)
+
+            slot = self._slots.get(key)
+            if slot is None:
+                run = self.build(node)
+                slot = len(self._closures)
+                if node.node_type == 'operator':
+                    run = _memoized(run, slot)
+                    dependencies = self.dependencies[key[2]] | self.dependencies[key[3]]
+                elif node.node_type == 'variable':
+                    dependencies = frozenset([node.value])
+                else:
+                    dependencies = frozenset()
+                self._closures.append(run)
+                self.dependencies.append(dependencies)
+                self._slots[key] = slot
+            self._node_slots[id(node)] = (node, slot)
+
+        return self._closures[slot]
+
+    def slot_of(self, node):
+        self.compile(node)
+        return self._node_slots[id(node)][1]
+
+    def __len__(self):
+        return len(self._closures)
+
+
+# Evaluation engines a compiled rule can run with
+ENGINES = ('compiled', 'native', 'interpreter')
+
+
+class CompiledRule:
+    """
+    A rule compiled for repeated evaluation, tagged with the rule version it was built from.
+    The serialized program of the rule is kept along so it can be handed to worker processes.
+
+    Besides the compiled closures, the rule can be evaluated as generated native code or by
+    the evaluate_rule interpreter, see evaluator. Those are built on first use.
+    """
+
+    def __init__(self, rule_id, version, evaluator, rule_name=None, program=None):
+        self.rule_id = rule_id
+        self.version = version
+        self.rule_name = rule_name
+        self.program = program
+        self._evaluator = evaluator
+        # The variables the rule reads, the only part of a record its result depends on
+        self.variables = sorted({value for node_type, value in program or () if node_type == 'variable'})
+        self._engines = {'compiled': evaluator}
+
+    def evaluate(self, data):
+        return self._evaluator(data)
+
+    def evaluator(self, engine='compiled'):
+        """
+        Returns the callable evaluating the rule with the given engine.
+
+        Raises:
+            ValueError: If the engine is unknown.
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine '{engine}', expected one of: {', '.join(ENGINES)}.")
+
+        evaluate = self._engines.get(engine)
+        if evaluate is None:
+            ast_root = build_tree(self.program)
+            if engine == 'native':
+                from .codegen import compile_native
+                # Rules nested too deeply for the Python compiler keep the compiled closures
+                evaluate = compile_native(ast_root, f'<rule {self.rule_id} v{self.version}>') or self._evaluator
+            else:
+                evaluate = lambda data: evaluate_rule(ast_root, data)
+            self._engines[engine] = evaluate
+        return evaluate
+
+    def __repr__(self):
+        return f"<CompiledRule {self.rule_id} v{self.version}>"
+
+
+def _adaptive_compiler():
+    # Compiler for cached rules, which live long enough to learn a better operand order
+    return RuleCompiler(
+        adaptive=getattr(settings, 'RULEIT_ADAPTIVE_ORDERING', True),
+        sample_rate=getattr(settings, 'RULEIT_ADAPTIVE_SAMPLE_RATE', 16),
+        reorder_interval=getattr(settings, 'RULEIT_ADAPTIVE_REORDER_INTERVAL', 64),
+    )
+
+def _compile_tree(ast_root):
+    # Adaptive chains are compiled recursively, rules nested too deeply for that get plain closures
+    try:
+        return _adaptive_compiler().compile(ast_root)
+    except RecursionError:
+        return RuleCompiler().compile(ast_root)
+
+def compile_rule(rule):
+    """
+    Loads a rule's AST and compiles it.
+
+    Args:
+        rule (Rule): The rule to compile.
+
+    Returns:
+        CompiledRule: The compiled rule.
+    """
+    ast_root = load_rule_tree(rule)
+    return CompiledRule(rule.id, rule.version, _compile_tree(ast_root), rule.rule_name, dump_tree(ast_root))
+
+
+def get_compiled_rule(rule_id=None, rule_name=None, version=None):
+    """
+    Returns the compiled form of a rule from the per-process cache, compiling it on a miss.
+    The database is only queried on a cache miss.
+
+    Without a version the current version of the rule is used, a version pins an earlier one.
+
+    Raises:
+        Rule.DoesNotExist: If no rule matches the given id or name.
+        RuleVersion.DoesNotExist: If the rule has no such version.
+    """
+    if rule_id:
+        rule_id = int(rule_id)
+    if version:
+        version = int(version)
+
+    compiled = compiled_rules.get(rule_id=rule_id, rule_name=rule_name, version=version)
+    if compiled is not None:
+        return compiled
+
+    if version:
+        return _compile_version(rule_id, rule_name, version)
+
+    if rule_id:
+        rule = Rule.objects.get(id=rule_id)
+    else:
+        rule = Rule.objects.get(rule_name=rule_name)
+
+    compiled = compile_rule(rule)
+    compiled_rules.put(rule.id, rule.version, compiled, rule.rule_name)
+    return compiled
+
+
+def _compile_version(rule_id, rule_name, version):
+    # Versions never change once recorded, so a pinned version is cached like the current one
+    versions = RuleVersion.objects.select_related('rule')
+    if rule_id:
+        rule_version = versions.get(rule_id=rule_id, version=version)
+    else:
+        rule_version = versions.get(rule__rule_name=rule_name, version=version)
+
+    program = rule_version.program
+    if program is None:
+        program = dump_tree(load_nodes([rule_version.rule_root_id])[rule_version.rule_root_id])
+    rule = rule_version.rule
+    compiled = CompiledRule(rule.id, version, _compile_tree(build_tree(program)), rule.rule_name, program)
+    compiled_rules.put(rule.id, version, compiled, rule.rule_name, current=version == rule.version)
+    return compiled
+
+
+async def aget_compiled_rule(rule_id=None, rule_name=None):
+    """
+    Async version of get_compiled_rule. A cache hit returns without leaving the event loop,
+    a miss loads the rule and its tree through the async ORM.
+    """
+    if rule_id:
+        rule_id = int(rule_id)
+
+    compiled = compiled_rules.get(rule_id=rule_id, rule_name=rule_name)
+    if compiled is not None:
+        return compiled
+
+    if rule_id:
+        rule = await Rule.objects.aget(id=rule_id)
+    else:
+        rule = await Rule.objects.aget(rule_name=rule_name)
+
+    ast_root = await aload_rule_tree(rule)
+    compiled = CompiledRule(rule.id, rule.version, _compile_tree(ast_root), rule.rule_name, dump_tree(ast_root))
+    compiled_rules.put(rule.id, rule.version, compiled, rule.rule_name)
+    return compiled
+
+
+def input_key(compiled_rule, data):
+    """
+    Hashes the values of the variables a rule reads from a record. Records that only differ
+    in fields the rule does not read get the same key.
+
+    Returns:
+        bytes or None: The digest, None when the values are not JSON serializable.
+    """
+    if not isinstance(data, dict):
+        return None
+    try:
+        values = json.dumps([data.get(name, None) for name in compiled_rule.variables], sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+    return hashlib.blake2b(values.encode(), digest_size=16).digest()
+
+def evaluate_cached(compiled_rule, data, evaluate=None):
+    """
+    Evaluates a record, reusing the result of an earlier record with the same values for the
+    variables the rule reads. Only successful evaluations are cached.
+    """
+    evaluate = evaluate or compiled_rule.evaluate
+    key = input_key(compiled_rule, data) if compiled_rule.program is not None else None
+    if key is None:
+        return evaluate(data)
+
+    key = (compiled_rule.rule_id, compiled_rule.version, key)
+    result = evaluation_results.get(key)
+    if result is evaluation_results.MISSING:
+        result = evaluate(data)
+        evaluation_results.put(key, result)
+    return result
+
+
+def evaluate_record(evaluate, data):
+    """
+    Evaluates one record, reporting a failure in place instead of raising.
+
+    Args:
+        evaluate (callable): A compiled evaluator taking the data dictionary.
+        data (dict): The record to evaluate.
+
+    Returns:
+        dict: {'result': bool or value} on success, {'error': message} otherwise.
+    """
+    if not isinstance(data, dict):
+        return {'error': 'Each record must be an object.'}
+
+    try:
+        result = evaluate(data)
+        return {'result': result if result is not None else False}
+    except RuntimeError as e:
+        return {'error': f'Runtime error occurred: {str(e)}'}
+    except NotImplementedError as e:
+        return {'error': f'NotImplementedError: {str(e)}'}
+    except Exception as e:
+        return {'error': str(e)}
+
+def evaluate_records(evaluate, records):
+    """
+    Lazily evaluates an iterable of records with one compiled evaluator.
+    """
+    for data in records:
+        yield evaluate_record(evaluate, data)
+
+def evaluate_ndjson(evaluate, lines):
+    """
+    Lazily evaluates newline-delimited JSON records, one output line per input record.
+
+    Only one line is held in memory at a time, so the input can be arbitrarily large.
+    Blank lines are skipped and lines that are not valid JSON are reported in place.
+
+    Args:
+        evaluate (callable): A compiled evaluator taking the data dictionary.
+        lines (iterable): The input lines, as str or bytes.
+
+    Yields:
+        str: The JSON encoded result of each record followed by a newline.
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            result = {'error': f'Invalid JSON: {str(e)}'}
+        else:
+            result = evaluate_record(evaluate, data)
+        yield json.dumps(result) + '\n'
+
+
+class MergedRuleSet:
+    """
+    A set of rules compiled into one shared DAG, matched against a record in a single pass.
+    """
+
+    def __init__(self, rules, nodes):
+        compiler = SharedRuleCompiler()
+        self.roots = [(rule_id, compiler.compile(nodes[root_id])) for rule_id, root_id in rules]
+        self.size = len(compiler)
+
+    def match(self, data, rule_ids=None):
+        """
+        Evaluates the rules against one record.
+
+        Args:
+            data (dict): The record to evaluate.
+            rule_ids (set, optional): Only evaluate these rules, e.g. the candidates from the predicate index.
+
+        Returns:
+            tuple: The ids of the matching rules and a list of {'rule_id', 'error'} entries
+            for the rules that failed to evaluate.
+        """
+        record = Record(data)
+        matched, errors = [], []
+        for rule_id, run in self.roots:
+            if rule_ids is not None and rule_id not in rule_ids:
+                continue
+            try:
+                if run(record):
+                    matched.append(rule_id)
+            except Exception as e:
+                errors.append({'rule_id': rule_id, 'error': str(e)})
+        return matched, errors
+
+
+def get_merged_rule_set(rules):
+    """
+    Returns the merged DAG for the given rules, building it on a cache miss.
+
+    Args:
+        rules (iterable): (rule_id, version, rule_root_id) tuples of the selected rules.
+
+    Returns:
+        MergedRuleSet: The merged rule set.
+    """
+    rules = sorted(rules)
+    key = tuple((rule_id, version) for rule_id, version, _ in rules)
+
+    rule_set = merged_rule_sets.get(key)
+    if rule_set is None:
+        nodes = load_nodes(root_id for _, _, root_id in rules)
+        rule_set = MergedRuleSet([(rule_id, root_id) for rule_id, _, root_id in rules], nodes)
+        merged_rule_sets.put(key, rule_set)
+
+        # Index the rules this process has not seen at their current version yet
+        for rule_id, version, root_id in rules:
+            if not rule_index.has(rule_id, version):
+                rule_index.add(rule_id, version, nodes[root_id])
+    return rule_set
+
+
+def match_rules(data, rule_ids=None, rule_name_prefix=None):
+    """
+    Finds the rules a record satisfies.
+
+    Without rule_ids or rule_name_prefix every rule is considered. Only the ids and versions of
+    the selected rules are read on every call; their trees are loaded and merged on a cache miss.
+    The predicate index prunes the rules that cannot match before any of them is evaluated.
+
+    Returns:
+        tuple: The ids of the matching rules and the per-rule evaluation errors.
+    """
+    rules = Rule.objects.all()
+    if rule_ids is not None:
+        rules = rules.filter(id__in=rule_ids)
+    if rule_name_prefix:
+        rules = rules.filter(rule_name__startswith=rule_name_prefix)
+
+    rules = list(rules.values_list('id', 'version', 'rule_root_id'))
+    rule_set = get_merged_rule_set(rules)
+    candidates = rule_index.candidates(data, [(rule_id, version) for rule_id, version, _ in rules])
+    return rule_set.match(data, candidates)
+
@@ -0,0 +1,124 @@
+# delta.py
+# Incremental re-evaluation of a rule for records where only a few fields changed.
+import uuid
+from collections import defaultdict
+from django.conf import settings
+from .cache import LRUCache
+from .compiler import SharedRuleCompiler, Record, get_compiled_rule
+from .utils import build_tree
+
+
+class DeltaRule:
+    """
+    A rule compiled so the per-node results of an evaluation can be reused.
+
+    Every operator node memoizes its result on the Record being evaluated. Re-evaluating with a
+    few changed fields drops only the results of the nodes that read one of those fields and
+    reuses all the others, so only the affected subtrees run again. Results are the same as a
+    full evaluation of the updated record.
+    """
+
+    def __init__(self, rule_id, version, ast_root):
+        self.rule_id = rule_id
+        self.version = version
+        compiler = SharedRuleCompiler()
+        self._run = compiler.compile(ast_root)
+        self._dependents = defaultdict(list)
+        for slot, variables in enumerate(compiler.dependencies):
+            for variable in variables:
+                self._dependents[variable].append(slot)
+
+    def evaluate(self, data):
+        """
+        Evaluates a record from scratch.
+
+        Returns:
+            tuple: The result and the Record holding the per-node results.
+        """
+        record = Record(data)
+        return self._run(record), record
+
+    def reevaluate(self, record, changes):
+        """
+        Evaluates the record updated with the changed fields, reusing the per-node results of
+        the previous evaluation that do not depend on them. The previous record is left as is.
+
+        Args:
+            record (Record): The record of the previous evaluation.
+            changes (dict): The fields that changed and their new values.
+
+        Returns:
+            tuple: The result and the Record of the updated record.
+        """
+        updated = Record(record)
+        updated.update(changes)
+        updated.memo = dict(record.memo)
+        for variable in changes:
+            for slot in self._dependents.get(variable, ()):
+                updated.memo.pop(slot, None)
+        return self._run(updated), updated
+
+
+class EvaluationHandleNotFound(Exception):
+    pass
+
+
+# Delta rules by (rule_id, version), and the latest evaluation state behind every handle
+delta_rules = LRUCache(getattr(settings, 'RULEIT_DELTA_RULE_CACHE_SIZE', 256))
+evaluation_states = LRUCache(getattr(settings, 'RULEIT_EVALUATION_STATE_CACHE_SIZE', 10000))
+
+
+def _get_delta_rule(compiled_rule):
+    key = (compiled_rule.rule_id, compiled_rule.version)
+    delta_rule = delta_rules.get(key)
+    if delta_rule is None:
+        delta_rule = DeltaRule(compiled_rule.rule_id, compiled_rule.version, build_tree(compiled_rule.program))
+        delta_rules.put(key, delta_rule)
+    return delta_rule
+
+
+def evaluate_with_handle(data, rule_id=None, rule_name=None):
+    """
+    Evaluates a record and keeps its per-node results for later delta evaluations.
+
+    Raises:
+        Rule.DoesNotExist: If no rule matches the given id or name.
+
+    Returns:
+        tuple: The result and the handle of the evaluation.
+    """
+    delta_rule = _get_delta_rule(get_compiled_rule(rule_id=rule_id, rule_name=rule_name))
+    result, record = delta_rule.evaluate(data)
+
+    handle = uuid.uuid4().hex
+    evaluation_states.put(handle, (delta_rule, record))
+    return result, handle
+
+
+def evaluate_delta(handle, changes):
+    """
+    Re-evaluates the record behind a handle with a few changed fields. Only the nodes that
+    depend on the changed fields are evaluated again. The handle then refers to the updated record.
+
+    If the rule was edited since, the updated record is evaluated in full against the current version.
+
+    Raises:
+        EvaluationHandleNotFound: If the handle is unknown or its state was evicted.
+
+    Returns:
+        The result of the updated record.
+    """
+    state = evaluation_states.get(handle)
+    if state is None:
+        raise EvaluationHandleNotFound("Evaluation handle not found or expired.")
+    delta_rule, record = state
+
+    compiled_rule = get_compiled_rule(rule_id=delta_rule.rule_id)
+    if compiled_rule.version == delta_rule.version:
+        result, record = delta_rule.reevaluate(record, changes)
+    else:
+        delta_rule = _get_delta_rule(compiled_rule)
+        result, record = delta_rule.evaluate({**record, **changes})
+
+    evaluation_states.put(handle, (delta_rule, record))
+    return result
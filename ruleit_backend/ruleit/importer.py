@@ -0,0 +1,187 @@
+# importer.py
+# Bulk import of rule catalogs.
+import csv
+import io
+import json
+from django.db import transaction, DatabaseError
+from .models import Rule, RuleVersion
+from .cache import compiled_rules
+from .index import rule_index
+from .collector import lock_nodes
+from .invalidation import notify_rules_changed
+from .parallel import parse_rules_chunk, parser_pool, _chunks
+from .utils import build_nodes, save_nodes, dump_tree, build_tree
+
+FORMATS = ('json', 'ndjson', 'csv')
+
+
+def guess_format(filename):
+    """
+    Returns the import format matching a file extension, None if there is none.
+    """
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension == 'jsonl':
+        return 'ndjson'
+    return extension if extension in FORMATS else None
+
+
+def read_rules(source, format):
+    """
+    Reads the rows of a rule catalog.
+
+    Args:
+        source: Text file-like object holding the catalog, or the list of rules already decoded for 'json'.
+        format (str): 'json' for a list of objects, 'ndjson' for one object per line, 'csv'
+            for a file with a header row. Every row has a rule_name and a rule_string, both strings.
+
+    Yields:
+        tuple: (row number, rule_name, rule_string, error), error being None for a readable row.
+    """
+    if format == 'json':
+        try:
+            rows = source if isinstance(source, list) else json.load(source)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON: {str(e)}")
+        if not isinstance(rows, list):
+            raise ValueError("A JSON catalog must be a list of rules.")
+        rows = enumerate(rows, start=1)
+    elif format == 'ndjson':
+        rows = ((number, line) for number, line in enumerate(source, start=1) if line.strip())
+    elif format == 'csv':
+        rows = enumerate(csv.DictReader(source), start=1)
+    else:
+        raise ValueError(f"Unknown format '{format}'. Use one of {', '.join(FORMATS)}.")
+
+    for number, row in rows:
+        if format == 'ndjson':
+            try:
+                row = json.loads(row)
+            except ValueError as e:
+                yield number, None, None, f"Invalid JSON: {str(e)}"
+                continue
+        if not isinstance(row, dict):
+            yield number, None, None, "Every rule must be an object with a rule_name and a rule_string."
+            continue
+        rule_name, rule_string = row.get('rule_name') or None, row.get('rule_string')
+        if rule_string is not None and not isinstance(rule_string, str):
+            yield number, None, None, "rule_string must be a string."
+            continue
+        if rule_name is not None and not isinstance(rule_name, str):
+            yield number, None, None, "rule_name must be a string."
+            continue
+        yield number, rule_name, rule_string, None
+
+
+def _parse(rule_strings, pool, workers):
+    if pool is None:
+        return parse_rules_chunk(rule_strings)
+    size = max(1, -(-len(rule_strings) // workers))
+    return [result for chunk in pool.map(parse_rules_chunk, _chunks(rule_strings, size)) for result in chunk]
+
+
+def _save(entries):
+    # Saves the rules of a chunk with one bulk insert per tree level and one for the rules
+    node_cache = {}
+    nodes = []
+    rules = []
+    for entry in entries:
+        root, rule_nodes = build_nodes(entry['postfix'], node_cache)
+        nodes += rule_nodes
+        rules.append(Rule(
+            rule_root=root, rule_tokens=entry['tokens'], rule_name=entry['rule_name'], program=dump_tree(root)
+        ))
+
+    with transaction.atomic():
+        lock_nodes()
+        save_nodes(nodes)
+        rules = Rule.objects.bulk_create(rules)
+        RuleVersion.objects.bulk_create([
+            RuleVersion(
+                rule=rule, version=rule.version, rule_root_id=rule.rule_root_id,
+                rule_tokens=rule.rule_tokens, program=rule.program
+            )
+            for rule in rules
+        ])
+        notify_rules_changed(rules)
+        return rules
+
+
+def import_rules(rows, chunk_size=500, workers=1):
+    """
+    Creates rules in bulk. A rule that fails is reported and skipped, the others are created.
+
+    Rules are parsed in chunks, across a pool of worker processes when workers is more than one,
+    and every chunk is saved in its own transaction with batched inserts. If a chunk fails to
+    save as a whole, its rules are saved one by one so only the failing rules are left out.
+
+    Args:
+        rows (iterable): (row number, rule_name, rule_string, error) tuples, as read_rules yields them.
+        chunk_size (int): Rules parsed and saved at a time.
+        workers (int): Number of parser processes, the rules are parsed in this process if 1.
+
+    Returns:
+        dict: The number of created rules and the per-row errors.
+    """
+    created = 0
+    errors = []
+    seen_names = set()
+    pool = parser_pool(workers) if workers and workers > 1 else None
+
+    try:
+        for chunk in _chunks(rows, chunk_size):
+            parsed = iter(_parse([rule_string for _, _, rule_string, error in chunk if error is None], pool, workers))
+
+            entries = []
+            for number, rule_name, rule_string, error in chunk:
+                if error is None:
+                    result = next(parsed)
+                    error = result.get('error')
+                if error is None and rule_name is not None and rule_name in seen_names:
+                    error = f"Duplicate rule name '{rule_name}'."
+                if error is not None:
+                    errors.append({'row': number, 'rule_name': rule_name, 'error': error})
+                    continue
+                seen_names.add(rule_name)
+                entries.append({'row': number, 'rule_name': rule_name, **result})
+
+            # Names taken by existing rules are reported instead of failing the chunk
+            taken = set(Rule.objects.filter(
+                rule_name__in=[entry['rule_name'] for entry in entries if entry['rule_name']]
+            ).values_list('rule_name', flat=True))
+            for entry in [entry for entry in entries if entry['rule_name'] in taken]:
+                errors.append({'row': entry['row'], 'rule_name': entry['rule_name'], 'error': f"Rule name '{entry['rule_name']}' already exists."})
+                entries.remove(entry)
+
+            try:
+                rules = _save(entries)
+            except (ValueError, DatabaseError):
+                rules = []
+                for entry in entries:
+                    try:
+                        rules += _save([entry])
+                    except (ValueError, DatabaseError) as e:
+                        errors.append({'row': entry['row'], 'rule_name': entry['rule_name'], 'error': str(e)})
+
+            for rule in rules:
+                if rule.rule_name:
+                    compiled_rules.invalidate(rule_name=rule.rule_name)
+                rule_index.add(rule.id, rule.version, build_tree(rule.program))
+            created += len(rules)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    errors.sort(key=lambda error: error['row'])
+    return {'created': created, 'errors': errors}
+
+
+def import_catalog(source, format, chunk_size=500, workers=1):
+    """
+    Reads a rule catalog and imports it, see read_rules and import_rules.
+
+    Raises:
+        ValueError: If the catalog cannot be read as a whole.
+    """
+    if isinstance(source, (bytes, str)):
+        source = io.StringIO(source.decode('utf-8') if isinstance(source, bytes) else source)
+    return import_rules(read_rules(source, format), chunk_size=chunk_size, workers=workers)
@@ -0,0 +1,183 @@
+# index.py
+import threading
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+# Comparisons that can be indexed, and how they read with the operands swapped
+RANGE_OPERATORS = {'>': '<', '>=': '<=', '<': '>', '<=': '>='}
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _equality_key(value):
+    # Numbers compare numerically and everything else compares as is, like evaluate_rule does
+    number = _number(value)
+    if number is not None:
+        return ('number', number)
+    return ('value', value)
+
+
+def required_conjuncts(root):
+    """
+    Returns the comparisons that must all be true for the rule rooted at root to match,
+    i.e. the operands of the top-level chain of AND operators.
+    """
+    if root.node_type == 'operator' and root.value == 'AND':
+        return required_conjuncts(root.left) + required_conjuncts(root.right)
+    return [root]
+
+def index_entry(node):
+    """
+    Describes a `variable <op> literal` comparison as an index entry.
+
+    Returns:
+        tuple or None: ('eq', variable, key) or ('range', variable, operator, threshold),
+        None for anything the index cannot reason about.
+    """
+    if node.node_type != 'operator':
+        return None
+
+    operator = node.value
+    left, right = node.left, node.right
+    if left.node_type == 'literal' and right.node_type == 'variable':
+        left, right = right, left
+        operator = RANGE_OPERATORS.get(operator, operator)
+    if left.node_type != 'variable' or right.node_type != 'literal':
+        return None
+
+    if operator in ('=', '=='):
+        return ('eq', left.value, _equality_key(right.value))
+    if operator in RANGE_OPERATORS:
+        threshold = _number(right.value)
+        if threshold is not None:
+            return ('range', left.value, operator, threshold)
+    return None
+
+
+class _Thresholds:
+    """
+    The thresholds of one (variable, operator) pair, sorted so the satisfied ones can be found by bisection.
+    """
+
+    def __init__(self):
+        self.values = []
+        self.rule_ids = []
+
+    def add(self, threshold, rule_id):
+        position = bisect_right(self.values, threshold)
+        self.values.insert(position, threshold)
+        self.rule_ids.insert(position, rule_id)
+
+    def remove(self, threshold, rule_id):
+        position = bisect_left(self.values, threshold)
+        while self.rule_ids[position] != rule_id:
+            position += 1
+        del self.values[position]
+        del self.rule_ids[position]
+
+    def satisfied(self, operator, value):
+        # '>' holds for thresholds below the value, '<' for thresholds above it, and so on
+        if operator == '>':
+            return self.rule_ids[:bisect_left(self.values, value)]
+        if operator == '>=':
+            return self.rule_ids[:bisect_right(self.values, value)]
+        if operator == '<':
+            return self.rule_ids[bisect_right(self.values, value):]
+        return self.rule_ids[bisect_left(self.values, value):]
+
+
+class PredicateIndex:
+    """
+    An index over the required `variable <op> literal` comparisons of the stored rules.
+
+    Equality comparisons are kept in hash maps and range comparisons in sorted threshold
+    lists per variable. For a record, every satisfied comparison is counted per rule, and
+    only rules whose indexed comparisons are all satisfied remain candidates for full
+    evaluation. Rules without any indexable comparison are always candidates.
+    Every rule is indexed at a specific version.
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._entries = {}
+        self._equality = defaultdict(list)
+        self._ranges = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def add(self, rule_id, version, root):
+        entries = [entry for entry in map(index_entry, required_conjuncts(root)) if entry]
+        with self._lock:
+            self._remove(rule_id)
+            self._versions[rule_id] = version
+            self._entries[rule_id] = entries
+            for entry in entries:
+                if entry[0] == 'eq':
+                    self._equality[entry[1:]].append(rule_id)
+                else:
+                    _, variable, operator, threshold = entry
+                    self._ranges[variable].setdefault(operator, _Thresholds()).add(threshold, rule_id)
+
+    def remove(self, rule_id):
+        with self._lock:
+            self._remove(rule_id)
+
+    def _remove(self, rule_id):
+        self._versions.pop(rule_id, None)
+        for entry in self._entries.pop(rule_id, []):
+            if entry[0] == 'eq':
+                self._equality[entry[1:]].remove(rule_id)
+                if not self._equality[entry[1:]]:
+                    del self._equality[entry[1:]]
+            else:
+                _, variable, operator, threshold = entry
+                self._ranges[variable][operator].remove(threshold, rule_id)
+
+    def has(self, rule_id, version):
+        return self._versions.get(rule_id) == version
+
+    def candidates(self, data, rules):
+        """
+        Narrows the given rules down to the ones that can match the record.
+
+        Args:
+            data (dict): The record.
+            rules (iterable): (rule_id, version) pairs of the rules to consider. Rules that
+                are not indexed at that version are always kept.
+
+        Returns:
+            set: The ids of the candidate rules.
+        """
+        satisfied = defaultdict(int)
+        with self._lock:
+            for variable, value in data.items():
+                if value is None:
+                    continue
+                try:
+                    for rule_id in self._equality.get((variable, _equality_key(value)), ()):
+                        satisfied[rule_id] += 1
+                except TypeError:
+                    pass
+
+                number = _number(value)
+                if number is None:
+                    continue
+                for operator, thresholds in self._ranges.get(variable, {}).items():
+                    for rule_id in thresholds.satisfied(operator, number):
+                        satisfied[rule_id] += 1
+
+            return {
+                rule_id for rule_id, version in rules
+                if self._versions.get(rule_id) != version
+                or satisfied[rule_id] == len(self._entries[rule_id])
+            }
+
+    def __len__(self):
+        return len(self._versions)
+
+
+# Index of the rules known to this process
+rule_index = PredicateIndex()
@@ -0,0 +1,215 @@
+# invalidation.py
+# Keeps the per-process rule caches of every worker coherent with the database.
+#
+# Writers publish the rules they change on a PostgreSQL NOTIFY channel from inside their
+# transaction, so the notification goes out exactly when the change commits. Every process runs a
+# listener thread evicting the cached forms of the changed rules, and falls back to polling the
+# rule versions while it cannot listen.
+import json
+import os
+import select
+import threading
+import uuid
+from django.conf import settings
+from django.db import connection, connections, DatabaseError
+from .models import Rule
+from .cache import compiled_rules, evaluation_results
+from .index import rule_index
+
+CHANNEL = 'ruleit_rules'
+
+# PostgreSQL rejects payloads of 8000 bytes and more
+MAX_PAYLOAD_SIZE = 7000
+
+_origin = None
+_origin_pid = None
+
+
+def origin():
+    """
+    Tells the notifications of this process apart, it has evicted its own caches already.
+
+    The origin is regenerated whenever the pid changes, so workers forked from a server that
+    imported the app first (gunicorn --preload) do not share it and drop each other's changes.
+    """
+    global _origin, _origin_pid
+    if _origin_pid != os.getpid():
+        _origin = uuid.uuid4().hex
+        _origin_pid = os.getpid()
+    return _origin
+
+
+def _payloads(rules, deleted):
+    # Packs as many rules as fit in every notification
+    sender = origin()
+    batch = []
+    for rule in rules:
+        candidate = batch + [[rule.id, rule.version, rule.rule_name]]
+        payload = json.dumps({'origin': sender, 'deleted': deleted, 'rules': candidate})
+        if batch and len(payload.encode()) > MAX_PAYLOAD_SIZE:
+            yield json.dumps({'origin': sender, 'deleted': deleted, 'rules': batch})
+            candidate = [[rule.id, rule.version, rule.rule_name]]
+        batch = candidate
+    if batch:
+        yield json.dumps({'origin': sender, 'deleted': deleted, 'rules': batch})
+
+
+def notify_rules_changed(rules, deleted=False):
+    """
+    Publishes created, edited or deleted rules to the other processes.
+
+    Run inside the transaction that changes the rules: PostgreSQL only delivers the
+    notification when it commits, and drops it on a rollback.
+    """
+    with connection.cursor() as cursor:
+        for payload in _payloads(rules, deleted):
+            cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, payload])
+
+
+def rule_deleted(sender, instance, **kwargs):
+    """
+    post_delete receiver for Rule, evicting the rule here and publishing it to the other processes.
+    """
+    invalidate_rule(instance.id, instance.rule_name, deleted=True)
+    notify_rules_changed([instance], deleted=True)
+
+
+def invalidate_rule(rule_id, rule_name=None, deleted=False):
+    """
+    Evicts everything this process cached for a rule.
+    """
+    compiled_rules.invalidate(rule_id)
+    if rule_name:
+        compiled_rules.invalidate(rule_name=rule_name)
+    evaluation_results.invalidate(rule_id)
+    if deleted:
+        rule_index.remove(rule_id)
+
+
+def apply_notification(payload):
+    """
+    Evicts the rules of a notification, unless this process sent it.
+    """
+    try:
+        message = json.loads(payload)
+    except ValueError:
+        return
+    if message.get('origin') == origin():
+        return
+    for rule_id, version, rule_name in message.get('rules', []):
+        # A cached rule that is already at the notified version is up to date
+        if not message.get('deleted') and compiled_rules.versions().get(rule_id) == version:
+            continue
+        invalidate_rule(rule_id, rule_name, message.get('deleted', False))
+
+
+def poll_rule_versions():
+    """
+    Compares the versions of the cached rules with the database and evicts the stale ones.
+
+    Returns:
+        int: The number of evicted rules.
+    """
+    cached = compiled_rules.versions()
+    if not cached:
+        return 0
+
+    current = dict(Rule.objects.filter(id__in=list(cached)).values_list('id', 'version'))
+    stale = [rule_id for rule_id, version in cached.items() if current.get(rule_id) != version]
+    for rule_id in stale:
+        invalidate_rule(rule_id, deleted=rule_id not in current)
+    return len(stale)
+
+
+class RuleChangeListener(threading.Thread):
+    """
+    Listens for rule changes on a dedicated database connection and evicts the changed rules.
+
+    Whenever the connection cannot be opened or is lost, the cached rule versions are polled
+    every poll_interval seconds until listening works again. The versions are also polled once
+    right after every (re)connection, to catch the changes made while nobody was listening.
+    """
+
+    def __init__(self, poll_interval=5, using='default'):
+        super().__init__(name='ruleit-invalidation', daemon=True)
+        self.poll_interval = poll_interval
+        self.using = using
+        self.listening = threading.Event()
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except DatabaseError:
+                pass
+            finally:
+                self.listening.clear()
+
+            if not self._stopped.is_set():
+                self._poll()
+                self._stopped.wait(self.poll_interval)
+
+    def _listen(self):
+        database = connections[self.using]
+        listener = None
+        try:
+            listener = database.get_new_connection(database.get_connection_params())
+            listener.autocommit = True
+            with listener.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            self._poll()
+            self.listening.set()
+
+            while not self._stopped.is_set():
+                # Wakes up now and then to notice stop() even when nothing happens
+                if not select.select([listener], [], [], min(self.poll_interval, 1))[0]:
+                    continue
+                listener.poll()
+                while listener.notifies:
+                    apply_notification(listener.notifies.pop(0).payload)
+        except Exception as e:
+            # psycopg2 errors raised outside of Django cursors are not wrapped
+            raise DatabaseError(str(e)) from e
+        finally:
+            if listener is not None:
+                listener.close()
+
+    def _poll(self):
+        try:
+            poll_rule_versions()
+        except DatabaseError:
+            pass
+        finally:
+            # The ORM connection of this thread is not reused across polls
+            connections[self.using].close()
+
+
+_listener = None
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def start_listener(**kwargs):
+    """
+    Starts the listener of this process once, if RULEIT_INVALIDATION_LISTENER is on.
+
+    Connected to request_started, so every worker starts its own listener when it serves its
+    first request, after any fork.
+    """
+    global _listener, _listener_pid
+    if not getattr(settings, 'RULEIT_INVALIDATION_LISTENER', False):
+        return
+    if _listener_pid == os.getpid():
+        return
+
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        origin()
+        _listener = RuleChangeListener(getattr(settings, 'RULEIT_INVALIDATION_POLL_INTERVAL', 5))
+        _listener.start()
+        _listener_pid = os.getpid()
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ruleit.models import Rule
+from ruleit.utils import load_nodes, dump_tree
+
+
+class Command(BaseCommand):
+    help = "Stores the serialized program of every rule created before rules carried one."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Rules loaded and updated at a time.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        updated = 0
+        last_id = 0
+
+        while True:
+            rules = list(Rule.objects.filter(program__isnull=True, id__gt=last_id).order_by('id')[:batch_size])
+            if not rules:
+                break
+            last_id = rules[-1].id
+
+            # The trees of the whole batch come with a single query
+            nodes = load_nodes(rule.rule_root_id for rule in rules)
+            for rule in rules:
+                rule.program = dump_tree(nodes[rule.rule_root_id])
+
+            with transaction.atomic():
+                Rule.objects.bulk_update(rules, ['program'])
+            updated += len(rules)
+
+        self.stdout.write(f"Stored the program of {updated} rule(s).")
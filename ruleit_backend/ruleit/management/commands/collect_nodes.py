@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+from ruleit.collector import count_orphaned_nodes, collect_orphaned_nodes, prune_versions
+
+
+class Command(BaseCommand):
+    help = "Deletes the nodes that are not reachable from any rule or rule version."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Nodes deleted per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the orphaned nodes.')
+        parser.add_argument('--keep-versions', type=int, help='Delete all but the latest given number of versions of every rule first.')
+        parser.add_argument('--interval', type=float, help='Keep running, collecting again every given number of seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            if options['keep_versions'] and not options['dry_run']:
+                self.stdout.write(f"Deleted {prune_versions(options['keep_versions'])} old rule version(s).")
+            if options['dry_run']:
+                self.stdout.write(f"Found {count_orphaned_nodes()} orphaned node(s).")
+            else:
+                report = collect_orphaned_nodes(batch_size=options['batch_size'])
+                self.stdout.write(
+                    f"Deleted {report['deleted']} orphaned node(s) in {report['batches']} batch(es) "
+                    f"and {report['seconds']:.2f}s."
+                )
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,48 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from ruleit.models import Rule
+from ruleit.compiler import get_compiled_rule, evaluate_ndjson
+from ruleit.parallel import evaluate_ndjson_parallel
+
+
+class Command(BaseCommand):
+    help = "Evaluates newline-delimited JSON records against a rule, streaming one result line per record."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rule-id', type=int, help='Id of the rule to evaluate.')
+        parser.add_argument('--rule-name', help='Name of the rule to evaluate.')
+        parser.add_argument('--input', default='-', help='NDJSON file to read, defaults to stdin.')
+        parser.add_argument('--output', default='-', help='File to write the results to, defaults to stdout.')
+        parser.add_argument('--parallel', action='store_true', help='Shard the records across a pool of worker processes.')
+        parser.add_argument('--workers', type=int, help='Number of worker processes, defaults to the CPU count.')
+        parser.add_argument('--chunk-size', type=int, help='Records sent to a worker at a time.')
+
+    def handle(self, *args, **options):
+        if not options['rule_id'] and not options['rule_name']:
+            raise CommandError('Must provide either --rule-id or --rule-name.')
+
+        try:
+            compiled_rule = get_compiled_rule(rule_id=options['rule_id'], rule_name=options['rule_name'])
+        except Rule.DoesNotExist:
+            raise CommandError('Rule not found.')
+
+        source = sys.stdin if options['input'] == '-' else open(options['input'], encoding='utf-8')
+        target = None if options['output'] == '-' else open(options['output'], 'w', encoding='utf-8')
+        if options['parallel']:
+            results = evaluate_ndjson_parallel(
+                compiled_rule.program, source, workers=options['workers'], chunk_size=options['chunk_size']
+            )
+        else:
+            results = evaluate_ndjson(compiled_rule.evaluate, source)
+
+        try:
+            for line in results:
+                if target is None:
+                    self.stdout.write(line, ending='')
+                else:
+                    target.write(line)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if target is not None:
+                target.close()
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from ruleit.importer import FORMATS, guess_format, read_rules, import_rules
+
+
+class Command(BaseCommand):
+    help = "Creates the rules of a JSON, NDJSON or CSV catalog of rule_name, rule_string rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='The catalog file.')
+        parser.add_argument('--format', choices=FORMATS, help='Format of the catalog, guessed from its extension by default.')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Rules parsed and saved per transaction.')
+        parser.add_argument('--workers', type=int, default=1, help='Number of processes parsing the rules.')
+
+    def handle(self, *args, **options):
+        format = options['format'] or guess_format(options['path'])
+        if format is None:
+            raise CommandError(f"Cannot tell the format of {options['path']}, use --format.")
+
+        try:
+            with open(options['path'], encoding='utf-8', newline='') as source:
+                report = import_rules(
+                    read_rules(source, format), chunk_size=options['chunk_size'], workers=options['workers']
+                )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for error in report['errors']:
+            self.stderr.write(f"Row {error['row']} ({error['rule_name'] or 'unnamed'}): {error['error']}")
+        self.stdout.write(f"Created {report['created']} rule(s), {len(report['errors'])} error(s).")
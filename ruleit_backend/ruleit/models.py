@@ -14,6 +14,10 @@ class Node(models.Model):
     left = models.ForeignKey('self', null=True, blank=True, related_name='left_child', on_delete=models.CASCADE)
     right = models.ForeignKey('self', null=True, blank=True, related_name='right_child', on_delete=models.CASCADE)
     value = models.CharField(max_length=255, null=True, blank=True)
+    structure_hash = models.CharField(
+        max_length=32, null=True, blank=True, unique=True,
+        help_text="Hash of the node and its subtree, identical subtrees are stored once and shared across rules."
+    )
 
     def __str__(self):
         return f"{self.node_type}: {self.value or 'None'}"
@@ -24,12 +28,46 @@ class Node(models.Model):
 
 class Rule(models.Model):
     rule_name = models.CharField(max_length=225, null=True, blank=True, unique=True)
-    rule_root = models.OneToOneField(Node, on_delete=models.CASCADE)
+    rule_root = models.ForeignKey(Node, related_name='rules', on_delete=models.PROTECT)
     rule_tokens = ArrayField(
         models.CharField(max_length=255),
         blank=True,
         null=True,
         help_text="Stores the tokenized version of the rule string."
     )
+    program = models.JSONField(
+        null=True,
+        blank=True,
+        help_text="The rule tree as a postfix program of [node_type, value] pairs, so it can be loaded without reading its nodes."
+    )
+    version = models.PositiveIntegerField(
+        default=1,
+        help_text="Incremented every time the rule is edited or rolled back, so cached forms of the rule can be told apart."
+    )
+    def __str__(self):
+        return self.rule_name or f"Rule id:{self.id}\nRule: {self.rule_tokens}"
+
+class RuleVersion(models.Model):
+    """
+    An immutable version of a rule. The Rule row holds a copy of its current version, so
+    reading a rule never needs this table.
+    """
+    rule = models.ForeignKey(Rule, related_name='versions', on_delete=models.CASCADE)
+    version = models.PositiveIntegerField()
+    rule_root = models.ForeignKey(Node, related_name='rule_versions', on_delete=models.PROTECT)
+    rule_tokens = ArrayField(models.CharField(max_length=255), blank=True, null=True)
+    program = models.JSONField(null=True, blank=True)
+    restored_from = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="The version this one rolled the rule back to, if any."
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['rule', 'version'], name='unique_rule_version'),
+        ]
+
     def __str__(self):
-        return self.rule_name or f"Rule id:{self.id}\nRule: {self.rule_tokens}"
\ No newline at end of file
+        return f"{self.rule} v{self.version}"
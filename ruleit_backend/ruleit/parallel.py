@@ -0,0 +1,117 @@
+# parallel.py
+# Process-pool evaluation and parsing for bulk jobs. Workers get the serialized program of a rule, never
+# ORM objects, and compile it once when they start. This module only imports Django lazily so
+# worker processes can import it before Django is set up in them.
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+_evaluate = None
+
+
+def _init_worker(program):
+    global _evaluate
+
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+    from .utils import build_tree
+    from .compiler import compile_tree
+    _evaluate = compile_tree(build_tree(program))
+
+def _init_parser():
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+def parse_rules_chunk(rule_strings):
+    """
+    Parses rule strings into tokens and postfix tokens.
+
+    Returns:
+        list: One {'tokens': ..., 'postfix': ...} or {'error': ...} entry per rule string, in input order.
+    """
+    from .utils import parse_rule
+    results = []
+    for rule_string in rule_strings:
+        try:
+            rule_tokens, postfix_tokens = parse_rule(rule_string)
+            results.append({'tokens': rule_tokens, 'postfix': postfix_tokens})
+        except ValueError as e:
+            results.append({'error': str(e)})
+    return results
+
+def parser_pool(workers=None):
+    """
+    Returns a pool of worker processes ready to run parse_rules_chunk.
+    """
+    return ProcessPoolExecutor(max_workers=workers or _default_workers(), initializer=_init_parser)
+
+def _evaluate_records_chunk(records):
+    from .compiler import evaluate_records
+    return list(evaluate_records(_evaluate, records))
+
+def _evaluate_lines_chunk(lines):
+    from .compiler import evaluate_ndjson
+    return list(evaluate_ndjson(_evaluate, lines))
+
+
+def _chunks(items, chunk_size):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def _default_workers():
+    from django.conf import settings
+    return getattr(settings, 'RULEIT_PARALLEL_WORKERS', None) or os.cpu_count() or 1
+
+def _default_chunk_size():
+    from django.conf import settings
+    return getattr(settings, 'RULEIT_PARALLEL_CHUNK_SIZE', 1000)
+
+
+def _run(program, items, task, workers, chunk_size):
+    workers = workers or _default_workers()
+    chunk_size = chunk_size or _default_chunk_size()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(program,)) as executor:
+        # Only a few chunks per worker are in flight, so the input is consumed lazily
+        pending = deque()
+        for chunk in _chunks(items, chunk_size):
+            pending.append(executor.submit(task, chunk))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def evaluate_parallel(program, records, workers=None, chunk_size=None):
+    """
+    Evaluates records against a rule program across a pool of worker processes.
+
+    Args:
+        program (list): The rule program, as produced by dump_tree.
+        records (iterable): The data records.
+        workers (int, optional): Number of worker processes, defaults to RULEIT_PARALLEL_WORKERS or the CPU count.
+        chunk_size (int, optional): Records sent to a worker at a time, defaults to RULEIT_PARALLEL_CHUNK_SIZE.
+
+    Yields:
+        dict: One {'result': ...} or {'error': ...} entry per record, in input order.
+    """
+    return _run(program, records, _evaluate_records_chunk, workers, chunk_size)
+
+def evaluate_ndjson_parallel(program, lines, workers=None, chunk_size=None):
+    """
+    Parallel version of evaluate_ndjson. JSON decoding and encoding happen in the workers too.
+
+    Yields:
+        str: The JSON encoded result of each record followed by a newline, in input order.
+    """
+    return _run(program, lines, _evaluate_lines_chunk, workers, chunk_size)
@@ -5,4 +5,4 @@ from .models import Rule
 class RuleSerializer(serializers.ModelSerializer):
     class Meta:
         model = Rule
-        fields = ['id', 'rule_name', 'rule_root', 'rule_tokens']  # Include fields you need
+        fields = ['id', 'rule_name', 'rule_root', 'rule_tokens', 'program']  # Include fields you need
@@ -0,0 +1,265 @@
+# sql.py
+# Translation of rule ASTs into parameterized SQL conditions, so rules can filter rows in the database.
+from django.db import connection
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from .utils import is_number
+from .compiler import _eq, _ne
+
+NUMBER, TEXT, BOOLEAN, LITERAL = 'number', 'text', 'boolean', 'literal'
+
+ORDERING_OPERATORS = {'>', '<', '>=', '<='}
+ARITHMETIC_OPERATORS = {'+', '-', '*', '/', '%'}
+
+# Model fields by the kind of value evaluate_rule would see for them
+NUMBER_FIELDS = {
+    'AutoField', 'BigAutoField', 'SmallAutoField', 'IntegerField', 'BigIntegerField', 'SmallIntegerField',
+    'PositiveIntegerField', 'PositiveBigIntegerField', 'PositiveSmallIntegerField', 'FloatField', 'DecimalField',
+}
+TEXT_FIELDS = {'CharField', 'TextField', 'SlugField', 'EmailField', 'URLField'}
+
+
+class UntranslatableRule(ValueError):
+    """
+    Raised when a rule uses something SQL cannot express with the same results as evaluate_rule.
+    """
+    pass
+
+
+class _Expression:
+    def __init__(self, sql, params, kind, literal=None):
+        self.sql = sql
+        self.params = params
+        self.kind = kind
+        self.literal = literal
+
+
+class SQLTranslator:
+    """
+    Translates a rule AST into a SQL condition that holds for exactly the rows evaluate_rule
+    returns a truthy result for.
+
+    Variables map to columns, given as {variable: (sql, kind)} with kind 'number', 'text' or
+    'boolean'. NULL stands for None: comparisons and arithmetic propagate it like evaluate_rule
+    does, and AND/OR are translated so a None left side never lets the rule match.
+    Literals are always passed as parameters.
+
+    Raises UntranslatableRule for anything whose outcome could differ per row in ways SQL cannot
+    express: unsupported operators, division by anything but a non-zero literal, text columns
+    used as numbers or compared with numbers, and variables without a column.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def translate(self, ast_root):
+        """
+        Returns:
+            tuple: The SQL condition and its parameters.
+        """
+        condition = self.condition(ast_root)
+        return condition.sql, condition.params
+
+    def condition(self, node):
+        # Only truthiness matters here, so None and False can be treated alike
+        if node is not None and node.node_type == 'operator' and node.value == 'AND':
+            left, right = self.condition(node.left), self.condition(node.right)
+            return _Expression(f"({left.sql} AND {right.sql})", left.params + right.params, BOOLEAN)
+
+        if node is not None and node.node_type == 'operator' and node.value == 'OR':
+            # A None left side makes the whole OR None, whatever the right side is
+            left, right = self.truth(self.expression(node.left)), self.condition(node.right)
+            return _Expression(
+                f"(({left.sql} OR {right.sql}) AND {left.sql} IS NOT NULL)",
+                left.params + right.params + left.params, BOOLEAN
+            )
+
+        return self.truth(self.expression(node))
+
+    def expression(self, node):
+        if node is None:
+            raise UntranslatableRule("Invalid tree structure.")
+
+        if node.node_type == 'literal':
+            return _Expression('%s', [node.value], LITERAL, literal=node.value)
+
+        if node.node_type == 'variable':
+            if node.value not in self.columns:
+                raise UntranslatableRule(f"Variable '{node.value}' has no matching column.")
+            sql, kind = self.columns[node.value]
+            return _Expression(sql, [], kind)
+
+        if node.node_type != 'operator':
+            raise UntranslatableRule(f"Unknown node type '{node.node_type}'.")
+
+        operator = node.value
+        left, right = self.expression(node.left), self.expression(node.right)
+
+        if operator == 'AND':
+            left, right = self.truth(left), self.truth(right)
+            return _Expression(
+                f"(CASE WHEN {left.sql} IS NULL THEN NULL WHEN NOT {left.sql} THEN FALSE ELSE {right.sql} END)",
+                left.params + left.params + right.params, BOOLEAN
+            )
+        if operator == 'OR':
+            left, right = self.truth(left), self.truth(right)
+            return _Expression(
+                f"(CASE WHEN {left.sql} IS NULL THEN NULL WHEN {left.sql} THEN TRUE ELSE {right.sql} END)",
+                left.params + left.params + right.params, BOOLEAN
+            )
+        if operator == 'XOR':
+            left, right = self.truth(left), self.truth(right)
+            return _Expression(f"({left.sql} <> {right.sql})", left.params + right.params, BOOLEAN)
+
+        if operator in ORDERING_OPERATORS:
+            left, right = self.number(left), self.number(right)
+            return _Expression(f"({left.sql} {operator} {right.sql})", left.params + right.params, BOOLEAN)
+
+        if operator in ARITHMETIC_OPERATORS:
+            return self.arithmetic(operator, left, right)
+
+        if operator in ('=', '==', '!='):
+            return self.equality(left, right, operator == '!=')
+
+        raise UntranslatableRule(f"Operator '{operator}' cannot be translated to SQL.")
+
+    def number(self, expression):
+        # The expression as to_float would see it
+        if expression.kind == LITERAL:
+            if not is_number(expression.literal):
+                raise UntranslatableRule(f"Literal '{expression.literal}' is used as a number.")
+            number = float(expression.literal)
+            # Integral values stay integers so comparisons with integer columns can use their indexes
+            if number.is_integer() and abs(number) < 2 ** 53:
+                number = int(number)
+            return _Expression('%s', [number], NUMBER)
+        if expression.kind == NUMBER:
+            return expression
+        if expression.kind == BOOLEAN:
+            return _Expression(
+                f"(CASE WHEN {expression.sql} THEN 1 WHEN NOT {expression.sql} THEN 0 END)",
+                expression.params + expression.params, NUMBER
+            )
+        raise UntranslatableRule("A text column is used as a number.")
+
+    def truth(self, expression):
+        # The expression as to_bool would see it, NULL stays NULL
+        if expression.kind == LITERAL:
+            return _Expression('TRUE' if expression.literal else 'FALSE', [], BOOLEAN)
+        if expression.kind == BOOLEAN:
+            return expression
+        if expression.kind == NUMBER:
+            return _Expression(f"({expression.sql} <> 0)", expression.params, BOOLEAN)
+        return _Expression(f"({expression.sql} <> '')", expression.params, BOOLEAN)
+
+    def arithmetic(self, operator, left, right):
+        if operator in ('/', '%') and (right.kind != LITERAL or not is_number(right.literal) or float(right.literal) == 0):
+            raise UntranslatableRule(f"The divisor of '{operator}' must be a non-zero number for the rule to be translated.")
+
+        # Computed in double precision like Python floats, so integer columns neither truncate nor overflow
+        left, right = self.number(left), self.number(right)
+        left_sql = f"CAST({left.sql} AS double precision)"
+        right_sql = f"CAST({right.sql} AS double precision)"
+        if operator == '%':
+            # Python's % takes the sign of the divisor
+            return _Expression(
+                f"({left_sql} - {right_sql} * floor({left_sql} / {right_sql}))",
+                left.params + right.params + left.params + right.params, NUMBER
+            )
+        return _Expression(f"({left_sql} {operator} {right_sql})", left.params + right.params, NUMBER)
+
+    def equality(self, left, right, negate):
+        compare = '<>' if negate else '='
+
+        if left.kind == LITERAL and right.kind == LITERAL:
+            # Nothing depends on the row, so the comparison is made once here
+            equal = (_ne if negate else _eq)(left.literal, right.literal)
+            return _Expression('TRUE' if equal else 'FALSE', [], BOOLEAN)
+
+        def numeric(expression):
+            return expression.kind in (NUMBER, BOOLEAN) or (expression.kind == LITERAL and is_number(expression.literal))
+
+        if numeric(left) and numeric(right):
+            left, right = self.number(left), self.number(right)
+            return _Expression(f"({left.sql} {compare} {right.sql})", left.params + right.params, BOOLEAN)
+
+        if TEXT in (left.kind, right.kind):
+            text, other = (left, right) if left.kind == TEXT else (right, left)
+            if other.kind == LITERAL and not is_number(other.literal):
+                return _Expression(f"({text.sql} {compare} %s)", text.params + [other.literal], BOOLEAN)
+            # Numeric strings compare as numbers, which SQL cannot tell apart safely
+            raise UntranslatableRule("A text column can only be compared with a literal that is not a number.")
+
+        # A number and a literal that is not a number are never equal, unless the number is None
+        value = left if numeric(left) else right
+        return _Expression(
+            f"(CASE WHEN {value.sql} IS NULL THEN NULL ELSE {'TRUE' if negate else 'FALSE'} END)",
+            value.params, BOOLEAN
+        )
+
+
+def rule_to_sql(ast_root, columns):
+    """
+    Translates a rule into a parameterized SQL condition.
+
+    Args:
+        ast_root (Node): The root of the rule AST.
+        columns (dict): Variable name to (column SQL, kind) mapping, kind being 'number', 'text' or 'boolean'.
+
+    Returns:
+        tuple: The SQL condition and its parameters.
+
+    Raises:
+        UntranslatableRule: If the rule cannot be expressed in SQL with the same results.
+    """
+    return SQLTranslator(columns).translate(ast_root)
+
+
+def model_columns(model, fields=None):
+    """
+    Describes the concrete fields of a model as columns for rule_to_sql.
+
+    Args:
+        model: The Django model.
+        fields (dict, optional): Variable name to field name mapping, variables map to the
+            field of the same name by default.
+    """
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    by_name = {field.name: field for field in model._meta.concrete_fields}
+    by_name.update({field.attname: field for field in model._meta.concrete_fields})
+
+    columns = {}
+    for variable, field_name in (fields or {name: name for name in by_name}).items():
+        field = by_name.get(field_name)
+        if field is None:
+            continue
+        field_type = field.get_internal_type()
+        if field_type in NUMBER_FIELDS or field.is_relation:
+            kind = NUMBER
+        elif field_type in TEXT_FIELDS:
+            kind = TEXT
+        elif field_type == 'BooleanField':
+            kind = BOOLEAN
+        else:
+            continue
+        columns[variable] = (f"{table}.{quote(field.column)}", kind)
+    return columns
+
+
+def filter_rule(queryset, ast_root, fields=None):
+    """
+    Filters a queryset down to the rows a rule matches, in a single query.
+
+    Every row is read as the data evaluate_rule would get, with one variable per field.
+
+    Args:
+        queryset (QuerySet): The rows to filter.
+        ast_root (Node): The root of the rule AST.
+        fields (dict, optional): Variable name to field name mapping.
+
+    Raises:
+        UntranslatableRule: If the rule cannot be expressed in SQL with the same results.
+    """
+    sql, params = rule_to_sql(ast_root, model_columns(queryset.model, fields))
+    return queryset.filter(RawSQL(sql, params, output_field=BooleanField()))
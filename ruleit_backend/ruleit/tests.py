@@ -1,9 +1,39 @@
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
-from .models import Rule, Node
+from .models import Rule, Node, RuleVersion
+from .utils import parse_rule, rollback_rule, create_rule, combine_rules, combine_stored_rules, evaluate_rule, load_rule_tree, edit_rule, build_tree, dump_tree, tokenize, infix_to_postfix, optimize_postfix, is_number, PRECEDENCE
+from .codegen import compile_native
+from .columnar import evaluate_columns
+from .sql import filter_rule, UntranslatableRule
+from .delta import DeltaRule, delta_rules, evaluation_states
+from .compiler import compile_tree, get_compiled_rule, SharedRuleCompiler, RuleCompiler, Record
+from .index import rule_index
+from .collector import count_orphaned_nodes, prune_versions
+from .invalidation import origin, CHANNEL, RuleChangeListener, apply_notification, poll_rule_versions
+from .cache import compiled_rules, merged_rule_sets, evaluation_results, parsed_rules
 from rest_framework.test import APIClient
+from django.core.management import call_command
+from django.test import override_settings
+from django.db import connection
+import io
+import os
+import json
+import tempfile
+import unittest
+from unittest import mock
+import importlib.util
+import time
 
+def outcome(function, data):
+    # The result of a call, or the type and message of the exception it raised
+    try:
+        return function(data)
+    except Exception as e:
+        return (type(e), str(e))
+
+# Listener threads would keep connections to the test database open
+@override_settings(RULEIT_INVALIDATION_LISTENER=False)
 class RuleTests(APITestCase):
 
     @classmethod
@@ -45,6 +75,25 @@ class RuleTests(APITestCase):
             response_data = response.json()
             cls.combined_rule_id = response_data['rule_id']
 
+    def assertMatchesInterpreter(self, evaluator, ast_root, values, variables):
+        """
+        Checks that evaluator gives the result or raises the error evaluate_rule does, for every
+        value in every variable while the other variables hold the remaining values in turn.
+        """
+        for i, variable in enumerate(variables):
+            for value in values:
+                data = {name: values[(i + j) % len(values)] for j, name in enumerate(variables)}
+                data[variable] = value
+                self.assertEqual(outcome(evaluator, data), outcome(lambda d: evaluate_rule(ast_root, d), data))
+
+    def setUp(self):
+        # Rolled back test transactions are invisible to the per-process caches
+        compiled_rules.clear()
+        merged_rule_sets.clear()
+        evaluation_results.clear()
+        delta_rules.clear()
+        evaluation_states.clear()
+
     def test_get_all_rules(self):
         # Testing the API to get all rules
         url = reverse('get_rules')
@@ -144,4 +193,670 @@ class RuleTests(APITestCase):
         print(result)
         self.assertFalse(result, "Expected False for incomplete data, as it can not pass the rule")
 
+    def test_load_rule_tree_single_query(self):
+        rule = Rule.objects.get(id=self.combined_rule_id)
+        data = {
+            'age': 24,
+            'department': 'Marketing',
+            'salary': 60000,
+            'experience': 6
+        }
+
+        # The stored program is decoded without any query
+        with self.assertNumQueries(0):
+            ast_root = load_rule_tree(rule)
+        self.assertTrue(evaluate_rule(ast_root, data))
+
+        # Without one the whole tree is fetched at once and evaluation runs without further queries
+        rule.program = None
+        with self.assertNumQueries(1):
+            ast_root = load_rule_tree(rule)
+        with self.assertNumQueries(0):
+            result = evaluate_rule(ast_root, data)
+        self.assertTrue(result)
+
+    def test_compiled_rule_matches_interpreter(self):
+        ast_root = load_rule_tree(Rule.objects.get(id=self.combined_rule_id))
+        evaluator = compile_tree(ast_root)
+        records = [
+            {'age': 24, 'department': 'Marketing', 'salary': 60000, 'experience': 6},
+            {'age': 40, 'department': 'HR', 'salary': 15000, 'experience': 2},
+            {'age': 28, 'department': 'Marketing', 'salary': 22000, 'experience': 2},
+            {'age': 40, 'department': 'Sales'},
+            {},
+        ]
+        for data in records:
+            self.assertEqual(evaluator(data), evaluate_rule(ast_root, data))
+
+    def test_compiled_rule_cache(self):
+        compiled_rule = get_compiled_rule(rule_id=self.rule_id)
+
+        # Cached rules are served without touching the database
+        with self.assertNumQueries(0):
+            self.assertIs(get_compiled_rule(rule_id=self.rule_id), compiled_rule)
+            self.assertTrue(compiled_rule.evaluate({'a': 5, 'b': 3}))
+
+        # Editing the rule bumps its version and drops the stale compiled form
+        edit_rule('a < b', self.rule_id)
+        edited_rule = get_compiled_rule(rule_id=self.rule_id)
+        self.assertEqual(edited_rule.version, compiled_rule.version + 1)
+        self.assertFalse(edited_rule.evaluate({'a': 5, 'b': 3}))
+
+    def test_batch_evaluation(self):
+        data = {
+            'rule_id': self.combined_rule_id,
+            'records': [
+                {'age': 24, 'department': 'Marketing', 'salary': 60000, 'experience': 6},
+                {'age': 40, 'department': 'HR', 'salary': 15000, 'experience': 2},
+                {'age': 'old', 'department': 'Sales'},
+                'not a record',
+            ]
+        }
+        url = reverse('evaluate_rule_batch')
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json().get('results')
+
+        # Results come back in order, with per-record errors reported in place
+        self.assertEqual(results[0], {'result': True})
+        self.assertEqual(results[1], {'result': False})
+        self.assertIn('error', results[2])
+        self.assertIn('error', results[3])
+
+    def test_match_rules(self):
+        data = {
+            'data': {'age': 24, 'department': 'Marketing', 'salary': 60000, 'experience': 6, 'a': 1, 'b': 2},
+            'all': True
+        }
+        url = reverse('match_rules')
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['matched_rule_ids'], [self.combined_rule_id])
+
+        data = {'data': {'a': 2, 'b': 1}, 'rule_ids': [self.rule_id]}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.json()['matched_rule_ids'], [self.rule_id])
+
+        data = {'data': {'a': 2, 'b': 1}}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_shared_predicates_are_merged(self):
+        first = create_rule("age > 30 AND department = 'Sales'", None)
+        second = create_rule("age > 30 OR salary > 100", None)
+
+        # The two rules store 14 nodes, 'age > 30' and its operands are shared in the merged DAG
+        compiler = SharedRuleCompiler()
+        compiler.compile(load_rule_tree(first))
+        compiler.compile(load_rule_tree(second))
+        self.assertEqual(len(compiler), 11)
+
+    def test_predicate_index_prunes_rules(self):
+        sales = create_rule("age > 30 AND department = 'Sales'", None)
+        young = create_rule("25 > age", None)
+        unindexed = create_rule("a > b OR age > 30", None)
+        rules = [(rule.id, rule.version) for rule in (sales, young, unindexed)]
+
+        candidates = rule_index.candidates({'age': 40, 'department': 'Sales'}, rules)
+        self.assertEqual(candidates, {sales.id, unindexed.id})
+        candidates = rule_index.candidates({'age': '20', 'department': 'Sales'}, rules)
+        self.assertEqual(candidates, {young.id, unindexed.id})
+
+        # Edited rules are re-indexed at their new version
+        edit_rule("department = 'HR'", sales.id)
+        sales.refresh_from_db()
+        rules[0] = (sales.id, sales.version)
+        candidates = rule_index.candidates({'age': 40, 'department': 'Sales'}, rules)
+        self.assertEqual(candidates, {unindexed.id})
+
+    def test_stream_evaluation(self):
+        body = '{"a": 5, "b": 3}\n\n{"a": 1, "b": 3}\nnot json\n'
+        url = reverse('evaluate_rule_stream') + f'?rule_id={self.rule_id}'
+        response = self.client.post(url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        results = [json.loads(line) for line in lines]
+        self.assertEqual(results[:2], [{'result': True}, {'result': False}])
+        self.assertIn('error', results[2])
+
+    def test_evaluate_ndjson_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False) as records:
+            records.write('{"a": 5, "b": 3}\n{"a": 1, "b": 3}\n')
+        self.addCleanup(os.remove, records.name)
+
+        stdout = io.StringIO()
+        call_command('evaluate_ndjson', rule_id=self.rule_id, input=records.name, stdout=stdout)
+        self.assertEqual(stdout.getvalue().splitlines(), ['{"result": true}', '{"result": false}'])
+
+    async def test_async_evaluation(self):
+        url = reverse('evaluate_rule_async')
+        data = {'rule_id': self.rule_id, 'data': {'a': 5, 'b': 3}}
+        response = await self.async_client.post(url, data, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.json()['result'])
+
+        url = reverse('evaluate_rule_batch_async')
+        data = {'rule_name': 'testrule', 'records': [{'a': 1, 'b': 3}, {'a': 'x', 'b': 3}]}
+        response = await self.async_client.post(url, data, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual(results[0], {'result': False})
+        self.assertIn('error', results[1])
+
+        url = reverse('evaluate_rule_async')
+        response = await self.async_client.post(url, {'rule_name': 'missing'}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_parallel_batch_evaluation(self):
+        records = [{'a': i, 'b': 3} for i in range(10)] + ['not a record']
+        data = {'rule_id': self.rule_id, 'records': records, 'parallel': True, 'workers': 2, 'chunk_size': 3}
+        url = reverse('evaluate_rule_batch')
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+
+        # Results of the sharded evaluation come back in input order
+        self.assertEqual(results[:10], [{'result': i > 3} for i in range(10)])
+        self.assertIn('error', results[10])
+
+    def test_typed_literals_match_interpreter(self):
+        rule = create_rule(
+            "(age > 30 AND 'Sales' = department) OR salary * 12 >= 600000 OR (10 < experience AND code != 7) OR name == 'x' OR 5 = grade",
+            None
+        )
+        ast_root = load_rule_tree(rule)
+        evaluator = compile_tree(ast_root)
+        values = [None, 0, 7, 31, 50000.5, '7', '31', 'Sales', 'x', 'abc', True, [1]]
+        variables = ['age', 'department', 'salary', 'experience', 'code', 'name', 'grade']
+        self.assertMatchesInterpreter(evaluator, ast_root, values, variables)
+
+    def test_constant_folding_and_simplification(self):
+        rule = create_rule("salary * 12 > 50000 * 12 AND (age > 10) AND (age > 10) AND 1 < 2", None)
+        self.assertEqual(
+            [value for _, value in dump_tree(load_rule_tree(rule))],
+            ['salary', '12', '*', '600000', '>', 'age', '10', '>', 'AND']
+        )
+
+        def program(tokens):
+            return [
+                ['operator', token] if token in PRECEDENCE
+                else ['literal' if token[0] in '"\'' or is_number(token) else 'variable', token.strip('"\'')]
+                for token in tokens
+            ]
+
+        rules = [
+            "salary * (2 + 10) > 50000 * 12 - 1 / 2 AND (age > 10) AND (age > 10) AND 1 < 2",
+            "age > 30 AND (age > 30 OR x = 1) OR 2 > 3 OR age + (1 - 1) = 1 / 4",
+            "flag AND 1 OR 0 AND flag",
+            "x > 2 / 0 OR 'a' = 'a' AND x",
+        ]
+        values = [None, 0, 1, 31, '31', 'abc', True]
+        for rule_string in rules:
+            postfix_tokens = infix_to_postfix(tokenize(rule_string))
+            optimized_tokens = optimize_postfix(postfix_tokens)
+            original, optimized = build_tree(program(postfix_tokens)), build_tree(program(optimized_tokens))
+            for value in values:
+                for other in values:
+                    data = {'salary': value, 'age': other, 'x': value, 'flag': other}
+                    self.assertEqual(
+                        outcome(lambda d: evaluate_rule(optimized, d), data), outcome(lambda d: evaluate_rule(original, d), data)
+                    )
+
+    def test_adaptive_ordering(self):
+        rule = create_rule("(age > 30 AND salary * 12 >= 600000 AND department = 'Sales') OR experience / 2 > 3", None)
+        ast_root = load_rule_tree(rule)
+        compiler = RuleCompiler(adaptive=True, sample_rate=2, reorder_interval=8)
+        evaluator = compiler.compile(ast_root)
+        self.assertEqual(len(compiler.runs), 1)
+
+        # department rarely matches, so it moves to the front of the AND run
+        for age in range(40):
+            evaluator({'age': 40 + age, 'salary': 60000, 'department': 'Marketing', 'experience': 1})
+        self.assertEqual(compiler.runs[0].order[0], 2)
+
+        values = [None, 0, 31, '31', 60000, 'Sales', 'abc', True, [1]]
+        self.assertMatchesInterpreter(evaluator, ast_root, values, ['age', 'salary', 'department', 'experience'])
+
+    @override_settings(RULEIT_RESULT_CACHE=True)
+    def test_result_cache(self):
+        url = reverse('evaluate_rule')
+        for request_id in range(3):
+            response = self.client.post(url, {'rule_id': self.rule_id, 'data': {'a': 5, 'b': 3, 'request_id': request_id}}, format='json')
+            self.assertTrue(response.json()['result'])
+
+        # Fields the rule does not read do not change the key
+        stats = self.client.get(reverse('evaluation_cache_stats')).json()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (2, 1, 1))
+
+        # Editing the rule drops its cached results
+        edit_rule('a < b', self.rule_id)
+        self.assertEqual(len(evaluation_results), 0)
+        response = self.client.post(url, {'rule_id': self.rule_id, 'data': {'a': 5, 'b': 3}}, format='json')
+        self.assertFalse(response.json()['result'])
+
+    def test_native_engine_matches_interpreter(self):
+        rules = [
+            "(age > 30 AND 'Sales' = department) OR salary * 12 >= 600000 OR (10 < experience AND code != 7) OR name == 'x'",
+            "(salary / code > 2 XOR experience % 3 = 1) AND 5 = grade OR department != name",
+            "age NAND grade OR 'x' > age",
+        ]
+        values = [None, 0, 7, 31, 50000.5, '7', '31', 'Sales', 'x', 'abc', True, [1]]
+        variables = ['age', 'department', 'salary', 'experience', 'code', 'name', 'grade']
+        for rule_string in rules:
+            ast_root = load_rule_tree(create_rule(rule_string, None))
+            self.assertMatchesInterpreter(compile_native(ast_root), ast_root, values, variables)
+
+        # Literals and variable names only ever reach the generated code through the constants pool
+        ast_root = build_tree([['variable', 'name'], ['literal', "x') or __import__('os"], ['operator', '=']])
+        evaluator = compile_native(ast_root)
+        self.assertNotIn('__import__', evaluator.source)
+        self.assertNotIn('name', evaluator.source)
+        self.assertTrue(evaluator({'name': "x') or __import__('os"}))
+
+    def test_evaluate_engine_selection(self):
+        url = reverse('evaluate_rule')
+        for engine in ('compiled', 'native', 'interpreter'):
+            response = self.client.post(url, {'rule_id': self.rule_id, 'data': {'a': 5, 'b': 3}, 'engine': engine}, format='json')
+            self.assertTrue(response.json()['result'])
+
+        response = self.client.post(url, {'rule_id': self.rule_id, 'data': {'a': 5, 'b': 3}, 'engine': 'jit'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_delta_evaluation(self):
+        ast_root = load_rule_tree(Rule.objects.get(id=self.combined_rule_id))
+        delta_rule = DeltaRule(self.combined_rule_id, 1, ast_root)
+        data = {'age': 24, 'department': 'Marketing', 'salary': 60000, 'experience': 6}
+        result, record = delta_rule.evaluate(data)
+
+        # Fields the rule does not read keep every per-node result
+        _, updated = delta_rule.reevaluate(record, {'city': 'Pune'})
+        self.assertEqual(updated.memo, record.memo)
+
+        changes = [{'salary': 10000}, {'experience': 2}, {'age': 35}, {'department': 'Sales'}, {'age': None}, {'age': 'x'}, {'age': 31}]
+        for change in changes:
+            data.update(change)
+            expected = outcome(lambda d: evaluate_rule(ast_root, d), data)
+            try:
+                result, record = delta_rule.reevaluate(record, change)
+            except Exception as e:
+                result = (type(e), str(e))
+                record = Record(data)
+            self.assertEqual(result, expected)
+
+        url = reverse('evaluate_rule_delta')
+        response = self.client.post(url, {'rule_id': self.combined_rule_id, 'data': {'age': 24, 'department': 'Marketing', 'salary': 60000, 'experience': 6}}, format='json')
+        self.assertTrue(response.json()['result'])
+        handle = response.json()['handle']
+        response = self.client.post(url, {'handle': handle, 'changes': {'department': 'Sales'}}, format='json')
+        self.assertFalse(response.json()['result'])
+        response = self.client.post(url, {'handle': 'unknown', 'changes': {}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_columnar_evaluation_without_numpy(self):
+        with mock.patch.dict('sys.modules', {'numpy': None}):
+            with self.assertRaisesRegex(RuntimeError, 'requires NumPy'):
+                evaluate_columns(build_tree([['variable', 'age'], ['literal', '30'], ['operator', '>']]), {'age': [40]})
+
+    @unittest.skipUnless(importlib.util.find_spec('numpy'), 'NumPy is not installed')
+    def test_columnar_evaluation(self):
+        import numpy as np
+
+        ast_root = load_rule_tree(Rule.objects.get(id=self.combined_rule_id))
+        columns = {
+            'age': np.array([24, 35, 35, 22, 40, 31]),
+            'department': ['Marketing', 'Sales', 'Sales', None, 'Sales', 'Sales'],
+            'salary': np.ma.masked_array([60000.0, 40000.0, 70000.0, 10.0, 0.0, 1.0], mask=[0, 0, 0, 0, 1, 0]),
+            'experience': [6, 2, 'x', 1, 3, [1]],
+        }
+        result = evaluate_columns(ast_root, columns)
+
+        for row in range(6):
+            data = {name: (None if np.ma.is_masked(column[row]) else column[row]) for name, column in columns.items()}
+            try:
+                expected = evaluate_rule(ast_root, data)
+            except Exception:
+                self.assertTrue(result.errors[row])
+                continue
+            self.assertFalse(result.errors[row])
+            self.assertEqual(bool(result.missing[row]), expected is None)
+            self.assertEqual(bool(result.matched[row]), bool(expected))
+
+    def test_sql_translation(self):
+        rules = [
+            "node_type = 'literal' AND id > 3",
+            "left_id > 0 OR value = 'a'",
+            "id % 2 = 1 AND node_type != 'operator' OR value = 'x'",
+            "(left_id > 0 AND id < 0) OR value = 'AND'",
+            "id * 2 - 1 >= 7 XOR node_type = 'variable'",
+            "right_id - left_id = 1 OR left_id",
+        ]
+        nodes = list(Node.objects.all())
+        for rule_string in rules:
+            ast_root = load_rule_tree(create_rule(rule_string, None))
+            expected = {
+                node.id for node in nodes
+                if evaluate_rule(ast_root, {field.attname: getattr(node, field.attname) for field in Node._meta.concrete_fields})
+            }
+            matched = set(filter_rule(Node.objects.filter(id__in=[node.id for node in nodes]), ast_root).values_list('id', flat=True))
+            self.assertEqual(matched, expected, rule_string)
+
+        for rule_string in ["value > 3", "id / left_id > 1", "id NAND left_id", "value = 5", "id > 1 AND color = 'red'"]:
+            with self.assertRaises(UntranslatableRule):
+                filter_rule(Node.objects.all(), load_rule_tree(create_rule(rule_string, None)))
+
+    def test_nodes_inserted_per_level(self):
+        rule_string = "(a > 1 AND b < 2) OR (c >= 3 AND d <= 4) OR (e = 'x' AND f != 'y')"
+        postfix_tokens = optimize_postfix(infix_to_postfix(tokenize(rule_string)))
+        self.assertGreater(len(postfix_tokens), 20)
+
+        # One insert per tree level (five here), not per node, plus the node lock, the lookup
+        # of the stored subtrees, the rule, its first version, the notification and the savepoint around them
+        with self.assertNumQueries(5 + 7):
+            rule = create_rule(rule_string, None)
+        self.assertEqual(evaluate_rule(load_rule_tree(rule), {'a': 2, 'b': 1}), True)
+
+        # A failing edit leaves no nodes behind
+        node_count = Node.objects.count()
+        with self.assertRaises(Rule.DoesNotExist):
+            edit_rule("g > 1 AND h < 2", -1)
+        self.assertEqual(Node.objects.count(), node_count)
+
+    def test_identical_subtrees_are_shared(self):
+        first = create_rule("region = 'North' AND tenure > 7", None)
+        node_count = Node.objects.count()
+
+        # Only the nodes that are not stored yet are inserted
+        second = create_rule("region = 'North' OR level > 9", None)
+        self.assertEqual(Node.objects.count(), node_count + 4)
+        self.assertEqual(first.rule_root.left_id, second.rule_root.left_id)
+
+        # Identical rules share their whole tree
+        third = create_rule("region = 'North' AND tenure > 7", None)
+        self.assertEqual(third.rule_root_id, first.rule_root_id)
+        self.assertEqual(Node.objects.count(), node_count + 4)
+        self.assertEqual(evaluate_rule(load_rule_tree(third), {'region': 'North', 'tenure': 8}), True)
+
+    def test_backfill_programs_command(self):
+        rule = Rule.objects.get(id=self.combined_rule_id)
+        program = rule.program
+        self.assertEqual(program, dump_tree(build_tree(program)))
+
+        Rule.objects.update(program=None)
+        out = io.StringIO()
+        call_command('backfill_programs', batch_size=1, stdout=out)
+        self.assertIn(f"{Rule.objects.count()} rule(s)", out.getvalue())
+        rule.refresh_from_db()
+        self.assertEqual(rule.program, program)
+
+    def test_collect_orphaned_nodes_command(self):
+        orphaned = count_orphaned_nodes()
+        rule = create_rule("alpha > 101 AND (beta < 102 OR gamma = 'x')", None)
+        shared = create_rule("beta < 102 OR gamma = 'x'", None)
+        # The old version keeps its tree until it is pruned
+        edit_rule("alpha > 105", rule.id)
+        out = io.StringIO()
+        call_command('collect_nodes', dry_run=True, stdout=out)
+        self.assertIn(f"Found {orphaned} orphaned node(s)", out.getvalue())
+
+        # Then the AND node, the old comparison and its literal go, the subtree still used by the other rule stays
+        call_command('collect_nodes', keep_versions=1, batch_size=1, stdout=out)
+        self.assertIn("Deleted 1 old rule version(s)", out.getvalue())
+        self.assertIn(f"Deleted {orphaned + 3} orphaned node(s)", out.getvalue())
+        self.assertEqual(count_orphaned_nodes(), 0)
+        for current in Rule.objects.filter(id__in=[rule.id, shared.id]):
+            program = current.program
+            current.program = None
+            self.assertEqual(dump_tree(load_rule_tree(current)), program)
+
+    def test_combine_stored_rules(self):
+        rule_strings = ["score > 70 AND grade = 'A'", "score < 20", "retake = 1 OR grade = 'F'"]
+        rules = [create_rule(rule_string, f"stored_{index}") for index, rule_string in enumerate(rule_strings)]
+
+        # Only the two new operator nodes are inserted, the stored trees are reused
+        node_count = Node.objects.count()
+        combined = combine_stored_rules(None, [rules[0].id, rules[1].id, 'stored_2'], ['OR', 'AND'])
+        self.assertEqual(Node.objects.count(), node_count + 2)
+        self.assertEqual(combined.rule_root.left.left_id, rules[0].rule_root_id)
+        self.assertEqual(combined.rule_root.right_id, rules[2].rule_root_id)
+
+        # Combining the rule strings gives the very same tree
+        expected = combine_rules(None, rule_strings, ['OR', 'AND'])
+        self.assertEqual(expected.rule_root_id, combined.rule_root_id)
+        self.assertEqual(combined.program, expected.program)
+        self.assertEqual(evaluate_rule(load_rule_tree(combined), {'score': 10, 'retake': 1}), True)
+
+        url = reverse('combine_rules')
+        response = self.client.post(url, {'rule_names': ['stored_0', 'stored_1'], 'operators': ['XOR']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        combined = Rule.objects.get(id=response.json()['rule_id'])
+        self.assertEqual(evaluate_rule(load_rule_tree(combined), {'score': 10, 'grade': 'B'}), True)
+
+        response = self.client.post(url, {'rule_ids': [rules[0].id, -1]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_combine_hundreds_of_stored_rules(self):
+        # A master rule out of hundreds of rules is a chain as deep as the number of rules
+        rules = [create_rule(f"master_{index} >= {index}", f"master_{index}") for index in range(400)]
+        combined = combine_stored_rules('master', [rule.id for rule in rules], ['AND'] * 399)
+        data = {f'master_{index}': index for index in range(400)}
+        self.assertTrue(get_compiled_rule(rule_name='master').evaluate(data))
+        data['master_250'] = 0
+        self.assertFalse(get_compiled_rule(rule_id=combined.id).evaluate(data))
+
+    def test_combine_stored_rules_repeated(self):
+        rule_strings = ["units > 5", "units < 50", "region = 'EU'"]
+        rules = [create_rule(rule_string, f"repeated_{index}") for index, rule_string in enumerate(rule_strings)]
+
+        # The repeated (r2 NAND r3) is inserted once and shared by both sides
+        node_count = Node.objects.count()
+        ids = [rules[0].id, rules[1].id, rules[2].id, rules[1].id, rules[2].id]
+        combined = combine_stored_rules(None, ids, ['AND', 'NAND', 'OR', 'NAND'])
+        self.assertEqual(Node.objects.count(), node_count + 3)
+        self.assertEqual(combined.rule_root.left.right_id, combined.rule_root.right_id)
+
+        expected = combine_rules(None, rule_strings + rule_strings[1:], ['AND', 'NAND', 'OR', 'NAND'])
+        self.assertEqual(expected.rule_root_id, combined.rule_root_id)
+
+    def test_import_rules_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as catalog:
+            catalog.write(
+                "rule_name,rule_string\n"
+                "import_1,price > 10 AND region = 'EU'\n"
+                "import_2,price > 10 OR stock < 3\n"
+                "import_3,price > AND\n"
+                "import_1,stock = 0\n"
+                "testrule,stock > 1\n"
+                ",region = 'US'\n"
+            )
+        self.addCleanup(os.remove, catalog.name)
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_rules', catalog.name, chunk_size=2, workers=2, stdout=stdout, stderr=stderr)
+        self.assertIn("Created 3 rule(s), 3 error(s).", stdout.getvalue())
+        self.assertEqual([line.split(' ')[1] for line in stderr.getvalue().splitlines()], ['3', '4', '5'])
+
+        rule = Rule.objects.get(rule_name='import_2')
+        self.assertEqual(evaluate_rule(load_rule_tree(rule), {'price': 5, 'stock': 1}), True)
+        self.assertEqual(get_compiled_rule(rule_name='import_1').evaluate({'price': 11, 'region': 'EU'}), True)
+
+    def test_import_rules_view(self):
+        url = reverse('import_rules')
+        rules = [{'rule_name': 'api_1', 'rule_string': 'x > 1'}, {'rule_name': 'api_2', 'rule_string': '(x > 1'}, 'x < 2']
+        response = self.client.post(url, {'rules': rules}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['created'], 1)
+        self.assertEqual([error['row'] for error in response.json()['errors']], [2, 3])
+
+        ndjson = io.BytesIO(b'{"rule_name": "api_3", "rule_string": "y = 2"}\nnot json\n')
+        ndjson.name = 'rules.ndjson'
+        response = self.client.post(url, {'file': ndjson}, format='multipart')
+        self.assertEqual(response.json()['created'], 1)
+        self.assertEqual(response.json()['errors'][0]['row'], 2)
+        self.assertTrue(Rule.objects.filter(rule_name='api_3').exists())
+
+    def test_import_rules_invalid_types(self):
+        # Values of the wrong type are reported per row instead of failing the import
+        rules = [
+            {'rule_name': 'typed_1', 'rule_string': 5},
+            {'rule_name': ['typed_2'], 'rule_string': 'x > 1'},
+            {'rule_name': {'name': 'typed_3'}, 'rule_string': 'x > 1'},
+            {'rule_name': 'typed_4', 'rule_string': 'x > 4'},
+        ]
+        response = self.client.post(reverse('import_rules'), {'rules': rules}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['created'], 1)
+        self.assertEqual(
+            [(error['row'], error['error']) for error in response.json()['errors']],
+            [(1, 'rule_string must be a string.'), (2, 'rule_name must be a string.'), (3, 'rule_name must be a string.')]
+        )
+        self.assertTrue(Rule.objects.filter(rule_name='typed_4').exists())
+
+    def test_rule_versions_and_rollback(self):
+        rule = create_rule("tier = 'gold' AND spend > 100", 'versioned')
+        first_root = rule.rule_root_id
+        edit_rule("tier = 'gold' AND spend > 500", rule.id)
+        data = {'tier': 'gold', 'spend': 200}
+        self.assertEqual(get_compiled_rule(rule_name='versioned').evaluate(data), False)
+
+        # Earlier versions can be evaluated without touching the current one
+        self.assertEqual(get_compiled_rule(rule_name='versioned', version=1).evaluate(data), True)
+        self.assertEqual(get_compiled_rule(rule_name='versioned').version, 2)
+        url = reverse('evaluate_rule')
+        response = self.client.post(url, {'rule_id': rule.id, 'version': 1, 'data': data}, format='json')
+        self.assertTrue(response.json()['result'])
+        response = self.client.post(url, {'rule_id': rule.id, 'version': 7, 'data': data}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # A rollback points the rule back at the stored tree under a new version, without new nodes
+        node_count = Node.objects.count()
+        response = self.client.post(reverse('rollback_rule'), {'rule_id': rule.id, 'version': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['version'], 3)
+        self.assertEqual(response.json()['rule_root_id'], first_root)
+        self.assertEqual(Node.objects.count(), node_count)
+        self.assertEqual(get_compiled_rule(rule_id=rule.id).evaluate(data), True)
+
+        response = self.client.get(reverse('get_rule_versions', args=[rule.id]))
+        self.assertEqual([version['restored_from'] for version in response.json()['versions']], [None, None, 1])
+        response = self.client.post(reverse('rollback_rule'), {'rule_id': rule.id, 'version': 9}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rollback_and_prune_take_node_lock(self):
+        rule = create_rule("plan = 'pro' AND seats > 3", 'locked_versions')
+        edit_rule("plan = 'pro' AND seats > 10", rule.id)
+
+        # Both move references to trees, so they are serialized with the collector
+        with mock.patch('ruleit.utils.lock_nodes') as utils_lock:
+            rollback_rule(rule.id, 1)
+        utils_lock.assert_called_once_with()
+        with mock.patch('ruleit.collector.lock_nodes') as collector_lock:
+            self.assertGreaterEqual(prune_versions(1), 2)
+        collector_lock.assert_called_once_with(shared=False)
+        self.assertEqual(list(rule.versions.values_list('version', flat=True)), [3])
+
+    def test_cross_process_invalidation(self):
+        compiled = get_compiled_rule(rule_id=self.rule_id)
+        payload = lambda origin, version: json.dumps({'origin': origin, 'deleted': False, 'rules': [[self.rule_id, version, 'testrule']]})
+
+        # Notifications of this process and of versions already cached change nothing
+        apply_notification(payload(origin(), compiled.version + 1))
+        apply_notification(payload('elsewhere', compiled.version))
+        self.assertIs(get_compiled_rule(rule_id=self.rule_id), compiled)
+        apply_notification(payload('elsewhere', compiled.version + 1))
+        self.assertIsNone(compiled_rules.get(rule_id=self.rule_id))
+
+        # Polling catches the rules edited behind the cache's back
+        get_compiled_rule(rule_id=self.rule_id)
+        self.assertEqual(poll_rule_versions(), 0)
+        Rule.objects.filter(id=self.rule_id).update(version=compiled.version + 5)
+        self.assertEqual(poll_rule_versions(), 1)
+        self.assertEqual(get_compiled_rule(rule_id=self.rule_id).version, compiled.version + 5)
+
+        # Deleting a rule evicts it and publishes the deletion
+        rule = create_rule("discount > 5", 'deleted_rule')
+        get_compiled_rule(rule_name='deleted_rule')
+        rule.delete()
+        self.assertIsNone(compiled_rules.get(rule_name='deleted_rule'))
+
+    def test_invalidation_origin_after_fork(self):
+        compiled = get_compiled_rule(rule_id=self.rule_id)
+        sibling = origin()
+
+        # A worker forked after the app was imported gets its own origin, and applies its sibling's notifications
+        with mock.patch('ruleit.invalidation.os.getpid', return_value=os.getpid() + 1):
+            self.assertNotEqual(origin(), sibling)
+            apply_notification(json.dumps({'origin': sibling, 'deleted': False, 'rules': [[self.rule_id, compiled.version + 1, 'testrule']]}))
+            self.assertIsNone(compiled_rules.get(rule_id=self.rule_id))
+
+    def test_invalidation_listener(self):
+        listener = RuleChangeListener(poll_interval=1)
+        listener.start()
+        self.addCleanup(listener.join, 5)
+        self.addCleanup(listener.stop)
+        self.assertTrue(listener.listening.wait(5))
+
+        compiled_rules.put(999999, 1, 'compiled')
+        sender = connection.get_new_connection(connection.get_connection_params())
+        sender.autocommit = True
+        with sender.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, json.dumps({'origin': 'elsewhere', 'deleted': True, 'rules': [[999999, 2, None]]})])
+        sender.close()
+
+        deadline = time.monotonic() + 5
+        while compiled_rules.get(rule_id=999999) is not None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertIsNone(compiled_rules.get(rule_id=999999))
+
+    def test_tokenizer_and_parser(self):
+        # Keywords are only matched as whole words
+        self.assertEqual(tokenize("ORDER_ID > 5 AND ANDROID_VERSION >= 12"), ['ORDER_ID', '>', '5', 'AND', 'ANDROID_VERSION', '>=', '12'])
+        self.assertEqual(tokenize("name = 'OR AND'"), ['name', '=', "'OR AND'"])
+
+        # Same precedence is left associative, parentheses take over
+        self.assertEqual(infix_to_postfix(tokenize("a - b - c")), ['a', 'b', '-', 'c', '-'])
+        self.assertEqual(infix_to_postfix(tokenize("a + b * c > d AND e OR f")), ['a', 'b', 'c', '*', '+', 'd', '>', 'e', 'AND', 'f', 'OR'])
+        self.assertEqual(infix_to_postfix(tokenize("(a OR b) NAND c")), ['a', 'b', 'OR', 'c', 'NAND'])
+
+        for rule_string in ["(a > 1", "a > 1)", "a > ", "> a b", "a b", "()"]:
+            with self.assertRaises(ValueError, msg=rule_string):
+                infix_to_postfix(tokenize(rule_string))
+
+        rule = create_rule("ORDER_ID > 5", 'order_rule')
+        self.assertTrue(evaluate_rule(load_rule_tree(rule), {'ORDER_ID': 7}))
+
+    def test_parse_cache(self):
+        parsed_rules.clear()
+        rule_tokens, postfix_tokens = parse_rule("cached_a > 3 AND cached_b < 2")
+        self.assertEqual(len(parsed_rules), 1)
+
+        # Surrounding whitespace does not matter, and callers cannot change the cached lists
+        rule_tokens.append('mutated')
+        self.assertEqual(parse_rule("  cached_a > 3 AND cached_b < 2 "), (rule_tokens[:-1], postfix_tokens))
+        self.assertEqual(len(parsed_rules), 1)
+
+        with self.assertRaises(ValueError):
+            parse_rule("cached_a >")
+        self.assertEqual(len(parsed_rules), 1)
+
+    @override_settings(RULEIT_ADAPTIVE_ORDERING=False)
+    def test_compile_deep_rule(self):
+        # A chain of 600 conditions nests 600 levels deep, about as deep as evaluate_rule goes
+        rule = create_rule(' AND '.join(f"depth_{index} > {index}" for index in range(600)), 'deep_rule')
+        data = {f'depth_{index}': index + 1 for index in range(600)}
+        ast_root = load_rule_tree(rule)
+        self.assertTrue(evaluate_rule(ast_root, data))
+        self.assertTrue(compile_tree(ast_root)(data))
+        self.assertTrue(get_compiled_rule(rule_id=rule.id).evaluate(data))
+
+        data['depth_599'] = 0
+        self.assertFalse(get_compiled_rule(rule_id=rule.id).evaluate(data))
 
+    def test_compile_deep_rule_adaptive(self):
+        operators = ['OR', 'XOR']
+        rule_string = 'mixed_0 > 0'
+        for index in range(1, 600):
+            rule_string += f" {operators[index % 2]} mixed_{index} > 0"
+        for name, rule_string in [('deep_and', ' AND '.join(f"chain_{index} > 0" for index in range(600))), ('deep_mixed', rule_string)]:
+            rule = create_rule(rule_string, name)
+            data = {f'{prefix}_{index}': 1 for prefix in ('chain', 'mixed') for index in range(600)}
+            self.assertEqual(get_compiled_rule(rule_name=name).evaluate(data), evaluate_rule(load_rule_tree(rule), data))
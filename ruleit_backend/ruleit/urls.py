@@ -1,12 +1,22 @@
 from django.urls import path
-from .views import home, create_rule_view, combine_rules_view, evaluate_rule_view, get_rules, edit_rule_view, get_rule_by_id
+from .views import home, create_rule_view, combine_rules_view, import_rules_view, evaluate_rule_view, evaluation_cache_stats_view, evaluate_rule_batch_view, evaluate_rule_stream_view, evaluate_rule_delta_view, evaluate_rule_async_view, evaluate_rule_batch_async_view, match_rules_view, get_rules, edit_rule_view, rollback_rule_view, get_rule_by_id, get_rule_versions
 
 urlpatterns = [
     path('', home, name='home'),
     path('api/create-rule/', create_rule_view, name='create_rule'),
     path('api/edit-rule/', edit_rule_view, name='edit_rule'),
+    path('api/rollback-rule/', rollback_rule_view, name='rollback_rule'),
     path('api/combine-rules/', combine_rules_view, name='combine_rules'),
+    path('api/import-rules/', import_rules_view, name='import_rules'),
     path('api/evaluate-rule/', evaluate_rule_view, name='evaluate_rule'),
+    path('api/evaluate-rule/cache-stats/', evaluation_cache_stats_view, name='evaluation_cache_stats'),
+    path('api/evaluate-rule/batch/', evaluate_rule_batch_view, name='evaluate_rule_batch'),
+    path('api/evaluate-rule/stream/', evaluate_rule_stream_view, name='evaluate_rule_stream'),
+    path('api/evaluate-rule/delta/', evaluate_rule_delta_view, name='evaluate_rule_delta'),
+    path('api/match-rules/', match_rules_view, name='match_rules'),
+    path('api/async/evaluate-rule/', evaluate_rule_async_view, name='evaluate_rule_async'),
+    path('api/async/evaluate-rule/batch/', evaluate_rule_batch_async_view, name='evaluate_rule_batch_async'),
     path('api/rules/', get_rules, name='get_rules'),
     path('api/rules/<int:rule_id>/', get_rule_by_id, name='get_rule_by_id'),
+    path('api/rules/<int:rule_id>/versions/', get_rule_versions, name='get_rule_versions'),
 ]
@@ -1,30 +1,16 @@
 # utils.py
+import hashlib
+import json
+import math
 import re
 from django.db import transaction
+from django.db.models import Q
 from django.core.exceptions import ValidationError
-from .models import Node, Rule
-
-# A simple class to represent a node structure for comparison
-class NodeKey:
-    def __init__(self, node_type, value, left=None, right=None):
-        self.node_type = node_type
-        self.value = value
-        self.left = left
-        self.right = right
-
-    def __hash__(self):
-        lft = self.left.id if self.left else None
-        rht = self.right.id if self.right else None
-        return hash((self.node_type, self.value, lft, rht))
-
-    def __eq__(self, other):
-        return (
-            self.node_type == other.node_type and
-            self.value == other.value and
-            self.left == other.left and
-            self.right == other.right
-        )
-
+from .models import Node, Rule, RuleVersion
+from .cache import compiled_rules, evaluation_results, parsed_rules
+from .index import rule_index
+from .collector import lock_nodes
+from .invalidation import notify_rules_changed
 
 # Operator precedence
 PRECEDENCE = {
@@ -48,72 +34,77 @@ PRECEDENCE = {
     '%': 5,
 }
 
+# String literals, operators and operands. Keywords must end on a word boundary, so that
+# identifiers starting with one (ORDER_ID, ANDROID_VERSION) stay whole
+TOKEN_PATTERN = re.compile(
+    r'"[^"]*"|\'[^\']*\'|(?:AND|OR|XOR|NAND|NOR|XNOR)\b|>=|<=|!=|==|=|>|<|[+\-*/%()]|[a-zA-Z0-9_]\w*'
+)
+
 def tokenize(rule_string):
     """
     Tokenizes the input rule string.
     """
-    # Regex to handle string literals and other tokens
-    pattern = r'\"[^\"]*\"|\'[^\']*\'|AND|OR|XOR|NAND|NOR|XNOR|>=|<=|!=|==|=|>|<|\+|\-|\*|/|%|\(|\)|[a-zA-Z0-9_][\w]*'
-
-    # Find all matching tokens
-    tokens = re.findall(pattern, rule_string)
-    return [token for token in tokens if token]
+    return TOKEN_PATTERN.findall(rule_string)
 
 def infix_to_postfix(tokens):
     """
-    Converts infix tokens to postfix notation using the Shunting Yard algorithm.
-    
+    Converts infix tokens to postfix notation in a single pass, by precedence climbing.
+    Operators of the same precedence are left associative.
+
     Args:
         tokens (list): A list of tokens in infix notation.
-    
+
     Returns:
         list: A list of tokens in postfix notation.
-    
+
     Raises:
         ValueError: If there are any syntax errors in the expression.
     """
-    output = []
-    operator_stack = []
-
     # Check for empty input
     if not tokens:
         raise ValueError("No tokens provided for conversion.")
 
-    # Ensure matching parentheses
-    open_parentheses = 0
-
-    for token in tokens:
-        if token not in PRECEDENCE and (token != '(' and token != ')'):  # If the token is an operand
+    output = []
+    count = len(tokens)
+    position = 0
+
+    def parse_operand():
+        nonlocal position
+        if position == count:
+            raise ValueError("Invalid rule string: missing operand at the end.")
+        token = tokens[position]
+        position += 1
+        if token == '(':
+            parse_expression(1)
+            if position == count:
+                raise ValueError("Mismatched parentheses: unmatched opening parenthesis.")
+            position += 1  # Skip the ')'
+        elif token == ')':
+            raise ValueError("Mismatched parentheses: extra closing parenthesis.")
+        elif token in PRECEDENCE:
+            raise ValueError(f"Invalid rule string: missing operand before '{token}'.")
+        else:
             output.append(token)
 
-        elif token == '(':
-            operator_stack.append(token)
-            open_parentheses += 1
-            
-        elif token == ')':
-            if open_parentheses == 0:
-                raise ValueError("Mismatched parentheses: extra closing parenthesis.")
-            while operator_stack and operator_stack[-1] != '(':
-                output.append(operator_stack.pop())
-            if operator_stack: 
-                operator_stack.pop()  # Pop the '(' from the stack
-                open_parentheses -= 1
-
-        else:  # If the token is an operator
-            while (operator_stack and operator_stack[-1] != '(' and
-                   PRECEDENCE[operator_stack[-1]] >= PRECEDENCE[token]):
-                output.append(operator_stack.pop())
-            operator_stack.append(token)
-
-    # Pop all the operators left in the stack
-    while operator_stack:
-        top_token = operator_stack.pop()
-        if top_token == '(':
-            raise ValueError("Mismatched parentheses: extra opening parenthesis.")
-        output.append(top_token)
-
-    if open_parentheses > 0:
-        raise ValueError("Mismatched parentheses: unmatched opening parenthesis.")
+    def parse_expression(min_precedence):
+        nonlocal position
+        parse_operand()
+        while position < count and tokens[position] in PRECEDENCE and PRECEDENCE[tokens[position]] >= min_precedence:
+            operator = tokens[position]
+            position += 1
+            # The right operand only takes operators binding tighter, which keeps the left associativity
+            parse_expression(PRECEDENCE[operator] + 1)
+            output.append(operator)
+
+    try:
+        parse_expression(1)
+    except RecursionError:
+        raise ValueError("Invalid rule string: too deeply nested.")
+
+    if position < count:
+        if tokens[position] == ')':
+            raise ValueError("Mismatched parentheses: extra closing parenthesis.")
+        raise ValueError(f"Invalid rule string: unexpected '{tokens[position]}'.")
 
     return output
 
@@ -124,86 +115,466 @@ def is_number(s):
     except ValueError:
         return False
 
+# Convert values to boolean values for logical operations
+def to_bool(val):
+    try:
+        return bool(val)
+    except ValueError:
+        raise ValueError(f"Cannot convert '{val}' to a boolean value.")
+
+# Convert values to float for arithmetic comparisons
+def to_float(val):
+    try:
+        return float(val)
+    except ValueError:
+        raise ValueError(f"Cannot convert '{val}' to a numeric value.")
 
-def create_rule(rule_string, rule_name):
+
+# Optimization pass run on the postfix tokens before any node is created.
+# Subtrees are nested tuples: (token,) for operands and (operator, left, right) for operators.
+
+ARITHMETIC_OPERATORS = {'+', '-', '*', '/', '%'}
+COMPARISON_OPERATORS = {'>', '>=', '<', '<=', '=', '==', '!='}
+LOGICAL_CHAIN_OPERATORS = {'AND', 'OR'}
+
+def _is_literal_token(token):
+    return token.startswith('"') or token.startswith("'") or is_number(token)
+
+def _is_boolean_subtree(subtree):
+    # Comparisons and logical operators only ever produce True, False or None
+    return len(subtree) == 3 and subtree[0] not in ARITHMETIC_OPERATORS
+
+def _literal_only(subtree):
+    if len(subtree) == 1:
+        return _is_literal_token(subtree[0])
+    return _literal_only(subtree[1]) and _literal_only(subtree[2])
+
+def _constant_value(subtree):
     """
-    Create a tree from a rule string in postfix notation and save it to the database.
+    Evaluates a subtree made of literals only, with the exact semantics of evaluate_rule.
 
-    Parameters:
-    rule_string (str): The rule string to be processed.
+    Returns:
+        tuple: (True, value) if the subtree is constant and evaluates cleanly, (False, None) otherwise.
+    """
+    if not _literal_only(subtree):
+        return False, None
+
+    def to_node(subtree):
+        if len(subtree) == 1:
+            return Node(node_type='literal', value=subtree[0].strip('"\''))
+        return Node(node_type='operator', value=subtree[0], left=to_node(subtree[1]), right=to_node(subtree[2]))
+
+    try:
+        return True, evaluate_rule(to_node(subtree), {})
+    except Exception:
+        return False, None
+
+def _number_token(value):
+    # repr round-trips floats exactly, integral values are written without the '.0'
+    if value.is_integer() and abs(value) < 1e15 and not (value == 0 and math.copysign(1, value) < 0):
+        return str(int(value))
+    return repr(value)
+
+def _flatten_chain(subtree, operator):
+    if len(subtree) == 3 and subtree[0] == operator:
+        return _flatten_chain(subtree[1], operator) + _flatten_chain(subtree[2], operator)
+    return [subtree]
+
+def _build_chain(operator, operands):
+    chain = operands[0]
+    for operand in operands[1:]:
+        chain = (operator, chain, operand)
+    return chain
+
+def _simplify_chain(operator, operands):
+    """
+    Simplifies the operands of an AND/OR chain.
+
+    A chain evaluates its operands left to right and stops at the first None or deciding
+    value, so operands can be dropped when reaching them cannot change the outcome:
+    repeated operands, constants that never decide, operands after a constant that always
+    decides, and absorbed operands like the `(a OR b)` in `a AND (a OR b)`.
+    """
+    absorbing = 'OR' if operator == 'AND' else 'AND'
+    kept = []
+    for operand in operands:
+        is_constant, value = _constant_value(operand)
+        if is_constant:
+            if value is not None and to_bool(value) == (operator == 'AND'):
+                continue
+            kept.append(operand)
+            break
+
+        if operand in kept:
+            continue
+        if len(operand) == 3 and operand[0] == absorbing and _flatten_chain(operand, absorbing)[0] in kept:
+            continue
+        kept.append(operand)
+
+    # A lone operand must still produce a boolean, like the chain it replaces
+    if not kept or (len(kept) == 1 and not _is_boolean_subtree(kept[0])):
+        return _build_chain(operator, operands)
+    return _build_chain(operator, kept)
+
+def _simplify(subtree, numeric_context=False):
+    if len(subtree) == 1:
+        return subtree
+
+    operator = subtree[0]
+    if operator in LOGICAL_CHAIN_OPERATORS:
+        operands = [_simplify(operand) for operand in _flatten_chain(subtree, operator)]
+        return _simplify_chain(operator, operands)
+
+    # Operands of arithmetic and comparisons are only ever used as numbers or compared,
+    # so constant arithmetic below them can be folded into a literal
+    numeric = operator in ARITHMETIC_OPERATORS or operator in COMPARISON_OPERATORS
+    subtree = (operator, _simplify(subtree[1], numeric), _simplify(subtree[2], numeric))
+
+    if numeric_context and operator in ARITHMETIC_OPERATORS:
+        is_constant, value = _constant_value(subtree)
+        if is_constant:
+            return (_number_token(value),)
+    return subtree
+
+def optimize_postfix(postfix_tokens):
+    """
+    Folds constant subexpressions and simplifies boolean chains in a postfix token list.
+
+    The optimized rule evaluates to exactly the same results as the original one, it only
+    produces a smaller tree. Token lists that do not form a valid tree are returned as they
+    are, so the usual validation reports the error.
+
+    Args:
+        postfix_tokens (list): Tokens in postfix notation.
 
     Returns:
-    Rule: The created rule instance if successful.
+        list: The optimized tokens in postfix notation.
+    """
+    stack = []
+    for token in postfix_tokens:
+        if token in PRECEDENCE:
+            if len(stack) < 2:
+                return postfix_tokens
+            right = stack.pop()
+            left = stack.pop()
+            stack.append((token, left, right))
+        else:
+            stack.append((token,))
+    if len(stack) != 1:
+        return postfix_tokens
+
+    optimized = []
+
+    def emit(subtree):
+        if len(subtree) == 3:
+            emit(subtree[1])
+            emit(subtree[2])
+        optimized.append(subtree[0])
+
+    emit(_simplify(stack[0]))
+    return optimized
+
+
+def _tree_query():
+    # Recursive CTE collecting every node reachable from the given roots
+    table = Node._meta.db_table
+    return f"""
+        WITH RECURSIVE tree AS (
+            SELECT n.* FROM {table} n WHERE n.id = ANY(%s)
+            UNION
+            SELECT c.* FROM {table} c JOIN tree t ON c.id = t.left_id OR c.id = t.right_id
+        )
+        SELECT * FROM tree
+    """
+
+def _link_nodes(nodes):
+    # Link the children from the fetched rows instead of lazy ForeignKey lookups
+    try:
+        for node in nodes.values():
+            node.left = nodes[node.left_id] if node.left_id else None
+            node.right = nodes[node.right_id] if node.right_id else None
+    except KeyError:
+        raise RuntimeError("Invalid tree structure.")
+    return nodes
+
+def load_nodes(root_ids):
+    """
+    Fetches every node reachable from the given root nodes with a single recursive query
+    and links the children in memory, so walking the trees afterwards costs no queries.
+
+    Args:
+        root_ids (iterable): Ids of the root nodes to load.
+
+    Returns:
+        dict: A mapping of node id to Node, with left/right already populated.
 
     Raises:
-    ValueError: If the rule_string is empty or invalid.
+        RuntimeError: If a node refers to a child that could not be loaded.
+    """
+    root_ids = list(root_ids)
+    if not root_ids:
+        return {}
+
+    nodes = {node.id: node for node in Node.objects.raw(_tree_query(), [root_ids])}
+    return _link_nodes(nodes)
+
+async def aload_nodes(root_ids):
+    """
+    Async version of load_nodes, using the async ORM iteration.
+    """
+    root_ids = list(root_ids)
+    if not root_ids:
+        return {}
+
+    nodes = {node.id: node async for node in Node.objects.raw(_tree_query(), [root_ids])}
+    return _link_nodes(nodes)
+
+def load_rule_tree(rule):
+    """
+    Loads the complete AST of a rule. Rules with a stored program are decoded without any
+    query, the nodes of older rules are fetched in one query.
+
+    Args:
+        rule (Rule): The rule whose tree should be loaded.
+
+    Returns:
+        Node: The root node, with the whole tree reachable without further queries.
+    """
+    if rule.program is not None:
+        return build_tree(rule.program)
+
+    nodes = load_nodes([rule.rule_root_id])
+    if rule.rule_root_id not in nodes:
+        raise RuntimeError("Invalid tree structure.")
+    return nodes[rule.rule_root_id]
+
+async def aload_rule_tree(rule):
+    """
+    Async version of load_rule_tree.
+    """
+    if rule.program is not None:
+        return build_tree(rule.program)
+
+    nodes = await aload_nodes([rule.rule_root_id])
+    if rule.rule_root_id not in nodes:
+        raise RuntimeError("Invalid tree structure.")
+    return nodes[rule.rule_root_id]
+
+
+def dump_tree(ast_root):
+    """
+    Serializes an AST into a compact postfix program of [node_type, value] pairs.
+
+    The program holds no ORM state, so it can be shipped to other processes or stored,
+    and build_tree turns it back into a tree.
+    """
+    program = []
+
+    def visit(node):
+        if node is None:
+            raise RuntimeError("Invalid tree structure.")
+        if node.node_type == 'operator':
+            visit(node.left)
+            visit(node.right)
+        program.append([node.node_type, node.value])
+
+    visit(ast_root)
+    return program
+
+def build_tree(program):
+    """
+    Rebuilds an in-memory AST of unsaved nodes from a program produced by dump_tree.
+
+    Raises:
+        ValueError: If the program does not describe a single tree.
+    """
+    stack = []
+    for node_type, value in program:
+        if node_type == 'operator':
+            try:
+                right_node = stack.pop()
+                left_node = stack.pop()
+            except IndexError:
+                raise ValueError("Invalid program: insufficient operands for operators.")
+            stack.append(Node(node_type=node_type, value=value, left=left_node, right=right_node))
+        else:
+            stack.append(Node(node_type=node_type, value=value))
+
+    if len(stack) != 1:
+        raise ValueError("Invalid program: tree structure could not be formed.")
+    return stack[0]
+
+
+def structure_hash(node_type, value, left_hash=None, right_hash=None):
+    """
+    Content address of a subtree: identical subtrees get the same hash wherever they appear.
+    """
+    content = json.dumps([node_type, value, left_hash, right_hash])
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+def parse_rule(rule_string):
+    """
+    Tokenizes a rule string and converts it to optimized postfix notation. Results are kept
+    in a bounded LRU cache keyed by the rule string stripped of surrounding whitespace.
+
+    Returns:
+        tuple: The rule tokens and the postfix tokens.
+
+    Raises:
+        ValueError: If the rule_string is empty or invalid.
     """
 
     # Validate the rule string
     if not rule_string:
         raise ValueError("Rule string cannot be empty.")
 
-    # Tokenize and convert the rule string to postfix notation
-    try:
-        rule_tokens = tokenize(rule_string)
-        postfix_tokens = infix_to_postfix(rule_tokens)
-        # print("tokens: ",postfix_tokens)
-    except Exception as e:
-        raise ValueError(f"Error while processing rule string: {str(e)}")
+    # Rules are often created, edited and imported again with the same string
+    key = rule_string.strip()
+    parsed = parsed_rules.get(key)
+    if parsed is None:
+        # Tokenize and convert the rule string to postfix notation
+        try:
+            rule_tokens = tokenize(key)
+            postfix_tokens = optimize_postfix(infix_to_postfix(rule_tokens))
+        except Exception as e:
+            raise ValueError(f"Error while processing rule string: {str(e)}")
+        parsed = (tuple(rule_tokens), tuple(postfix_tokens))
+        parsed_rules.put(key, parsed)
+
+    # Callers get their own lists, the cached tuples are shared
+    return list(parsed[0]), list(parsed[1])
+
+def build_nodes(postfix_tokens, node_cache=None):
+    """
+    Builds the unsaved nodes of a rule tree from postfix tokens, each with its structure hash.
+    Identical subtrees are built once.
+
+    Args:
+        postfix_tokens (list): The rule in postfix notation.
+        node_cache (dict, optional): Nodes by structure hash, shared by the rules saved together
+            so their common subtrees are built once too.
 
+    Returns:
+        tuple: The root node and every node not in node_cache yet, children before their parents.
+
+    Raises:
+        ValueError: If the tokens do not form a single tree.
+    """
     stack = []
-    node_cache = {}
+    nodes = []
+    if node_cache is None:
+        node_cache = {}
 
-    # Build the tree from postfix tokens
-    for token in postfix_tokens:
-        if token not in PRECEDENCE:  # Operand
-
-            # Find out if the token is a literal or a variable
-            node_type = 'literal' if token.startswith('"') or token.startswith("'") or is_number(token) else 'variable'
-
-            # Create a unique key for the node
-            key = NodeKey(node_type=node_type, value=token.strip('"\''))
-            # Check if the node already exists
-            if key in node_cache:
-                stack.append(node_cache[key])
-            else:
-                node = Node(node_type=node_type, value=token.strip('"\''))
-                node.save()
+    try:
+        for token in postfix_tokens:
+            if token not in PRECEDENCE:  # Operand
+
+                # Find out if the token is a literal or a variable
+                node_type = 'literal' if token.startswith('"') or token.startswith("'") or is_number(token) else 'variable'
+                value = token.strip('"\'')
+                key = structure_hash(node_type, value)
+                node = node_cache.get(key)
+                if node is None:
+                    node = Node(node_type=node_type, value=value, structure_hash=key)
+            else:  # Operator
+                try:
+                    right_node = stack.pop()
+                    left_node = stack.pop()
+                except IndexError:
+                    raise ValueError("Invalid rule string: insufficient operands for operators.")
+
+                key = structure_hash('operator', token, left_node.structure_hash, right_node.structure_hash)
+                node = node_cache.get(key)
+                if node is None:
+                    node = Node(node_type='operator', value=token, left=left_node, right=right_node, structure_hash=key)
+
+            if key not in node_cache:
                 node_cache[key] = node
-                stack.append(node)
-        else:  # Operator
-            try:
-                right_node = stack.pop()
-                left_node = stack.pop()
-            except IndexError:
-                raise ValueError("Invalid rule string: insufficient operands for operators.")
+                nodes.append(node)
+            stack.append(node)
 
-            key = NodeKey(node_type='operator', value=token, left=left_node, right=right_node)
+        # Ensure that the stack contains the root node
+        if len(stack) != 1:
+            raise ValueError("Invalid rule string: tree structure could not be formed.")
+    except ValueError:
+        # Nodes of a rule that failed must not be reused by the next one
+        for node in nodes:
+            del node_cache[node.structure_hash]
+        raise
+    return stack[0], nodes
 
-            # Check if the node already exists
-            if key in node_cache:
-                stack.append(node_cache[key])
-            else:
-                operator_node = Node(node_type='operator', value=token, left=left_node, right=right_node)
-                operator_node.save()
-                node_cache[key] = operator_node
-                stack.append(operator_node)
+def save_nodes(nodes):
+    """
+    Saves the nodes built by build_nodes, reusing the stored nodes with the same structure hash
+    so identical subtrees are shared across rules.
 
-    # Ensure that the stack contains the root node
-    if len(stack) != 1:
-        # print("stack:", stack)
-        raise ValueError("Invalid rule string: tree structure could not be formed.")
+    The missing nodes are inserted with one bulk insert per tree level, leaves first, so every
+    node's children have their ids by the time it is inserted. A node inserted concurrently by
+    another rule is picked up instead of failing on the unique hash.
+    Must run inside a transaction so a failure leaves no partial tree behind.
+    """
+    existing = dict(
+        Node.objects.filter(structure_hash__in=[node.structure_hash for node in nodes if node.structure_hash])
+        .values_list('structure_hash', 'id')
+    )
+
+    levels = {}
+    for node in nodes:
+        if node.node_type == 'operator':
+            # Children that are not in the list are stored already
+            levels[id(node)] = 1 + max(levels.get(id(node.left), -1), levels.get(id(node.right), -1))
+        else:
+            levels[id(node)] = 0
+
+    by_level = {}
+    for node in nodes:
+        if node.structure_hash and node.structure_hash in existing:
+            node.id = existing[node.structure_hash]
+            node._state.adding = False
+        else:
+            by_level.setdefault(levels[id(node)], []).append(node)
+    for level in sorted(by_level):
+        Node.objects.bulk_create(
+            by_level[level], update_conflicts=True,
+            unique_fields=['structure_hash'], update_fields=['structure_hash']
+        )
+
+
+def create_rule(rule_string, rule_name):
+    """
+    Create a tree from a rule string in postfix notation and save it to the database.
 
-    # Create the rule in a transaction
+    Parameters:
+    rule_string (str): The rule string to be processed.
+
+    Returns:
+    Rule: The created rule instance if successful.
+
+    Raises:
+    ValueError: If the rule_string is empty or invalid.
+    """
+
+    rule_tokens, postfix_tokens = parse_rule(rule_string)
+    root, nodes = build_nodes(postfix_tokens)
+
+    # Create the nodes and the rule in a single transaction
     try:
         with transaction.atomic():
-            rule = Rule.objects.create(rule_root=stack[0])
-            rule.rule_tokens = rule_tokens
-            rule.rule_name = rule_name
-            rule.save()
+            lock_nodes()
+            save_nodes(nodes)
+            rule = Rule.objects.create(
+                rule_root=root, rule_tokens=rule_tokens, rule_name=rule_name, program=dump_tree(root)
+            )
+            record_version(rule)
+            notify_rules_changed([rule])
     except ValidationError as e:
         raise ValueError(f"Failed to save rule to the database: {str(e)}")
 
+    # A rule previously cached under this name must not shadow the new one
+    if rule_name:
+        compiled_rules.invalidate(rule_name=rule_name)
+    rule_index.add(rule.id, rule.version, root)
+
     return rule
 
 def combine_rules(combined_rule_name, rule_strings, operators):
@@ -234,6 +605,100 @@ def combine_rules(combined_rule_name, rule_strings, operators):
 
     return combined_rule_root
 
+def combine_stored_rules(combined_rule_name, rules, operators):
+    """
+    Combines existing rules into a new rule without parsing them again.
+
+    Only the operator nodes joining the stored trees are created, the constituent trees are
+    shared as they are. The rules are joined with the same precedence as combine_rules, so
+    the result is the same as combining their rule strings.
+
+    :param rules: List of rule ids (int) or rule names (str).
+
+    :param operators: List of operators to combine the rules.
+
+    :return: The combined rule or raises ValueError for invalid input.
+    """
+
+    # Validate input
+    if len(rules) < 2:
+        raise ValueError("At least two rules are required.")
+    if len(operators) != len(rules) - 1:
+        raise ValueError("Number of operators must be one less than the number of rules.")
+    for operator in operators:
+        if operator not in PRECEDENCE:
+            raise ValueError(f"Invalid operator '{operator}'.")
+
+    # Fetch all the rules with their root nodes at once
+    ids = [rule for rule in rules if isinstance(rule, int)]
+    names = [rule for rule in rules if isinstance(rule, str)]
+    stored = Rule.objects.filter(Q(id__in=ids) | Q(rule_name__in=names)).select_related('rule_root')
+    by_id = {rule.id: rule for rule in stored}
+    by_name = {rule.rule_name: rule for rule in by_id.values() if rule.rule_name}
+    constituents = []
+    for rule in rules:
+        found = by_id.get(rule) if isinstance(rule, int) else by_name.get(rule)
+        if found is None:
+            raise ValueError(f"Rule '{rule}' not found.")
+        constituents.append(found)
+
+    # The rules stand in for operands, so the operators get the precedence combine_rules gives them
+    tokens = [0]
+    for index, operator in enumerate(operators, start=1):
+        tokens += [operator, index]
+
+    stack = []
+    nodes = []
+    node_cache = {}
+    program = []
+    rule_tokens = []
+    for token in infix_to_postfix(tokens):
+        if token not in PRECEDENCE:
+            rule = constituents[token]
+            stack.append(rule.rule_root)
+            program.append(rule.program if rule.program is not None else dump_tree(load_rule_tree(rule)))
+            rule_tokens.append(['('] + list(rule.rule_tokens or []) + [')'])
+            continue
+
+        right_node = stack.pop()
+        left_node = stack.pop()
+        # Subtrees stored without a hash cannot be shared, and neither can their parents
+        key = None
+        if left_node.structure_hash and right_node.structure_hash:
+            key = structure_hash('operator', token, left_node.structure_hash, right_node.structure_hash)
+        # A repeated sub-combination is built once, as in build_nodes
+        node = node_cache.get(key) if key else None
+        if node is None:
+            node = Node(node_type='operator', value=token, left=left_node, right=right_node, structure_hash=key)
+            nodes.append(node)
+            if key:
+                node_cache[key] = node
+        stack.append(node)
+
+        right_program, right_tokens = program.pop(), rule_tokens.pop()
+        left_program, left_tokens = program.pop(), rule_tokens.pop()
+        program.append(left_program + right_program + [['operator', token]])
+        rule_tokens.append(['('] + left_tokens + [token] + right_tokens + [')'])
+
+    root = stack[0]
+    try:
+        with transaction.atomic():
+            lock_nodes()
+            save_nodes(nodes)
+            rule = Rule.objects.create(
+                rule_root=root, rule_tokens=rule_tokens[0], rule_name=combined_rule_name, program=program[0]
+            )
+            record_version(rule)
+            notify_rules_changed([rule])
+    except ValidationError as e:
+        raise ValueError(f"Failed to save rule to the database: {str(e)}")
+
+    if combined_rule_name:
+        compiled_rules.invalidate(rule_name=combined_rule_name)
+    rule_index.add(rule.id, rule.version, build_tree(rule.program))
+
+    return rule
+
 def evaluate_rule(ast_root, data):
     """
     Recursively evaluates the AST (abstract syntax tree) rooted at ast_root based on the provided data.
@@ -262,14 +727,6 @@ def evaluate_rule(ast_root, data):
 
     elif ast_root.node_type == 'operator':
 
-        # Convert left and right values to boolean values for logical operations
-        def to_bool(val):
-            try:
-                return bool(val)
-            except ValueError:
-                raise ValueError(f"Cannot convert '{val}' to a boolean value.")
-
-
         # Handle logical operators
         if ast_root.value == 'AND':
             left_value = evaluate_rule(ast_root.left, data)
@@ -310,13 +767,6 @@ def evaluate_rule(ast_root, data):
 
         if left_value == None or right_value == None: return None
 
-        # Convert left and right values to float for arithmetic comparisons if needed
-        def to_float(val):
-            try:
-                return float(val)
-            except ValueError:
-                raise ValueError(f"Cannot convert '{val}' to a numeric value.")
-
         # Handle operators based on their type
         if ast_root.value == '>':
             return to_float(left_value) > to_float(right_value)
@@ -373,69 +823,79 @@ def edit_rule(rule_string, rule_id):
     ValueError: If the rule_string is empty or invalid.
     """
 
-    # Validate the rule string
-    if not rule_string:
-        raise ValueError("Rule string cannot be empty.")
+    rule_tokens, postfix_tokens = parse_rule(rule_string)
+    root, nodes = build_nodes(postfix_tokens)
 
-    # Tokenize and convert the rule string to postfix notation
+    # Create the nodes and update the rule in a single transaction
     try:
-        rule_tokens = tokenize(rule_string)
-        postfix_tokens = infix_to_postfix(rule_tokens)
-        # print("tokens: ",postfix_tokens)
-    except Exception as e:
-        raise ValueError(f"Error while processing rule string: {str(e)}")
+        with transaction.atomic():
+            lock_nodes()
+            save_nodes(nodes)
+            rule = Rule.objects.select_for_update().get(id=rule_id)
+            # Rules created before versions were recorded keep their current version too
+            if not rule.versions.filter(version=rule.version).exists():
+                record_version(rule)
+            rule.rule_tokens = rule_tokens
+            rule.rule_root = root
+            rule.program = dump_tree(root)
+            rule.version += 1
+            rule.save()
+            record_version(rule)
+            notify_rules_changed([rule])
+    except ValidationError as e:
+        raise ValueError(f"Failed to save rule to the database: {str(e)}")
 
-    stack = []
-    node_cache = {}
+    # Compiled forms of the previous version are stale now
+    compiled_rules.invalidate(rule.id)
+    evaluation_results.invalidate(rule.id)
+    rule_index.add(rule.id, rule.version, root)
 
-    # Build the tree from postfix tokens
-    for token in postfix_tokens:
-        if token not in PRECEDENCE:  # Operand
-
-            # Find out if the token is a literal or a variable
-            node_type = 'literal' if token.startswith('"') or token.startswith("'") or is_number(token) else 'variable'
-
-            # Create a unique key for the node
-            key = NodeKey(node_type=node_type, value=token.strip('"\''))
-            # Check if the node already exists
-            if key in node_cache:
-                stack.append(node_cache[key])
-            else:
-                node = Node(node_type=node_type, value=token.strip('"\''))
-                node.save()
-                node_cache[key] = node
-                stack.append(node)
-        else:  # Operator
-            try:
-                right_node = stack.pop()
-                left_node = stack.pop()
-            except IndexError:
-                raise ValueError("Invalid rule string: insufficient operands for operators.")
+    return rule
 
-            key = NodeKey(node_type='operator', value=token, left=left_node, right=right_node)
+def record_version(rule, restored_from=None):
+    """
+    Records the current state of a rule as an immutable version.
+    Must run in the transaction that saved the rule.
+    """
+    return RuleVersion.objects.create(
+        rule=rule, version=rule.version, rule_root_id=rule.rule_root_id,
+        rule_tokens=rule.rule_tokens, program=rule.program, restored_from=restored_from
+    )
 
-            # Check if the node already exists
-            if key in node_cache:
-                stack.append(node_cache[key])
-            else:
-                operator_node = Node(node_type='operator', value=token, left=left_node, right=right_node)
-                operator_node.save()
-                node_cache[key] = operator_node
-                stack.append(operator_node)
+def rollback_rule(rule_id, version):
+    """
+    Makes a previous version of a rule current again.
 
-    # Ensure that the stack contains the root node
-    if len(stack) != 1:
-        # print("stack:", stack)
-        raise ValueError("Invalid rule string: tree structure could not be formed.")
+    Nothing is parsed or inserted but the new version: the rule is pointed back at the stored
+    tree of the old version. The rollback itself gets the next version number, so versions only
+    ever grow and caches keyed on (rule_id, version) never see a version change its meaning.
 
-    # Create the rule in a transaction
-    try:
-        with transaction.atomic():
-            rule = Rule.objects.get(id=rule_id)
-            rule.rule_tokens = rule_tokens
-            rule.rule_root = stack[0]
-            rule.save()
-    except ValidationError as e:
-        raise ValueError(f"Failed to save rule to the database: {str(e)}")
+    Returns:
+        Rule: The rolled back rule.
+
+    Raises:
+        Rule.DoesNotExist: If no rule matches the id.
+        ValueError: If the rule has no such version.
+    """
+    with transaction.atomic():
+        # The collector must not delete the old tree while the rule is pointed back at it
+        lock_nodes()
+        rule = Rule.objects.select_for_update().get(id=rule_id)
+        try:
+            target = rule.versions.get(version=version)
+        except RuleVersion.DoesNotExist:
+            raise ValueError(f"Rule {rule_id} has no version {version}.")
+
+        rule.rule_root_id = target.rule_root_id
+        rule.rule_tokens = target.rule_tokens
+        rule.program = target.program
+        rule.version += 1
+        rule.save()
+        record_version(rule, restored_from=version)
+        notify_rules_changed([rule])
+
+    compiled_rules.invalidate(rule.id)
+    evaluation_results.invalidate(rule.id)
+    rule_index.add(rule.id, rule.version, load_rule_tree(rule))
 
     return rule
@@ -1,13 +1,23 @@
 # views.py
+import io
+import json
+from django.conf import settings
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.http import JsonResponse, StreamingHttpResponse
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
-from .utils import create_rule, combine_rules, evaluate_rule, edit_rule
-from .models import Rule
+from .utils import create_rule, combine_rules, combine_stored_rules, evaluate_rule, edit_rule, rollback_rule
+from .compiler import ENGINES, get_compiled_rule, aget_compiled_rule, evaluate_cached, evaluate_records, evaluate_ndjson, match_rules
+from .parallel import evaluate_parallel
+from .importer import FORMATS, guess_format, read_rules, import_rules
+from .cache import evaluation_results
+from .delta import evaluate_with_handle, evaluate_delta, EvaluationHandleNotFound
+from .models import Rule, RuleVersion
 from .serializers import RuleSerializer
 from rest_framework.pagination import PageNumberPagination
 
@@ -119,6 +129,18 @@ def create_rule_view(request):
                 description='Array of rule strings to be combined (At least 2 rules required)',
                 example=["A > 10", "B < 5", "C = 20"]
             ),
+            'rule_ids': openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Schema(type=openapi.TYPE_INTEGER),
+                description='Ids of existing rules to combine instead of rule strings. Their stored trees are reused without being parsed again.',
+                example=[1, 2, 3]
+            ),
+            'rule_names': openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Schema(type=openapi.TYPE_STRING),
+                description='Names of existing rules to combine instead of rule strings or ids.',
+                example=["RULE_A", "RULE_B"]
+            ),
             'operators': openapi.Schema(
                 type=openapi.TYPE_ARRAY,
                 items=openapi.Schema(type=openapi.TYPE_STRING),
@@ -133,7 +155,6 @@ def create_rule_view(request):
                 example="MASTER_RULE_1"
             )
         },
-        required=['rule_strings'],
     ),
     responses={
         201: openapi.Response('Combined rule created successfully',
@@ -168,10 +189,31 @@ def create_rule_view(request):
 @api_view(['POST'])
 def combine_rules_view(request):
     rule_strings = request.data.get('rule_strings', [])
+    rule_ids = request.data.get('rule_ids', None)
+    rule_names = request.data.get('rule_names', None)
     operators = request.data.get('operators', [])
     combined_rule_name = request.data.get('combined_rule_name', None)
     # print("Creating Rule: ",rule_strings)
 
+    # Existing rules can be combined by id or name instead of by rule string
+    stored_rules = None
+    if rule_ids is not None:
+        if not isinstance(rule_ids, list) or not all(isinstance(rule_id, int) for rule_id in rule_ids):
+            return JsonResponse(
+                {'error': 'rule_ids should be a list of integers.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        stored_rules = rule_ids
+    elif rule_names is not None:
+        if not isinstance(rule_names, list) or not all(isinstance(rule_name, str) for rule_name in rule_names):
+            return JsonResponse(
+                {'error': 'rule_names should be a list of strings.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        stored_rules = rule_names
+    if stored_rules is not None:
+        rule_strings = stored_rules
+
     # Validate rule_strings
     if not isinstance(rule_strings, list) or len(rule_strings) < 2:
         return JsonResponse(
@@ -204,7 +246,10 @@ def combine_rules_view(request):
 
     # Combine the rules
     try:
-        combined_ast = combine_rules(combined_rule_name, rule_strings, operators)
+        if stored_rules is not None:
+            combined_ast = combine_stored_rules(combined_rule_name, stored_rules, operators)
+        else:
+            combined_ast = combine_rules(combined_rule_name, rule_strings, operators)
 
 
         # Log the created rule details
@@ -237,6 +282,104 @@ def combine_rules_view(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@swagger_auto_schema(
+    method='post',
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        properties={
+            'rules': openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'rule_name': openapi.Schema(type=openapi.TYPE_STRING, description='A unique name to identify the rule'),
+                        'rule_string': openapi.Schema(type=openapi.TYPE_STRING, description='The rule string'),
+                    }
+                ),
+                description='The rules to create. A JSON, NDJSON or CSV catalog can be uploaded as a multipart `file` instead.',
+                example=[{"rule_name": "RULE_1", "rule_string": "A > 10 AND B < 5"}, {"rule_name": "RULE_2", "rule_string": "C = 20"}]
+            ),
+            'format': openapi.Schema(
+                type=openapi.TYPE_STRING,
+                enum=['json', 'ndjson', 'csv'],
+                description='Format of the uploaded file, guessed from its extension by default.'
+            ),
+        },
+    ),
+    responses={
+        201: openapi.Response('Rules imported',
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'created': openapi.Schema(type=openapi.TYPE_INTEGER, description='Number of rules created'),
+                    'errors': openapi.Schema(
+                        type=openapi.TYPE_ARRAY,
+                        items=openapi.Schema(
+                            type=openapi.TYPE_OBJECT,
+                            properties={
+                                'row': openapi.Schema(type=openapi.TYPE_INTEGER, description='Row of the rule in the catalog, starting at 1'),
+                                'rule_name': openapi.Schema(type=openapi.TYPE_STRING, description='Name of the rule'),
+                                'error': openapi.Schema(type=openapi.TYPE_STRING, description='Why the rule was not created'),
+                            }
+                        ),
+                        description='The rules that could not be created, the others were.'
+                    ),
+                }
+            )
+        ),
+        400: openapi.Response('Bad Request', 
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='Error message')
+                }
+            )
+        ),
+        500: openapi.Response('Internal server error', 
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='Error message')
+                }
+            )
+        )
+    }
+)
+@api_view(['POST'])
+def import_rules_view(request):
+    upload = request.FILES.get('file')
+
+    try:
+        if upload is not None:
+            format = request.data.get('format') or guess_format(upload.name)
+            if format not in FORMATS:
+                return JsonResponse(
+                    {'error': f"Unknown format, use one of {', '.join(FORMATS)}."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            source = io.TextIOWrapper(upload.file, encoding='utf-8')
+            report = import_rules(read_rules(source, format))
+        else:
+            rules = request.data.get('rules')
+            if not isinstance(rules, list) or not rules:
+                return JsonResponse(
+                    {'error': 'Must provide a non empty list of rules or a file.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            report = import_rules(read_rules(rules, 'json'))
+
+        return JsonResponse(report, status=status.HTTP_201_CREATED)
+    except ValueError as e:
+        return JsonResponse(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except Exception as e:
+        return JsonResponse(
+            {'error': str(e)}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
 @swagger_auto_schema(
     method='post',
     request_body=openapi.Schema(
@@ -254,6 +397,15 @@ def combine_rules_view(request):
                 type=openapi.TYPE_OBJECT,
                 additional_properties=openapi.Schema(type=openapi.TYPE_STRING),
                 description='Data for rule evaluation'
+            ),
+            'engine': openapi.Schema(
+                type=openapi.TYPE_STRING,
+                enum=['compiled', 'native', 'interpreter'],
+                description='Evaluation engine: compiled closures (default), generated native code or the tree interpreter'
+            ),
+            'version': openapi.Schema(
+                type=openapi.TYPE_INTEGER,
+                description='Evaluate this version of the rule instead of the current one'
             )
         },
     ),
@@ -297,6 +449,8 @@ def evaluate_rule_view(request):
     rule_id = request.data.get('rule_id', None)
     rule_name = request.data.get('rule_name', None)
     data = request.data.get('data', {})
+    engine = request.data.get('engine', 'compiled')
+    version = request.data.get('version', None)
 
     if not rule_id and not rule_name:
         return JsonResponse(
@@ -304,16 +458,20 @@ def evaluate_rule_view(request):
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    if engine not in ENGINES:
+        return JsonResponse(
+            {'error': f"The engine must be one of: {', '.join(ENGINES)}."}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
     try:
-        # Retrieve the Rule object based on rule_id or rule_name
-        if rule_id:
-            rule = Rule.objects.get(id=rule_id)
+        # Retrieve the compiled rule based on rule_id or rule_name, the database is only hit on a cache miss
+        compiled_rule = get_compiled_rule(rule_id=rule_id, rule_name=rule_name, version=version)
+        evaluate = compiled_rule.evaluator(engine)
+        if getattr(settings, 'RULEIT_RESULT_CACHE', False):
+            result = evaluate_cached(compiled_rule, data, evaluate)
         else:
-            rule = Rule.objects.get(rule_name=rule_name)
-
-        # Assuming rule_root is a Node that represents the AST
-        ast_root = rule.rule_root
-        result = evaluate_rule(ast_root, data)
+            result = evaluate(data)
 
         return JsonResponse(
             {'result': result if result is not None else False},
@@ -325,6 +483,11 @@ def evaluate_rule_view(request):
             {'error': 'Rule not found'}, 
             status=status.HTTP_404_NOT_FOUND
         )
+    except RuleVersion.DoesNotExist:
+        return JsonResponse(
+            {'error': 'Rule version not found'}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
     except RuntimeError as e:
         return JsonResponse(
             {'error': f'Runtime error occurred: {str(e)}'},
@@ -344,25 +507,86 @@ def evaluate_rule_view(request):
 @swagger_auto_schema(
     method='get',
     responses={
-        200: openapi.Response('List of rules',
+        200: openapi.Response('Result cache statistics',
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'enabled': openapi.Schema(type=openapi.TYPE_BOOLEAN, description='If the result cache is on (RULEIT_RESULT_CACHE).'),
+                    'hits': openapi.Schema(type=openapi.TYPE_INTEGER, description='Evaluations answered from the cache'),
+                    'misses': openapi.Schema(type=openapi.TYPE_INTEGER, description='Evaluations that had to run the rule'),
+                    'size': openapi.Schema(type=openapi.TYPE_INTEGER, description='Number of cached results'),
+                }
+            )
+        ),
+    }
+)
+@api_view(['GET'])
+def evaluation_cache_stats_view(request):
+    return JsonResponse(
+        {'enabled': getattr(settings, 'RULEIT_RESULT_CACHE', False), **evaluation_results.stats()},
+        status=status.HTTP_200_OK
+    )
+
+@swagger_auto_schema(
+    method='post',
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        properties={
+            'rule_id': openapi.Schema(
+                type=openapi.TYPE_INTEGER, 
+                description='Rule Id'
+            ),
+            'rule_name': openapi.Schema(
+                type=openapi.TYPE_STRING, 
+                description='Unique Rule Name'
+            ),
+            'records': openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    additional_properties=openapi.Schema(type=openapi.TYPE_STRING)
+                ),
+                description='List of data records to evaluate against the rule'
+            ),
+            'parallel': openapi.Schema(
+                type=openapi.TYPE_BOOLEAN, 
+                description='Shard the records across a pool of worker processes'
+            ),
+            'workers': openapi.Schema(
+                type=openapi.TYPE_INTEGER, 
+                description='Number of worker processes when parallel, defaults to the CPU count'
+            ),
+            'chunk_size': openapi.Schema(
+                type=openapi.TYPE_INTEGER, 
+                description='Records sent to a worker at a time when parallel'
+            )
+        },
+        required=['records'],
+    ),
+    responses={
+        200: openapi.Response('Records evaluated successfully', 
             openapi.Schema(
                 type=openapi.TYPE_OBJECT,
                 properties={
-                    'count': openapi.Schema(type=openapi.TYPE_INTEGER, description='Total number of rules'),
-                    'next': openapi.Schema(type=openapi.TYPE_STRING, description='URL to the next page of results'),
-                    'previous': openapi.Schema(type=openapi.TYPE_STRING, description='URL to the previous page of results'),
                     'results': openapi.Schema(
                         type=openapi.TYPE_ARRAY,
                         items=openapi.Schema(
                             type=openapi.TYPE_OBJECT,
                             properties={
-                                'id': openapi.Schema(type=openapi.TYPE_INTEGER, description='ID of the rule'),
-                                'rule_name': openapi.Schema(type=openapi.TYPE_STRING, description='Name of the rule'),
-                                'rule_root': openapi.Schema(type=openapi.TYPE_INTEGER, description='ID of the root node of the rule tree'),
-                                'rule_tokens': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_STRING), description='The rule string (Tokenized Array)'),
+                                'result': openapi.Schema(type=openapi.TYPE_BOOLEAN, description='If the record qualifies the rule or not.'),
+                                'error': openapi.Schema(type=openapi.TYPE_STRING, description='Error while evaluating this record.'),
                             }
-                        )
-                    )
+                        ),
+                        description='One entry per record, in the order of the request.'
+                    ),
+                }
+            )
+        ),
+        404: openapi.Response('Rule Not Found', 
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='No rule exists with the given details.')
                 }
             )
         ),
@@ -374,98 +598,497 @@ def evaluate_rule_view(request):
                 }
             )
         ),
-        500: openapi.Response('Internal server error', 
+        500: openapi.Response('Internal Server Error', 
             openapi.Schema(
                 type=openapi.TYPE_OBJECT,
                 properties={
-                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='Error message')
+                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='Error while evaluating the rule.')
                 }
             )
-        )
+        ),
     }
 )
-@api_view(['GET'])
-def get_rules(request):
-    paginator = PageNumberPagination()
-    paginator.page_size = 10
-    rules = Rule.objects.all().order_by('id')
-    paginated_rules = paginator.paginate_queryset(rules, request)
-    
-    serializer = RuleSerializer(paginated_rules, many=True)
-    return paginator.get_paginated_response(serializer.data)
+@api_view(['POST'])
+def evaluate_rule_batch_view(request):
+    rule_id = request.data.get('rule_id', None)
+    rule_name = request.data.get('rule_name', None)
+    records = request.data.get('records', None)
+    parallel = request.data.get('parallel', False)
+    workers = request.data.get('workers', None)
+    chunk_size = request.data.get('chunk_size', None)
+
+    if not rule_id and not rule_name:
+        return JsonResponse(
+            {'error': 'Must provide either rule_id or rule_name'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if not isinstance(records, list):
+        return JsonResponse(
+            {'error': 'The records must be provided as a list.'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    for option in (workers, chunk_size):
+        if option is not None and (not isinstance(option, int) or option < 1):
+            return JsonResponse(
+                {'error': 'The workers and chunk_size must be positive integers.'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+    try:
+        # The rule is loaded and compiled once for the whole batch
+        compiled_rule = get_compiled_rule(rule_id=rule_id, rule_name=rule_name)
+        if parallel:
+            results = list(evaluate_parallel(compiled_rule.program, records, workers=workers, chunk_size=chunk_size))
+        else:
+            results = list(evaluate_records(compiled_rule.evaluate, records))
+
+        return JsonResponse(
+            {'results': results},
+            status=status.HTTP_200_OK
+        )
+
+    except Rule.DoesNotExist:
+        return JsonResponse(
+            {'error': 'Rule not found'}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    except Exception as e:
+        return JsonResponse(
+            {'error': f'An unexpected error occurred: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
 
 @swagger_auto_schema(
-    method='get',
+    method='post',
     manual_parameters=[
         openapi.Parameter(
             'rule_id', 
-            openapi.IN_PATH, 
-            description="ID of the rule to retrieve", 
+            openapi.IN_QUERY, 
+            description="Rule Id", 
             type=openapi.TYPE_INTEGER
+        ),
+        openapi.Parameter(
+            'rule_name', 
+            openapi.IN_QUERY, 
+            description="Unique Rule Name", 
+            type=openapi.TYPE_STRING
         )
     ],
+    request_body=openapi.Schema(
+        type=openapi.TYPE_STRING,
+        description='Newline-delimited JSON, one data record per line'
+    ),
     responses={
-        200: openapi.Response('Rule details',
+        200: openapi.Response('Newline-delimited JSON, one {"result": ...} or {"error": ...} line per record, in order'),
+        404: openapi.Response('Rule Not Found', 
             openapi.Schema(
                 type=openapi.TYPE_OBJECT,
                 properties={
-                    'id': openapi.Schema(type=openapi.TYPE_INTEGER, description='ID of the rule'),
-                    'rule_name': openapi.Schema(type=openapi.TYPE_STRING, description='Name of the rule'),
-                    'rule_root': openapi.Schema(type=openapi.TYPE_INTEGER, description='ID of the root node of the rule tree'),
-                    'rule_tokens': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_STRING), description='The rule string (Tokenized Array)'),
+                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='No rule exists with the given details.')
                 }
             )
         ),
-        404: openapi.Response('Rule Not Found', 
+        400: openapi.Response('Bad Request', 
             openapi.Schema(
                 type=openapi.TYPE_OBJECT,
                 properties={
-                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='No rule exists with the given id.')
+                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='Must provide either rule_id or rule_name.')
                 }
             )
         ),
-        500: openapi.Response('Internal server error', 
+        500: openapi.Response('Internal Server Error', 
             openapi.Schema(
                 type=openapi.TYPE_OBJECT,
                 properties={
-                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='Error message')
+                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='Error while evaluating the rule.')
                 }
             )
-        )
+        ),
     }
 )
-@api_view(['GET'])
-def get_rule_by_id(request, rule_id):
+@api_view(['POST'])
+def evaluate_rule_stream_view(request):
+    rule_id = request.query_params.get('rule_id', None)
+    rule_name = request.query_params.get('rule_name', None)
+
+    if not rule_id and not rule_name:
+        return JsonResponse(
+            {'error': 'Must provide either rule_id or rule_name'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
     try:
-        rule = Rule.objects.get(id=rule_id)
-        serializer = RuleSerializer(rule)
-        return Response(serializer.data)
+        compiled_rule = get_compiled_rule(rule_id=rule_id, rule_name=rule_name)
     except Rule.DoesNotExist:
-        return Response({'error': 'Rule not found'}, status=404)
+        return JsonResponse(
+            {'error': 'Rule not found'}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    except Exception as e:
+        return JsonResponse(
+            {'error': f'An unexpected error occurred: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    # The body is read line by line while the results are streamed back, never as a whole
+    return StreamingHttpResponse(
+        evaluate_ndjson(compiled_rule.evaluate, request.stream or ()),
+        content_type='application/x-ndjson'
+    )
 
 @swagger_auto_schema(
     method='post',
     request_body=openapi.Schema(
         type=openapi.TYPE_OBJECT,
         properties={
-            'new_rule_string': openapi.Schema(
+            'rule_id': openapi.Schema(
+                type=openapi.TYPE_INTEGER, 
+                description='Rule Id, for a first evaluation'
+            ),
+            'rule_name': openapi.Schema(
                 type=openapi.TYPE_STRING, 
-                description='The rule string',
-                example="A > 10 AND color = yellow"
+                description='Unique Rule Name, for a first evaluation'
             ),
-            'rule_id': openapi.Schema(
+            'data': openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                additional_properties=openapi.Schema(type=openapi.TYPE_STRING),
+                description='Data for a first evaluation'
+            ),
+            'handle': openapi.Schema(
                 type=openapi.TYPE_STRING, 
-                description='The unique id of the rule',
-                example="2"
+                description='Handle of a previous evaluation, for a delta evaluation'
+            ),
+            'changes': openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                additional_properties=openapi.Schema(type=openapi.TYPE_STRING),
+                description='The fields that changed since the previous evaluation'
             )
         },
     ),
     responses={
-        201: openapi.Response('Rule Edited successfully', 
-                openapi.Schema(
-                    type=openapi.TYPE_OBJECT,
-                    properties={
-                        'result': openapi.Schema(type=openapi.TYPE_STRING, description='Rule edited successfully'),
+        200: openapi.Response('Data evaluated successfully', 
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'result': openapi.Schema(type=openapi.TYPE_BOOLEAN, description='If the data qualify the rule or not.'),
+                    'handle': openapi.Schema(type=openapi.TYPE_STRING, description='Handle to pass along with the next changes.'),
+                }
+            )
+        ),
+        404: openapi.Response('Not Found', 
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='No rule exists with the given details, or the handle expired.')
+                }
+            )
+        ),
+        400: openapi.Response('Bad Request', 
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='Error message')
+                }
+            )
+        ),
+        500: openapi.Response('Internal Server Error', 
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='Error while evaluating the rule.')
+                }
+            )
+        ),
+    }
+)
+@api_view(['POST'])
+def evaluate_rule_delta_view(request):
+    handle = request.data.get('handle', None)
+    rule_id = request.data.get('rule_id', None)
+    rule_name = request.data.get('rule_name', None)
+
+    if handle:
+        payload = request.data.get('changes', None)
+    elif rule_id or rule_name:
+        payload = request.data.get('data', {})
+    else:
+        return JsonResponse(
+            {'error': 'Must provide either a handle or rule_id or rule_name'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if not isinstance(payload, dict):
+        return JsonResponse(
+            {'error': 'The changes must be an object.' if handle else 'The data must be an object.'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        if handle:
+            result = evaluate_delta(handle, payload)
+        else:
+            result, handle = evaluate_with_handle(payload, rule_id=rule_id, rule_name=rule_name)
+
+        return JsonResponse(
+            {'result': result if result is not None else False, 'handle': handle},
+            status=status.HTTP_200_OK
+        )
+
+    except (Rule.DoesNotExist, EvaluationHandleNotFound) as e:
+        return JsonResponse(
+            {'error': 'Rule not found' if isinstance(e, Rule.DoesNotExist) else str(e)}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    except RuntimeError as e:
+        return JsonResponse(
+            {'error': f'Runtime error occurred: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    except NotImplementedError as e:
+        return JsonResponse(
+            {'error': f'NotImplementedError: {str(e)}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except Exception as e:
+        return JsonResponse(
+            {'error': f'An unexpected error occurred: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+@swagger_auto_schema(
+    method='post',
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        properties={
+            'data': openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                additional_properties=openapi.Schema(type=openapi.TYPE_STRING),
+                description='Data for rule evaluation'
+            ),
+            'rule_ids': openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Schema(type=openapi.TYPE_INTEGER),
+                description='Only consider these rules'
+            ),
+            'rule_name_prefix': openapi.Schema(
+                type=openapi.TYPE_STRING, 
+                description='Only consider rules whose name starts with this prefix',
+                example="MASTER_"
+            ),
+            'all': openapi.Schema(
+                type=openapi.TYPE_BOOLEAN, 
+                description='Consider every rule'
+            )
+        },
+        required=['data'],
+    ),
+    responses={
+        200: openapi.Response('Rules matched successfully', 
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'matched_rule_ids': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER), description='IDs of the rules the data qualifies.'),
+                    'errors': openapi.Schema(
+                        type=openapi.TYPE_ARRAY,
+                        items=openapi.Schema(
+                            type=openapi.TYPE_OBJECT,
+                            properties={
+                                'rule_id': openapi.Schema(type=openapi.TYPE_INTEGER, description='ID of the rule'),
+                                'error': openapi.Schema(type=openapi.TYPE_STRING, description='Error while evaluating the rule.'),
+                            }
+                        ),
+                        description='Rules that could not be evaluated for the data.'
+                    ),
+                }
+            )
+        ),
+        400: openapi.Response('Bad Request', 
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='Error message')
+                }
+            )
+        ),
+        500: openapi.Response('Internal Server Error', 
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='Error while matching the rules.')
+                }
+            )
+        ),
+    }
+)
+@api_view(['POST'])
+def match_rules_view(request):
+    data = request.data.get('data', None)
+    rule_ids = request.data.get('rule_ids', None)
+    rule_name_prefix = request.data.get('rule_name_prefix', None)
+    match_all = request.data.get('all', False)
+
+    if not isinstance(data, dict):
+        return JsonResponse(
+            {'error': 'The data must be provided as an object.'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    # Exactly one way of selecting the rules must be used
+    if [rule_ids is not None, bool(rule_name_prefix), bool(match_all)].count(True) != 1:
+        return JsonResponse(
+            {'error': 'Must provide exactly one of rule_ids, rule_name_prefix or all.'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if rule_ids is not None and (not isinstance(rule_ids, list) or not all(isinstance(rule_id, int) for rule_id in rule_ids)):
+        return JsonResponse(
+            {'error': 'The rule_ids must be a list of integers.'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        matched_rule_ids, errors = match_rules(data, rule_ids=rule_ids, rule_name_prefix=rule_name_prefix)
+
+        return JsonResponse(
+            {'matched_rule_ids': matched_rule_ids, 'errors': errors},
+            status=status.HTTP_200_OK
+        )
+
+    except Exception as e:
+        return JsonResponse(
+            {'error': f'An unexpected error occurred: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+@swagger_auto_schema(
+    method='get',
+    responses={
+        200: openapi.Response('List of rules',
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'count': openapi.Schema(type=openapi.TYPE_INTEGER, description='Total number of rules'),
+                    'next': openapi.Schema(type=openapi.TYPE_STRING, description='URL to the next page of results'),
+                    'previous': openapi.Schema(type=openapi.TYPE_STRING, description='URL to the previous page of results'),
+                    'results': openapi.Schema(
+                        type=openapi.TYPE_ARRAY,
+                        items=openapi.Schema(
+                            type=openapi.TYPE_OBJECT,
+                            properties={
+                                'id': openapi.Schema(type=openapi.TYPE_INTEGER, description='ID of the rule'),
+                                'rule_name': openapi.Schema(type=openapi.TYPE_STRING, description='Name of the rule'),
+                                'rule_root': openapi.Schema(type=openapi.TYPE_INTEGER, description='ID of the root node of the rule tree'),
+                                'rule_tokens': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_STRING), description='The rule string (Tokenized Array)'),
+                                'program': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_STRING)), description='The rule tree as a postfix program of [node_type, value] pairs'),
+                            }
+                        )
+                    )
+                }
+            )
+        ),
+        400: openapi.Response('Bad Request', 
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='Error message')
+                }
+            )
+        ),
+        500: openapi.Response('Internal server error', 
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='Error message')
+                }
+            )
+        )
+    }
+)
+@api_view(['GET'])
+def get_rules(request):
+    paginator = PageNumberPagination()
+    paginator.page_size = 10
+    rules = Rule.objects.all().order_by('id')
+    paginated_rules = paginator.paginate_queryset(rules, request)
+    
+    serializer = RuleSerializer(paginated_rules, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+@swagger_auto_schema(
+    method='get',
+    manual_parameters=[
+        openapi.Parameter(
+            'rule_id', 
+            openapi.IN_PATH, 
+            description="ID of the rule to retrieve", 
+            type=openapi.TYPE_INTEGER
+        )
+    ],
+    responses={
+        200: openapi.Response('Rule details',
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'id': openapi.Schema(type=openapi.TYPE_INTEGER, description='ID of the rule'),
+                    'rule_name': openapi.Schema(type=openapi.TYPE_STRING, description='Name of the rule'),
+                    'rule_root': openapi.Schema(type=openapi.TYPE_INTEGER, description='ID of the root node of the rule tree'),
+                    'rule_tokens': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_STRING), description='The rule string (Tokenized Array)'),
+                    'program': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_STRING)), description='The rule tree as a postfix program of [node_type, value] pairs'),
+                }
+            )
+        ),
+        404: openapi.Response('Rule Not Found', 
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='No rule exists with the given id.')
+                }
+            )
+        ),
+        500: openapi.Response('Internal server error', 
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='Error message')
+                }
+            )
+        )
+    }
+)
+@api_view(['GET'])
+def get_rule_by_id(request, rule_id):
+    try:
+        rule = Rule.objects.get(id=rule_id)
+        serializer = RuleSerializer(rule)
+        return Response(serializer.data)
+    except Rule.DoesNotExist:
+        return Response({'error': 'Rule not found'}, status=404)
+
+@swagger_auto_schema(
+    method='post',
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        properties={
+            'new_rule_string': openapi.Schema(
+                type=openapi.TYPE_STRING, 
+                description='The rule string',
+                example="A > 10 AND color = yellow"
+            ),
+            'rule_id': openapi.Schema(
+                type=openapi.TYPE_STRING, 
+                description='The unique id of the rule',
+                example="2"
+            )
+        },
+    ),
+    responses={
+        201: openapi.Response('Rule Edited successfully', 
+                openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'result': openapi.Schema(type=openapi.TYPE_STRING, description='Rule edited successfully'),
                         'rule_id': openapi.Schema(type=openapi.TYPE_INTEGER, description='ID of the created rule'),
                         'rule_name': openapi.Schema(type=openapi.TYPE_STRING, description='Name of the created rule'),
                         'root_id': openapi.Schema(type=openapi.TYPE_INTEGER, description='ID of the root node of the rule tree'),
@@ -548,5 +1171,244 @@ def edit_rule_view(request):
         )
 
 
+# Async-native evaluation views for ASGI deployments. Cached rules are evaluated on the event
+# loop, only a cache miss awaits the database.
+
+def _parse_json_body(request):
+    try:
+        body = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) else None
+
+@csrf_exempt
+@require_POST
+async def evaluate_rule_async_view(request):
+    body = _parse_json_body(request)
+    if body is None:
+        return JsonResponse(
+            {'error': 'The request body must be a JSON object.'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    rule_id = body.get('rule_id', None)
+    rule_name = body.get('rule_name', None)
+    data = body.get('data', {})
+
+    if not rule_id and not rule_name:
+        return JsonResponse(
+            {'error': 'Must provide either rule_id or rule_name'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        compiled_rule = await aget_compiled_rule(rule_id=rule_id, rule_name=rule_name)
+        result = compiled_rule.evaluate(data)
+
+        return JsonResponse(
+            {'result': result if result is not None else False},
+            status=status.HTTP_200_OK
+        )
+
+    except Rule.DoesNotExist:
+        return JsonResponse(
+            {'error': 'Rule not found'}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    except RuntimeError as e:
+        return JsonResponse(
+            {'error': f'Runtime error occurred: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    except NotImplementedError as e:
+        return JsonResponse(
+            {'error': f'NotImplementedError: {str(e)}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except Exception as e:
+        return JsonResponse(
+            {'error': f'An unexpected error occurred: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+@csrf_exempt
+@require_POST
+async def evaluate_rule_batch_async_view(request):
+    body = _parse_json_body(request)
+    if body is None:
+        return JsonResponse(
+            {'error': 'The request body must be a JSON object.'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    rule_id = body.get('rule_id', None)
+    rule_name = body.get('rule_name', None)
+    records = body.get('records', None)
+
+    if not rule_id and not rule_name:
+        return JsonResponse(
+            {'error': 'Must provide either rule_id or rule_name'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if not isinstance(records, list):
+        return JsonResponse(
+            {'error': 'The records must be provided as a list.'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        compiled_rule = await aget_compiled_rule(rule_id=rule_id, rule_name=rule_name)
+        results = list(evaluate_records(compiled_rule.evaluate, records))
+
+        return JsonResponse(
+            {'results': results},
+            status=status.HTTP_200_OK
+        )
+
+    except Rule.DoesNotExist:
+        return JsonResponse(
+            {'error': 'Rule not found'}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    except Exception as e:
+        return JsonResponse(
+            {'error': f'An unexpected error occurred: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
 def home(req):
-    return render(req, 'index.html')
\ No newline at end of file
+    return render(req, 'index.html')
+
+@swagger_auto_schema(
+    method='get',
+    manual_parameters=[
+        openapi.Parameter(
+            'rule_id', 
+            openapi.IN_PATH, 
+            description="ID of the rule", 
+            type=openapi.TYPE_INTEGER
+        )
+    ],
+    responses={
+        200: openapi.Response('Versions of the rule, oldest first',
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'current_version': openapi.Schema(type=openapi.TYPE_INTEGER, description='The version the rule is at'),
+                    'versions': openapi.Schema(
+                        type=openapi.TYPE_ARRAY,
+                        items=openapi.Schema(
+                            type=openapi.TYPE_OBJECT,
+                            properties={
+                                'version': openapi.Schema(type=openapi.TYPE_INTEGER, description='Version number'),
+                                'rule_root_id': openapi.Schema(type=openapi.TYPE_INTEGER, description='ID of the root node of the version'),
+                                'rule_tokens': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_STRING), description='The rule string (Tokenized Array)'),
+                                'restored_from': openapi.Schema(type=openapi.TYPE_INTEGER, description='The version a rollback restored, if any'),
+                                'created_at': openapi.Schema(type=openapi.TYPE_STRING, description='When the version was recorded'),
+                            }
+                        )
+                    ),
+                }
+            )
+        ),
+        404: openapi.Response('Rule Not Found', 
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='No rule exists with the given id.')
+                }
+            )
+        ),
+    }
+)
+@api_view(['GET'])
+def get_rule_versions(request, rule_id):
+    try:
+        rule = Rule.objects.get(id=rule_id)
+    except Rule.DoesNotExist:
+        return JsonResponse({'error': 'Rule not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    versions = rule.versions.order_by('version').values('version', 'rule_root_id', 'rule_tokens', 'restored_from', 'created_at')
+    return JsonResponse(
+        {'current_version': rule.version, 'versions': list(versions)},
+        status=status.HTTP_200_OK
+    )
+
+@swagger_auto_schema(
+    method='post',
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        properties={
+            'rule_id': openapi.Schema(
+                type=openapi.TYPE_INTEGER, 
+                description='The unique id of the rule',
+                example=2
+            ),
+            'version': openapi.Schema(
+                type=openapi.TYPE_INTEGER, 
+                description='The version to restore',
+                example=1
+            )
+        },
+        required=['rule_id', 'version'],
+    ),
+    responses={
+        200: openapi.Response('Rule rolled back', 
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'rule_id': openapi.Schema(type=openapi.TYPE_INTEGER, description='ID of the rule'),
+                    'version': openapi.Schema(type=openapi.TYPE_INTEGER, description='The new current version of the rule'),
+                    'restored_from': openapi.Schema(type=openapi.TYPE_INTEGER, description='The version that was restored'),
+                    'rule_root_id': openapi.Schema(type=openapi.TYPE_INTEGER, description='ID of the root node of the rule tree'),
+                    'rule_tokens': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_STRING), description='The rule string (Tokenized Array)'),
+                }
+            )
+        ),
+        400: openapi.Response('Bad Request', 
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='Error message')
+                }
+            )
+        ),
+        404: openapi.Response('Rule Not Found', 
+            openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'error': openapi.Schema(type=openapi.TYPE_STRING, description='No rule exists with the given id.')
+                }
+            )
+        ),
+    }
+)
+@api_view(['POST'])
+def rollback_rule_view(request):
+    rule_id = request.data.get('rule_id', None)
+    version = request.data.get('version', None)
+
+    if not rule_id or not version:
+        return JsonResponse(
+            {'error': 'Must provide both rule_id and version.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        rule = rollback_rule(int(rule_id), int(version))
+        return JsonResponse(
+            {
+                'rule_id': rule.id,
+                'version': rule.version,
+                'restored_from': int(version),
+                'rule_root_id': rule.rule_root_id,
+                'rule_tokens': rule.rule_tokens
+            },
+            status=status.HTTP_200_OK
+        )
+    except Rule.DoesNotExist:
+        return JsonResponse({'error': 'Rule not found'}, status=status.HTTP_404_NOT_FOUND)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
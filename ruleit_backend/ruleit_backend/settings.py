@@ -133,3 +133,47 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Rule engine
+# Number of compiled rules kept in memory by every process
+
+RULEIT_COMPILED_RULE_CACHE_SIZE = 1024
+
+# Number of merged rule sets (used by /api/match-rules/) kept in memory by every process
+
+RULEIT_MERGED_RULE_SET_CACHE_SIZE = 32
+
+# Worker processes and records per chunk for parallel bulk evaluation, the CPU count is used when unset
+
+RULEIT_PARALLEL_WORKERS = None
+RULEIT_PARALLEL_CHUNK_SIZE = 1000
+
+# Reorder the operands of AND/OR chains in cached rules by their observed cost and selectivity,
+# timing one in every RULEIT_ADAPTIVE_SAMPLE_RATE evaluations and reordering every RULEIT_ADAPTIVE_REORDER_INTERVAL samples
+
+RULEIT_ADAPTIVE_ORDERING = True
+RULEIT_ADAPTIVE_SAMPLE_RATE = 16
+RULEIT_ADAPTIVE_REORDER_INTERVAL = 64
+
+# Cache the results of /api/evaluate-rule/ per rule version and values of the variables the rule reads,
+# holding at most RULEIT_RESULT_CACHE_SIZE results for RULEIT_RESULT_CACHE_TTL seconds each
+
+RULEIT_RESULT_CACHE = False
+RULEIT_RESULT_CACHE_SIZE = 10000
+RULEIT_RESULT_CACHE_TTL = 300
+
+# Rules prepared for delta evaluation, and evaluations kept for /api/evaluate-rule/delta/ (least recently used are evicted)
+
+RULEIT_DELTA_RULE_CACHE_SIZE = 256
+RULEIT_EVALUATION_STATE_CACHE_SIZE = 10000
+
+# Evict the cached rules of every process when a rule is changed elsewhere, through PostgreSQL LISTEN/NOTIFY.
+# Versions of the cached rules are polled every RULEIT_INVALIDATION_POLL_INTERVAL seconds while listening is not possible
+
+RULEIT_INVALIDATION_LISTENER = True
+RULEIT_INVALIDATION_POLL_INTERVAL = 5
+
+# Parsed rule strings kept so the same string is not tokenized and parsed again (least recently used are evicted)
+
+RULEIT_PARSE_CACHE_SIZE = 4096